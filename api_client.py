@@ -0,0 +1,77 @@
+import json
+
+import requests
+
+from config import TOP_K, API_CLIENT_TIMEOUT_S
+
+
+class ApiError(RuntimeError):
+    """服务端返回非 200（含 503 过载、504 超时）或流中出现 error 事件。"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RAGApiClient:
+    """server.py 的同步 HTTP 客户端，供 Streamlit 瘦客户端与压测脚本使用。"""
+
+    def __init__(self, base_url: str, timeout: float = API_CLIENT_TIMEOUT_S):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def _post(self, path, payload, **kwargs):
+        response = self._session.post(f"{self.base_url}{path}", json=payload,
+                                      timeout=self.timeout, **kwargs)
+        if response.status_code != 200:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            response.close()
+            raise ApiError(f"{path} failed with HTTP {response.status_code}: {detail}",
+                           response.status_code)
+        return response
+
+    def health(self) -> dict:
+        response = self._session.get(f"{self.base_url}/health", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def search(self, query: str, mode: str = "vector", top_k: int = TOP_K):
+        """Returns (docs, scores, timings)，与 retrieval 中各检索函数一致。"""
+        body = self._post("/search", {"query": query, "mode": mode, "top_k": top_k}).json()
+        return body["docs"], body["scores"], body["timings"]
+
+    def rerank(self, query: str, docs: list[dict]):
+        """Returns (docs, scores)，与 rerank_utils.rerank_with_scores 一致。"""
+        body = self._post("/rerank", {"query": query, "docs": docs}).json()
+        return body["docs"], body["scores"]
+
+    def answer_stream(self, query: str, docs: list[dict] = None, stats: dict = None,
+                      mode: str = "vector", top_k: int = TOP_K):
+        """
+        流式生成，逐段产出文本；结束时把服务端的生成统计写入 stats。
+        docs 为 None 时由服务端检索并 rerank，所用上下文写入 stats["context"]。
+        提前关闭生成器会断开连接，服务端随之停止生成。
+        """
+        stats = {} if stats is None else stats
+        response = self._post("/answer", {"query": query, "docs": docs, "mode": mode, "top_k": top_k},
+                              stream=True)
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+                kind = event.get("event")
+                if kind == "token":
+                    yield event["text"]
+                elif kind == "context":
+                    stats["context"] = event["docs"]
+                elif kind == "done":
+                    stats.update(event.get("stats", {}))
+                elif kind == "error":
+                    raise ApiError(event.get("detail", "answer failed"))
+        finally:
+            response.close()
@@ -1,7 +1,6 @@
 import streamlit as st
 import time
 import os
-from rerank_utils import load_reranker, rerank_documents
 
 # --- 新增：初始化对话历史 ---
 if "history" not in st.session_state:
@@ -15,18 +14,16 @@ os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
 os.environ['HF_HOME'] = './hf_cache'
 
 # Import functions and config from other modules
+# 模型 / Milvus 相关模块只在本地模式下导入，瘦客户端模式不加载 torch
 from config import (
     DATA_FILE, EMBEDDING_MODEL_NAME, GENERATION_MODEL_NAME, TOP_K,
     MAX_ARTICLES_TO_INDEX, MILVUS_LITE_DATA_PATH, COLLECTION_NAME,
-    id_to_doc_map
+    GENERATION_SCHEDULER_ENABLED, RAG_API_URL
 )
-from data_utils import load_data
-from models import load_embedding_model, load_generation_model
-from milvus_utils import (
-    get_milvus_client, setup_milvus_collection,
-    index_data_if_needed, search_similar_documents
-)
-from rag_core import generate_answer
+from api_client import RAGApiClient, ApiError
+
+# 侧边栏选项 -> server.py / retrieval 中的检索模式
+RETRIEVAL_MODES = {"向量检索": "vector", "图扩展检索": "graph", "混合检索": "hybrid"}
 
 # --- Streamlit UI 设置 ---
 st.set_page_config(layout="wide")
@@ -38,101 +35,195 @@ for turn in st.session_state.history:
     st.markdown(f"**用户：** {turn['user']}")
     st.markdown(f"**系统：** {turn['bot']}")
 
-# --- 初始化与缓存 ---
-milvus_client = get_milvus_client()
-
-if milvus_client:
-    collection_is_ready = setup_milvus_collection(milvus_client)
-    embedding_model = load_embedding_model(EMBEDDING_MODEL_NAME)
-    generation_model, tokenizer = load_generation_model(GENERATION_MODEL_NAME)
-    models_loaded = embedding_model and generation_model and tokenizer
-
-    if collection_is_ready and models_loaded:
-        raw = load_data(DATA_FILE)
-        indexing_successful = False
-        if raw:
-            indexing_successful = index_data_if_needed(
-                milvus_client, raw, embedding_model
-            )
-        else:
-            st.warning(f"无法从 {DATA_FILE} 加载数据。跳过索引。")
+def show_timings(timings):
+    st.caption(" | ".join(f"{k}: {v:.1f} ms" for k, v in timings.items()))
+
 
-        st.divider()
+def show_generation_stats(stats):
+    if "ttft_s" in stats:
+        st.caption(
+            f"首 token 延迟: {stats['ttft_s']:.2f} s | 生成 {stats['new_tokens']} tokens，"
+            f"{stats['tokens_per_s']:.1f} tokens/s"
+        )
 
-        # --- RAG 交互部分 ---
-        if not indexing_successful and not id_to_doc_map:
-            st.error("数据索引失败或不完整，且没有文档映射。RAG 功能已禁用。")
+
+def render_qa(retrieve, rerank, answer_stream):
+    """
+    问答交互界面。本地模式与瘦客户端模式只在三个回调的实现上不同：
+      - retrieve(query) -> (docs, scores, timings)
+      - rerank(query, docs) -> (docs, scores)
+      - answer_stream(query, docs, stats) -> 文本片段的生成器
+    """
+    query = st.text_input("请提出关于已索引医疗文章的问题:", key="query_input")
+
+    if st.button("获取答案", key="submit_button") and query:
+        start_time = time.time()
+
+        # —— 第一次检索 & Re-ranking —— 
+        with st.spinner("正在搜索相关文档..."):
+            docs, retrieval_scores, timings = retrieve(query)
+        if not docs:
+            st.warning("在数据库中找不到相关文档。")
         else:
-            query = st.text_input("请提出关于已索引医疗文章的问题:", key="query_input")
+            show_timings(timings)
+            score_by_id = {doc['id']: s for doc, s in zip(docs, retrieval_scores)}
+            docs, scores = rerank(query, docs)
+
+              # —— 新增：可视化 Re-ranking 结果 —— 
+            import pandas as pd
+            df = pd.DataFrame({
+                "doc_id": [doc["id"] for doc in docs],
+                "title": [doc["title"] for doc in docs],
+                "retrieval_score": [score_by_id[doc["id"]] for doc in docs],
+                "rerank_score": scores
+            }).sort_values("rerank_score", ascending=False).reset_index(drop=True)
+            # 使用 Streamlit 自带表格展示
+            st.subheader("Re-ranking 结果")
+            st.dataframe(df)  # 或者 st.table(df)
+            # 图扩展 / 混合检索会带来更多候选，rerank 后只取 TOP_K 作为生成上下文
+            docs = docs[:TOP_K]
+
+            # —— 流式生成答案并展示 —— 
+            st.subheader("系统回答：")
+            gen_stats = {}
+            answer = st.write_stream(answer_stream(query, docs, gen_stats)).strip()
+            show_generation_stats(gen_stats)
+
+            # —— 保存至历史 —— 
+            st.session_state.history.append({"user": query, "bot": answer})
+
+            # —— 新增：迭代检索按钮 —— 
+            if st.button("基于上次结果再检索", key="refine_button"):
+                refined_q = refine_query(query, answer)
+                with st.spinner("基于上次结果优化检索..."):
+                    docs2, _, timings2 = retrieve(refined_q)
+                show_timings(timings2)
+                docs2 = rerank(refined_q, docs2)[0][:TOP_K]
+
+                st.subheader("优化检索的上下文：")
+                for i, doc in enumerate(docs2):
+                    st.markdown(f"- **文档 {i+1}:** {doc['title']}")
+
+                st.subheader("优化后的回答：")
+                gen_stats2 = {}
+                answer2 = st.write_stream(answer_stream(refined_q, docs2, gen_stats2)).strip()
+                show_generation_stats(gen_stats2)
+                st.session_state.history.append({"user": refined_q, "bot": answer2})
+
+        end_time = time.time()
+        st.info(f"总耗时: {end_time - start_time:.2f} 秒")
+
+
+@st.cache_resource
+def get_api_client():
+    return RAGApiClient(RAG_API_URL)
 
-            if st.button("获取答案", key="submit_button") and query:
-                start_time = time.time()
 
-                # —— 第一次检索 & Re-ranking —— 
-                with st.spinner("正在搜索相关文档..."):
-                    ids, dists = search_similar_documents(
-                        milvus_client, query, embedding_model
+scheduler = None
+
+if RAG_API_URL:
+    # --- 瘦客户端模式：检索 / rerank / 生成都由 server.py 完成 ---
+    api = get_api_client()
+    mode = RETRIEVAL_MODES[st.sidebar.radio("检索模式", list(RETRIEVAL_MODES), key="retrieval_mode")]
+    try:
+        render_qa(
+            lambda q: api.search(q, mode),
+            api.rerank,
+            lambda q, docs, stats: api.answer_stream(q, docs, stats)
+        )
+    except ApiError as e:
+        st.error(f"RAG 服务请求失败：{e}")
+    except Exception as e:
+        st.error(f"无法连接 RAG 服务 {RAG_API_URL}：{e}")
+else:
+    from data_utils import load_data
+    from doc_store import get_doc_store
+    from models import load_embedding_model, load_generation_model, is_torch_model
+    from milvus_utils import (
+        get_milvus_client, setup_milvus_collection,
+        index_data_if_needed, index_is_up_to_date, mark_index_synced
+    )
+    from graph_utils import load_or_build_graph
+    from retrieval import vector_search, graph_augmented_search, hybrid_search
+    from lexical_index import load_or_build_lexical_index
+    from query_cache import get_index_version
+    from rerank_utils import load_reranker, rerank_with_scores
+    from rag_core import generate_answer_stream
+    from generation_server import get_generation_scheduler
+
+    # --- 初始化与缓存 ---
+    milvus_client = get_milvus_client()
+
+    if milvus_client:
+        collection_is_ready = setup_milvus_collection(milvus_client)
+        embedding_model = load_embedding_model(EMBEDDING_MODEL_NAME)
+        generation_model, tokenizer = load_generation_model(GENERATION_MODEL_NAME)
+        models_loaded = embedding_model and generation_model and tokenizer
+        # 所有会话共享一个调度器，并发请求在 decode 阶段连续合批（ONNX 后端直接调用 generate）
+        scheduler = (get_generation_scheduler(generation_model, tokenizer)
+                     if models_loaded and GENERATION_SCHEDULER_ENABLED and is_torch_model(generation_model)
+                     else None)
+
+        if collection_is_ready and models_loaded:
+            doc_store = get_doc_store()
+            indexing_successful = False
+            if index_is_up_to_date(milvus_client, DATA_FILE):
+                # 数据文件未变化且索引完整：直接使用 doc store，无需加载整个语料
+                st.write(f"索引已是最新（{len(doc_store)} 个文本块），跳过数据加载。")
+                indexing_successful = True
+            else:
+                raw = load_data(DATA_FILE)
+                if raw:
+                    indexing_successful = index_data_if_needed(
+                        milvus_client, raw, embedding_model
                     )
-                if not ids:
-                    st.warning("在数据库中找不到相关文档。")
+                    if indexing_successful:
+                        mark_index_synced(DATA_FILE)
                 else:
-                    docs = [id_to_doc_map[_id] for _id in ids if _id in id_to_doc_map]
-                    reranker = load_reranker()
-                    docs = rerank_documents(query, docs, reranker)
-
-                      # —— 新增：可视化 Re-ranking 结果 —— 
-                    import pandas as pd
-                    # 重新计算 scores（与 rerank_documents 内部一致）
-                    pairs = [(query, doc["abstract"]) for doc in docs]
-                    scores = reranker.predict(pairs)
-                    df = pd.DataFrame({
-                        "doc_id": ids,
-                        "title": [doc["title"] for doc in docs],
-                        "distance": dists,
-                        "rerank_score": scores
-                    }).sort_values("rerank_score", ascending=False).reset_index(drop=True)
-                    # 使用 Streamlit 自带表格展示
-                    st.subheader("Re-ranking 结果")
-                    st.dataframe(df)  # 或者 st.table(df)
-
-                    # —— 生成答案 —— 
-                    with st.spinner("正在根据上下文生成答案..."):
-                        answer = generate_answer(query, docs, generation_model, tokenizer)
-
-                    # —— 展示结果 & 保存至历史 —— 
-                    st.subheader("系统回答：")
-                    st.write(answer)
-                    st.session_state.history.append({"user": query, "bot": answer})
-
-                    # —— 新增：迭代检索按钮 —— 
-                    if st.button("基于上次结果再检索", key="refine_button"):
-                        refined_q = refine_query(query, answer)
-                        with st.spinner("基于上次结果优化检索..."):
-                            ids2, dists2 = search_similar_documents(
-                                milvus_client, refined_q, embedding_model
-                            )
-                        docs2 = [id_to_doc_map[_id] for _id in ids2 if _id in id_to_doc_map]
-                        docs2 = rerank_documents(refined_q, docs2, reranker)
-
-                        st.subheader("优化检索的上下文：")
-                        for i, doc in enumerate(docs2):
-                            st.markdown(f"- **文档 {i+1}:** {doc['title']}")
-
-                        with st.spinner("生成优化后的答案..."):
-                            answer2 = generate_answer(
-                                refined_q, docs2, generation_model, tokenizer
-                            )
-                        st.subheader("优化后的回答：")
-                        st.write(answer2)
-                        st.session_state.history.append({"user": refined_q, "bot": answer2})
-
-                end_time = time.time()
-                st.info(f"总耗时: {end_time - start_time:.2f} 秒")
+                    st.warning(f"无法从 {DATA_FILE} 加载数据。跳过索引。")
+                del raw
+
+            st.divider()
+
+            # --- RAG 交互部分 ---
+            if not indexing_successful and len(doc_store) == 0:
+                st.error("数据索引失败或不完整，且没有文档映射。RAG 功能已禁用。")
+            else:
+                retrieval_mode = RETRIEVAL_MODES[st.sidebar.radio(
+                    "检索模式", list(RETRIEVAL_MODES), key="retrieval_mode"
+                )]
+                graph = None
+                lexical_index = None
+                if retrieval_mode == "graph":
+                    graph = load_or_build_graph(doc_store, embedding_model, get_index_version())
+                elif retrieval_mode == "hybrid":
+                    lexical_index = load_or_build_lexical_index(doc_store, get_index_version())
+
+                def retrieve(q):
+                    """按所选模式检索，返回 (docs, scores, 各阶段耗时)。"""
+                    if graph is not None:
+                        return graph_augmented_search(
+                            milvus_client, q, embedding_model, doc_store, graph
+                        )
+                    if lexical_index is not None:
+                        return hybrid_search(
+                            milvus_client, q, embedding_model, doc_store, lexical_index
+                        )
+                    return vector_search(milvus_client, q, embedding_model, doc_store)
 
+                reranker = load_reranker()
+                render_qa(
+                    retrieve,
+                    lambda q, docs: rerank_with_scores(q, docs, reranker),
+                    lambda q, docs, stats: generate_answer_stream(
+                        q, docs, generation_model, tokenizer, stats=stats, scheduler=scheduler
+                    )
+                )
+
+        else:
+            st.error("加载模型或设置 Milvus Lite collection 失败。请检查日志和配置。")
     else:
-        st.error("加载模型或设置 Milvus Lite collection 失败。请检查日志和配置。")
-else:
-    st.error("初始化 Milvus Lite 客户端失败。请检查日志。")
+        st.error("初始化 Milvus Lite 客户端失败。请检查日志。")
 
 # --- 页脚/信息侧边栏 ---
 st.sidebar.header("系统配置")
@@ -142,5 +233,42 @@ st.sidebar.markdown(f"**Collection:** `{COLLECTION_NAME}`")
 st.sidebar.markdown(f"**数据文件:** `{DATA_FILE}`")
 st.sidebar.markdown(f"**嵌入模型:** `{EMBEDDING_MODEL_NAME}`")
 st.sidebar.markdown(f"**生成模型:** `{GENERATION_MODEL_NAME}`")
-st.sidebar.markdown(f"**最大索引数:** `{MAX_ARTICLES_TO_INDEX}`")
+st.sidebar.markdown(f"**最大索引数:** `{MAX_ARTICLES_TO_INDEX or '全部'}`")
 st.sidebar.markdown(f"**检索 Top K:** `{TOP_K}`")
+
+# --- 生成调度器 / 查询缓存状态：瘦客户端模式下取自服务端 /health ---
+_gen, _stats = None, None
+if RAG_API_URL:
+    st.sidebar.markdown(f"**RAG 服务:** `{RAG_API_URL}`")
+    try:
+        _health = get_api_client().health()
+        _gen, _stats = _health["scheduler"], _health["caches"]
+    except Exception as e:
+        st.sidebar.warning(f"无法获取服务状态：{e}")
+else:
+    from query_cache import cache_stats
+    _gen = scheduler.stats() if scheduler is not None else None
+    _stats = cache_stats()
+
+if _gen is not None:
+    st.sidebar.header("生成调度器")
+    st.sidebar.markdown(
+        f"**排队:** {_gen['queue_depth']} | **进行中:** {_gen['active']} | **已完成:** {_gen['completed']}"
+    )
+    if _gen["total_p50_s"] is not None:
+        # 全部请求都在 prefill 中被取消时没有首 token 耗时，对应的值为 None
+        _fmt = lambda v: "-" if v is None else f"{v:.2f}"
+        st.sidebar.markdown(
+            f"**首 token p50/p95:** {_fmt(_gen['ttft_p50_s'])}/{_fmt(_gen['ttft_p95_s'])} s，"
+            f"**总耗时 p50/p95:** {_fmt(_gen['total_p50_s'])}/{_fmt(_gen['total_p95_s'])} s"
+        )
+
+# --- 查询缓存命中情况（用于评估缓存容量） ---
+if _stats is not None:
+    st.sidebar.header("查询缓存")
+    for _name, _label in (("query_embedding", "查询向量"), ("search_result", "检索结果")):
+        _s = _stats[_name]
+        st.sidebar.markdown(
+            f"**{_label}:** {_s['size']}/{_s['max_entries']} 条，"
+            f"命中 {_s['hits']} / 未命中 {_s['misses']}（{_s['hit_rate']:.0%}）"
+        )
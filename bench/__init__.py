@@ -0,0 +1,6 @@
+"""
+离线基准测试：合成中英文 HTML 语料 + 随机初始化的小模型，无需下载即可跑通完整流水线。
+  python -m bench.run_bench --docs 500 --queries 200 --output bench_result.json
+  python -m bench.run_bench --baseline bench/baseline.json       # 与基线对比，退化时返回非 0
+  python -m bench.compare bench_result.json bench/baseline.json
+"""
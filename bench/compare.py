@@ -0,0 +1,73 @@
+"""
+对比两次基准测试结果：延迟 / 内存升高或吞吐下降超过容忍度即视为退化。
+用法：python -m bench.compare current.json baseline.json [--tolerance 0.2]
+"""
+import argparse
+import json
+import sys
+
+# 指标 -> (数值越大越好?, 判定退化所需的最小绝对变化量；过滤亚毫秒级抖动)
+METRICS = {
+    "p50_ms": (False, 0.5),
+    "p95_ms": (False, 1.0),
+    "p99_ms": (False, 2.0),
+    "throughput_per_s": (True, 0.0),
+    "peak_rss_mb": (False, 20.0),
+}
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.2):
+    """
+    逐阶段、逐指标比较。
+    Returns:
+      - [{"stage", "metric", "baseline", "current", "change", "regression"}]，
+        change 为相对变化（正数表示变差）
+    """
+    rows = []
+    for stage, base in baseline.get("stages", {}).items():
+        cur = current.get("stages", {}).get(stage)
+        if cur is None:
+            continue
+        for metric, (higher_is_better, min_delta) in METRICS.items():
+            b, c = base.get(metric), cur.get(metric)
+            if b is None or c is None or b == 0:
+                continue
+            worse_by = (b - c) if higher_is_better else (c - b)
+            change = worse_by / abs(b)
+            rows.append({
+                "stage": stage, "metric": metric, "baseline": b, "current": c,
+                "change": round(change, 4),
+                "regression": change > tolerance and worse_by > min_delta,
+            })
+    return rows
+
+
+def format_rows(rows):
+    lines = [f"{'stage':<14} {'metric':<17} {'baseline':>12} {'current':>12} {'change':>9}"]
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        lines.append(f"{row['stage']:<14} {row['metric']:<17} {row['baseline']:>12.3f} "
+                     f"{row['current']:>12.3f} {row['change']:>+8.1%}{flag}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare a benchmark result against a baseline.")
+    parser.add_argument("current")
+    parser.add_argument("baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative slowdown allowed before a metric counts as a regression")
+    args = parser.parse_args(argv)
+    with open(args.current, "r", encoding="utf-8") as f:
+        current = json.load(f)
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline, args.tolerance)
+    print(format_rows(rows))
+    regressions = [r for r in rows if r["regression"]]
+    print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+合成的中英文医疗科普 HTML 语料，结构与 preprocess.py 面向的公众号文章一致
+（<title> + rich_media_content / article / main / body 正文），并附带带相关性标注的查询集。
+每篇文章围绕一个主题（药物或疾病）；查询的相关文档即同主题的全部文章。
+"""
+import argparse
+import json
+import os
+import random
+
+# (中文名, 英文名)
+TOPICS = [
+    ("阿莫西林", "amoxicillin"), ("布洛芬", "ibuprofen"), ("阿司匹林", "aspirin"),
+    ("二甲双胍", "metformin"), ("胰岛素", "insulin"), ("氨氯地平", "amlodipine"),
+    ("阿托伐他汀", "atorvastatin"), ("奥美拉唑", "omeprazole"), ("头孢克肟", "cefixime"),
+    ("对乙酰氨基酚", "acetaminophen"), ("华法林", "warfarin"), ("左氧氟沙星", "levofloxacin"),
+    ("氯雷他定", "loratadine"), ("沙丁胺醇", "salbutamol"), ("甲状腺素", "levothyroxine"),
+    ("高血压", "hypertension"), ("糖尿病", "diabetes"), ("冠心病", "coronary heart disease"),
+    ("哮喘", "asthma"), ("肺炎", "pneumonia"), ("胃溃疡", "gastric ulcer"),
+    ("痛风", "gout"), ("骨质疏松", "osteoporosis"), ("偏头痛", "migraine"),
+    ("甲状腺功能减退", "hypothyroidism"), ("缺铁性贫血", "iron deficiency anemia"),
+    ("流感", "influenza"), ("带状疱疹", "shingles"), ("湿疹", "eczema"),
+    ("慢性肾病", "chronic kidney disease"), ("脂肪肝", "fatty liver disease"),
+    ("抑郁症", "depression"), ("失眠", "insomnia"), ("过敏性鼻炎", "allergic rhinitis"),
+    ("类风湿关节炎", "rheumatoid arthritis"), ("乙型肝炎", "hepatitis B"),
+    ("幽门螺杆菌感染", "Helicobacter pylori infection"), ("心房颤动", "atrial fibrillation"),
+    ("帕金森病", "Parkinson's disease"), ("阿尔茨海默病", "Alzheimer's disease"),
+]
+
+_ZH = {
+    "symptoms": ["头痛", "恶心", "皮疹", "乏力", "腹泻", "咳嗽", "发热", "胸闷", "头晕", "关节疼痛", "食欲下降"],
+    "groups": ["老年人", "孕妇", "儿童", "肝功能不全者", "肾功能不全者", "哺乳期女性", "长期饮酒者"],
+    "organs": ["肝脏", "肾脏", "心脏", "胃肠道", "肺部", "皮肤", "神经系统"],
+    "sentences": [
+        "{t}是临床上常见的话题，约有{n}%的患者在初次就诊时对其了解不足。",
+        "使用{t}相关治疗时，{g}需要在医生指导下调整剂量，常用剂量为每次{d}毫克。",
+        "部分患者会出现{s}和{s2}等不适，通常在{n2}天内逐渐缓解。",
+        "{t}可能影响{o}功能，建议每{n2}周复查一次相关指标。",
+        "研究显示，规范管理{t}可以使并发症风险降低约{n}%。",
+        "如果出现持续的{s}，应及时就医，不要自行停药或加量。",
+        "{g}在面对{t}时更需谨慎，必要时应进行{o}相关检查。",
+        "饮食方面，控制盐分摄入、规律作息对{t}的长期管理非常重要。",
+        "与其他药物合用时需注意相互作用，尤其是作用于{o}的药物。",
+        "一项纳入{n3}名受试者的研究发现，{t}相关的{s}发生率约为{n}%。",
+    ],
+    "titles": ["{t}的用药指南", "关于{t}，你需要知道的{n2}件事", "{t}：常见问题解答", "医生解读{t}", "{t}的预防与治疗"],
+    "queries": [
+        "{t}有哪些常见副作用？", "{t}的常用剂量是多少？", "{g}可以使用{t}吗？", "{t}会影响{o}吗？",
+        "出现{s}和{t}有关吗？", "如何长期管理{t}？", "{t}需要多久复查一次？", "{t}与其他药物合用要注意什么？",
+    ],
+}
+
+_EN = {
+    "symptoms": ["headache", "nausea", "rash", "fatigue", "diarrhea", "cough", "fever", "chest tightness",
+                 "dizziness", "joint pain", "loss of appetite"],
+    "groups": ["older adults", "pregnant women", "children", "patients with liver disease",
+               "patients with kidney disease", "breastfeeding mothers", "heavy drinkers"],
+    "organs": ["liver", "kidneys", "heart", "digestive tract", "lungs", "skin", "nervous system"],
+    "sentences": [
+        "{T} is a common concern in primary care, and about {n}% of patients know little about it at their first visit.",
+        "When treatment involves {t}, {g} should adjust the dose under medical supervision; a typical dose is {d} mg.",
+        "Some patients report {s} and {s2}, which usually resolve within {n2} days.",
+        "{T} may affect the {o}, so follow-up tests every {n2} weeks are recommended.",
+        "Studies show that well-managed {t} lowers the risk of complications by roughly {n}%.",
+        "Persistent {s} should prompt a visit to a doctor rather than stopping or doubling the medication.",
+        "{G} need extra caution with {t} and may require {o} function tests.",
+        "Limiting salt, sleeping regularly and staying active all help with the long-term management of {t}.",
+        "Drug interactions matter, especially with medicines that act on the {o}.",
+        "A study of {n3} participants found that {s} related to {t} occurred in about {n}% of cases.",
+    ],
+    "titles": ["{T}: a practical guide", "{n2} things to know about {t}", "{T} FAQ", "A doctor explains {t}",
+               "Preventing and treating {t}"],
+    "queries": [
+        "What are the common side effects of {t}?", "What is the usual dose of {t}?", "Can {g} take {t}?",
+        "Does {t} affect the {o}?", "Is {s} related to {t}?", "How is {t} managed long term?",
+        "How often should {t} be checked?", "What should I watch for when combining {t} with other drugs?",
+    ],
+}
+
+_LAYOUTS = [
+    '<div class="rich_media_content" id="js_content">{body}</div>',
+    '<article>{body}</article>',
+    '<main>{body}</main>',
+    '{body}',
+]
+
+
+def _fill(template, rng, vocab, topic):
+    t = topic
+    return template.format(
+        t=t, T=t[:1].upper() + t[1:], s=rng.choice(vocab["symptoms"]), s2=rng.choice(vocab["symptoms"]),
+        g=rng.choice(vocab["groups"]), G=rng.choice(vocab["groups"]).capitalize(),
+        o=rng.choice(vocab["organs"]), n=rng.randint(3, 95), n2=rng.randint(2, 12),
+        n3=rng.randint(100, 20000), d=rng.choice([5, 10, 20, 50, 100, 250, 500]),
+    )
+
+
+def make_article(rng, topic_idx, lang, paragraphs):
+    """Returns (title, [段落])。"""
+    vocab = _ZH if lang == "zh" else _EN
+    topic = TOPICS[topic_idx][0 if lang == "zh" else 1]
+    title = _fill(rng.choice(vocab["titles"]), rng, vocab, topic)
+    sep = "" if lang == "zh" else " "
+    paras = [
+        sep.join(_fill(rng.choice(vocab["sentences"]), rng, vocab, topic) for _ in range(rng.randint(4, 8)))
+        for _ in range(paragraphs)
+    ]
+    return title, paras
+
+
+def render_html(title, paragraphs, layout):
+    body = "".join(f"<p>{p}</p>\n" for p in paragraphs) + "<p>阅读原文</p>"
+    return (f"<html><head><meta charset=\"utf-8\"><title>{title}</title></head>"
+            f"<body>{_LAYOUTS[layout].format(body=body)}</body></html>")
+
+
+def generate_corpus(out_dir, n_docs, zh_ratio=0.5, min_paragraphs=3, max_paragraphs=8, seed=0):
+    """
+    在 out_dir 下生成 n_docs 个 HTML 文件。
+    Returns:
+      - {文件名: {"topic": 主题下标, "lang": "zh" | "en"}}，同时写入 out_dir/corpus.json
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {}
+    for i in range(n_docs):
+        lang = "zh" if rng.random() < zh_ratio else "en"
+        topic_idx = rng.randrange(len(TOPICS))
+        title, paras = make_article(rng, topic_idx, lang, rng.randint(min_paragraphs, max_paragraphs))
+        filename = f"doc_{i:06d}.html"
+        with open(os.path.join(out_dir, filename), "w", encoding="utf-8") as f:
+            f.write(render_html(title, paras, rng.randrange(len(_LAYOUTS))))
+        manifest[filename] = {"topic": topic_idx, "lang": lang}
+    with open(os.path.join(out_dir, "corpus.json"), "w", encoding="utf-8") as f:
+        json.dump({"n_docs": n_docs, "zh_ratio": zh_ratio, "seed": seed,
+                   "paragraphs": [min_paragraphs, max_paragraphs], "files": manifest}, f)
+    return manifest
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, "corpus.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def generate_queries(manifest, n_queries, zh_ratio=0.5, seed=0):
+    """
+    生成互不重复的查询（避免查询缓存命中影响延迟统计），只取语料中出现过的主题。
+    Returns:
+      - [{"query", "lang", "topic", "relevant_files"}]
+    """
+    rng = random.Random(seed + 1)
+    files_by_topic = {}
+    for filename, info in sorted(manifest.items()):
+        files_by_topic.setdefault(info["topic"], []).append(filename)
+    topics = sorted(files_by_topic)
+    queries, seen = [], set()
+    for _ in range(n_queries * 20):
+        if len(queries) >= n_queries or not topics:
+            break
+        lang = "zh" if rng.random() < zh_ratio else "en"
+        vocab = _ZH if lang == "zh" else _EN
+        topic_idx = rng.choice(topics)
+        query = _fill(rng.choice(vocab["queries"]), rng, vocab, TOPICS[topic_idx][0 if lang == "zh" else 1])
+        if query in seen:
+            continue
+        seen.add(query)
+        queries.append({"query": query, "lang": lang, "topic": topic_idx,
+                        "relevant_files": files_by_topic[topic_idx]})
+    return queries
+
+
+def ensure_corpus(out_dir, n_docs, zh_ratio=0.5, seed=0):
+    """参数与已有语料一致时直接复用，否则重新生成。Returns manifest["files"]。"""
+    existing = load_manifest(out_dir)
+    if existing and existing["n_docs"] == n_docs and existing["zh_ratio"] == zh_ratio \
+            and existing["seed"] == seed:
+        return existing["files"]
+    if os.path.isdir(out_dir):
+        for name in os.listdir(out_dir):
+            if name.endswith(".html"):
+                os.remove(os.path.join(out_dir, name))
+    return generate_corpus(out_dir, n_docs, zh_ratio=zh_ratio, seed=seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic zh/en medical HTML corpus.")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--zh-ratio", type=float, default=0.5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    manifest = generate_corpus(args.output_dir, args.docs, args.zh_ratio, seed=args.seed)
+    with open(os.path.join(args.output_dir, "queries.jsonl"), "w", encoding="utf-8") as f:
+        for q in generate_queries(manifest, args.queries, args.zh_ratio, args.seed):
+            f.write(json.dumps(q, ensure_ascii=False) + "\n")
+    print(f"Wrote {len(manifest)} HTML files and queries.jsonl to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
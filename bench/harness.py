@@ -0,0 +1,181 @@
+"""
+基准测试的公共部分：把 config 指向独立的工作目录与本地模型、按阶段采集延迟 / 吞吐 / 峰值 RSS。
+流水线模块在导入时从 config 读取常量，因此 configure() 必须在导入它们之前调用。
+"""
+import os
+import resource
+import threading
+import time
+
+import numpy as np
+
+
+def configure(workdir, embedding_model, reranker_model, generation_model, embedding_dim,
+              backend=None, max_new_tokens=None):
+    """把所有持久化路径指向 workdir，并切换到给定的本地模型；禁止访问 Hugging Face Hub。"""
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    import config
+
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    overrides = {
+        "MILVUS_LITE_DATA_PATH": os.path.join(workdir, "milvus_lite_data.db"),
+        "DATA_FILE": os.path.join(data_dir, "processed_data.jsonl"),
+        "DOC_STORE_PATH": os.path.join(data_dir, "doc_store.sqlite3"),
+        "EMBEDDING_CACHE_DIR": os.path.join(data_dir, "embedding_cache"),
+        "INDEX_PROFILE_PATH": os.path.join(data_dir, "index_profile.json"),
+        "GRAPH_PATH": os.path.join(data_dir, "similarity_graph"),
+        "LEXICAL_INDEX_PATH": os.path.join(data_dir, "lexical_index"),
+        "NEAR_DUP_INDEX_PATH": os.path.join(data_dir, "near_dup.sqlite3"),
+        "EMBEDDING_MODEL_NAME": embedding_model,
+        "RERANK_MODEL_NAME": reranker_model,
+        "GENERATION_MODEL_NAME": generation_model,
+        "EMBEDDING_DIM": embedding_dim,
+        "MAX_ARTICLES_TO_INDEX": 10 ** 9,
+    }
+    if backend:
+        overrides.update(EMBEDDING_BACKEND=backend, RERANK_BACKEND=backend, GENERATION_BACKEND=backend)
+    if max_new_tokens:
+        overrides["MAX_NEW_TOKENS_GEN"] = max_new_tokens
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return overrides
+
+
+def reset_state(workdir):
+    """删除上一次运行留下的索引状态（Milvus 数据、doc store、各类缓存），保证每次从冷启动测起。"""
+    import shutil
+    data_dir = os.path.join(workdir, "data")
+    for name in ("doc_store.sqlite3", "doc_store.sqlite3-wal", "doc_store.sqlite3-shm", "index_profile.json",
+                 "near_dup.sqlite3", "near_dup.sqlite3-wal", "near_dup.sqlite3-shm"):
+        path = os.path.join(data_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+    for name in ("embedding_cache", "similarity_graph", "lexical_index"):
+        shutil.rmtree(os.path.join(data_dir, name), ignore_errors=True)
+    db = os.path.join(workdir, "milvus_lite_data.db")
+    if os.path.isdir(db):
+        shutil.rmtree(db, ignore_errors=True)
+    elif os.path.exists(db):
+        os.remove(db)
+
+
+def current_rss_bytes():
+    """当前常驻内存；没有 /proc 时退回进程生命周期内的峰值。"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def children_rss_bytes():
+    """
+    子进程（如 preprocess 的解析进程）的常驻内存之和；
+    psutil 为可选依赖，未安装时返回 None。
+    """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    total = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+class RssSampler:
+    """后台线程按固定间隔采样 RSS，记录 with 块内本进程与子进程各自的峰值。"""
+
+    def __init__(self, interval_s=0.005):
+        self.interval_s = interval_s
+        self.start_bytes = 0
+        self.peak_bytes = 0
+        self.end_bytes = 0
+        self.children_peak_bytes = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample_children(self):
+        children = children_rss_bytes()
+        if children is not None:
+            self.children_peak_bytes = max(self.children_peak_bytes or 0, children)
+
+    def _run(self):
+        ticks = 0
+        while not self._stop.wait(self.interval_s):
+            self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+            ticks += 1
+            if ticks % 10 == 0:  # 遍历子进程较慢，降低频率
+                self._sample_children()
+
+    def __enter__(self):
+        self.start_bytes = self.peak_bytes = current_rss_bytes()
+        self.children_peak_bytes = None
+        self._sample_children()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.end_bytes = current_rss_bytes()
+        self.peak_bytes = max(self.peak_bytes, self.end_bytes)
+        self._sample_children()
+
+
+class Stage:
+    """一个阶段：逐项记录延迟（可选），结束时汇总为 JSON 友好的 dict。"""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.items = 0
+        self.extra = {}
+        self.wall_s = 0.0
+        self.rss = RssSampler()
+        self._start = None
+
+    def __enter__(self):
+        self.rss.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_s = time.perf_counter() - self._start
+        self.rss.__exit__(*exc)
+
+    def timed(self, fn, *args, **kwargs):
+        """执行一次 fn 并记录其延迟，返回 fn 的结果。"""
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.latencies.append(time.perf_counter() - start)
+        self.items += 1
+        return result
+
+    def summary(self):
+        mb = 1024.0 * 1024.0
+        result = {
+            "items": self.items,
+            "wall_s": round(self.wall_s, 4),
+            "throughput_per_s": round(self.items / self.wall_s, 3) if self.wall_s > 0 else None,
+            "peak_rss_mb": round(self.rss.peak_bytes / mb, 1),
+            "rss_delta_mb": round((self.rss.end_bytes - self.rss.start_bytes) / mb, 1),
+        }
+        if self.rss.children_peak_bytes is not None:
+            result["children_peak_rss_mb"] = round(self.rss.children_peak_bytes / mb, 1)
+        if self.latencies:
+            ms = np.asarray(self.latencies) * 1000.0
+            result.update({
+                "mean_ms": round(float(ms.mean()), 3),
+                **{f"p{q}_ms": round(float(np.percentile(ms, q)), 3) for q in (50, 95, 99)},
+                "max_ms": round(float(ms.max()), 3),
+            })
+        result.update(self.extra)
+        return result
@@ -0,0 +1,216 @@
+"""
+端到端离线基准：合成语料 -> preprocess -> index_data_if_needed -> search_similar_documents
+-> rerank_documents -> generate_answer，逐阶段报告吞吐、p50/p95/p99 延迟与峰值 RSS（JSON）。
+默认使用随机初始化的小模型（bench/tiny_models.py），全程不访问 Hugging Face Hub；
+也可以用 --embedding-model 等参数指定本地真实模型。
+每次运行都会清空工作目录中的索引状态，语料与小模型在参数不变时复用。
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from bench.corpus import ensure_corpus, generate_queries
+from bench.compare import compare, format_rows
+from bench.harness import configure, reset_state, Stage
+
+DEFAULT_WORKDIR = "./bench_work"
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=10, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    workdir = os.path.abspath(args.workdir)
+    model_dir = os.path.join(workdir, "models")
+    if args.embedding_model:
+        models = {"embedding": args.embedding_model, "reranker": args.reranker_model,
+                  "generator": args.generation_model, "embedding_dim": args.embedding_dim}
+    else:
+        models = {name: os.path.join(model_dir, name) for name in ("embedding", "reranker", "generator")}
+        models["embedding_dim"] = args.hidden_size
+    overrides = configure(workdir, models["embedding"], models["reranker"], models["generator"],
+                          models["embedding_dim"], backend=args.backend, max_new_tokens=args.max_new_tokens)
+    reset_state(workdir)
+
+    html_dir = os.path.join(workdir, "html")
+    manifest = ensure_corpus(html_dir, args.docs, args.zh_ratio, seed=args.seed)
+    queries = [q["query"] for q in generate_queries(manifest, args.queries, args.zh_ratio, seed=args.seed)]
+    stages = {}
+
+    # 小模型的分词器在语料正文上训练；须先于 preprocess 构建，切块按 embedding 分词器计 token
+    import preprocess
+    if not args.embedding_model:
+        from bench.tiny_models import ensure_tiny_models
+        texts = (preprocess.extract_text_and_title_from_html(os.path.join(html_dir, name))[1] or ""
+                 for name in sorted(manifest))
+        ensure_tiny_models(model_dir, texts, hidden_size=args.hidden_size, layers=args.layers, seed=args.seed)
+
+    # --- preprocess：HTML 解析、切块、过滤（多进程） ---
+    from data_utils import iter_data
+    data_file = overrides["DATA_FILE"]
+    with Stage("preprocess") as stage, open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        preprocess.main(["--input-dir", html_dir, "--output", data_file, "--workers", str(args.workers), "--force"])
+    n_chunks = sum(1 for _ in iter_data(data_file))
+    stage.items = len(manifest)
+    stage.extra.update(chunks=n_chunks, chunks_per_s=round(n_chunks / stage.wall_s, 3) if stage.wall_s else None)
+    stages["preprocess"] = stage.summary()
+
+    # --- 模型加载 ---
+    import config
+    from models import load_embedding_model, load_generation_model
+    from rerank_utils import load_reranker
+    with Stage("model_load") as stage:
+        embedding_model = load_embedding_model(config.EMBEDDING_MODEL_NAME)
+        reranker = load_reranker()
+        generation_model, tokenizer = load_generation_model(config.GENERATION_MODEL_NAME)
+    if not embedding_model or not generation_model or not reranker:
+        raise RuntimeError("Failed to load models; run with --verbose for details.")
+    stages["model_load"] = stage.summary()
+
+    # --- 建索引（含 collection 创建、doc store 写入与 BM25 索引） ---
+    from data_utils import load_data
+    from doc_store import get_doc_store
+    from milvus_utils import get_milvus_client, setup_milvus_collection, index_data_if_needed, get_index_profile, \
+        search_similar_documents
+    client = get_milvus_client()
+    with Stage("index") as stage:
+        if not client or not setup_milvus_collection(client):
+            raise RuntimeError("Milvus collection is not available.")
+        data = load_data(data_file)
+        if not index_data_if_needed(client, data, embedding_model):
+            raise RuntimeError("Indexing failed.")
+    stage.items = len(data)
+    stages["index"] = stage.summary()
+    del data
+    doc_store = get_doc_store()
+
+    from rerank_utils import rerank_documents
+    from rag_core import generate_answer_stream
+
+    # 预热：探测 search 调用方式、初始化 rerank 合批线程等一次性开销不计入统计
+    for i in range(args.warmup):
+        q = f"warmup query {i}"
+        ids, _ = search_similar_documents(client, q, embedding_model)
+        rerank_documents(q, doc_store.get_docs(ids), reranker)
+
+    with Stage("search") as stage:
+        hits = [stage.timed(search_similar_documents, client, q, embedding_model)[0] for q in queries]
+    stages["search"] = stage.summary()
+
+    with Stage("doc_lookup") as stage:
+        retrieved = [stage.timed(doc_store.get_docs, ids) for ids in hits]
+    stages["doc_lookup"] = stage.summary()
+
+    with Stage("rerank") as stage:
+        contexts = [stage.timed(rerank_documents, q, docs, reranker)[:config.TOP_K]
+                    for q, docs in zip(queries, retrieved)]
+    stage.extra["pairs"] = sum(len(docs) for docs in retrieved)
+    stages["rerank"] = stage.summary()
+
+    # generate_answer 的流式版本：多取一份生成统计（token 数、首 token 延迟）
+    with Stage("generate") as stage:
+        new_tokens, ttfts = 0, []
+        for q, docs in list(zip(queries, contexts))[:args.answers]:
+            stats = {}
+            stage.timed(lambda: "".join(generate_answer_stream(q, docs, generation_model, tokenizer, stats=stats)))
+            new_tokens += stats.get("new_tokens", 0)
+            if "ttft_s" in stats:
+                ttfts.append(stats["ttft_s"] * 1000.0)
+    stage.extra.update(new_tokens=new_tokens,
+                       tokens_per_s=round(new_tokens / stage.wall_s, 3) if stage.wall_s else None)
+    if ttfts:
+        import numpy as np
+        stage.extra["ttft_p50_ms"] = round(float(np.percentile(ttfts, 50)), 3)
+        stage.extra["ttft_p95_ms"] = round(float(np.percentile(ttfts, 95)), 3)
+    stages["generate"] = stage.summary()
+
+    import metrics
+    import torch
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "docs": args.docs, "chunks": n_chunks, "queries": len(queries), "answers": args.answers,
+            "zh_ratio": args.zh_ratio, "seed": args.seed,
+            "models": {k: (os.path.relpath(v, workdir) if isinstance(v, str) and v.startswith(workdir) else v)
+                       for k, v in models.items()},
+            "backend": args.backend or "torch",
+            "index_type": get_index_profile()["index_type"],
+        },
+        "stages": stages,
+        # 流水线内部 span（metrics.py）的分位数，便于定位阶段内的热点
+        "spans": metrics.stage_seconds.summary(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the RAG pipeline.")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR)
+    parser.add_argument("--docs", type=int, default=500, help="number of synthetic HTML articles")
+    parser.add_argument("--zh-ratio", type=float, default=0.5, help="fraction of Chinese articles and queries")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--answers", type=int, default=10, help="queries that also run generation")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="preprocess worker processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hidden-size", type=int, default=64, help="hidden size of the tiny random models")
+    parser.add_argument("--layers", type=int, default=2, help="layers of the tiny random models")
+    parser.add_argument("--embedding-model", help="local model path instead of the tiny random model")
+    parser.add_argument("--reranker-model")
+    parser.add_argument("--generation-model")
+    parser.add_argument("--embedding-dim", type=int)
+    parser.add_argument("--backend", choices=("torch", "int8", "onnx", "bf16"),
+                        help="inference backend for all three models (default: config)")
+    parser.add_argument("--output", help="write the JSON result here (default: stdout)")
+    parser.add_argument("--baseline", help="compare against this result; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--update-baseline", action="store_true", help="write this run to --baseline")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    if args.embedding_model and not (args.reranker_model and args.generation_model and args.embedding_dim):
+        parser.error("--embedding-model requires --reranker-model, --generation-model and --embedding-dim")
+
+    from runtime import configure_logging
+    configure_logging(logging.INFO if args.verbose else logging.ERROR)
+
+    result = run(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if not args.baseline:
+        return 0
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        rows = compare(result, json.load(f), args.tolerance)
+    print(format_rows(rows), file=sys.stderr)
+    regressions = [r for r in rows if r["regression"]]
+    print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}.", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
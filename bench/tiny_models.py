@@ -0,0 +1,100 @@
+"""
+随机初始化的小模型（embedding / cross-encoder / causal LM），分词器在合成语料上训练，
+保存为普通的本地 Hugging Face 目录，models.py / rerank_utils.py 按路径直接加载，无需联网。
+权重是随机的：只用于测延迟、吞吐与内存，不反映检索质量。
+"""
+import json
+import os
+
+SPEC_VERSION = 2
+
+
+def _train_texts(texts, limit=2000):
+    return [t for _, t in zip(range(limit), texts)]
+
+
+def _build_bert_models(out_dir, texts, hidden_size, layers, seed):
+    import torch
+    from tokenizers import Tokenizer, models, normalizers, pre_tokenizers, trainers
+    from tokenizers.processors import TemplateProcessing
+    from transformers import BertConfig, BertModel, BertForSequenceClassification, PreTrainedTokenizerFast
+    from sentence_transformers import SentenceTransformer, models as st_models
+
+    specials = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    tok = Tokenizer(models.WordPiece(unk_token="[UNK]"))
+    tok.normalizer = normalizers.BertNormalizer()
+    tok.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    tok.train_from_iterator(texts, trainers.WordPieceTrainer(vocab_size=4000, special_tokens=specials))
+    tok.post_processor = TemplateProcessing(
+        single="[CLS] $A [SEP]", pair="[CLS] $A [SEP] $B:1 [SEP]:1",
+        special_tokens=[("[CLS]", tok.token_to_id("[CLS]")), ("[SEP]", tok.token_to_id("[SEP]"))],
+    )
+    fast = PreTrainedTokenizerFast(tokenizer_object=tok, unk_token="[UNK]", pad_token="[PAD]",
+                                   cls_token="[CLS]", sep_token="[SEP]", mask_token="[MASK]",
+                                   model_max_length=512)
+    config = BertConfig(vocab_size=len(fast), hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+                        num_hidden_layers=layers, num_attention_heads=max(1, hidden_size // 32),
+                        max_position_embeddings=512)
+
+    torch.manual_seed(seed)
+    emb_dir = os.path.join(out_dir, "embedding")
+    raw_dir = os.path.join(out_dir, "embedding_raw")
+    BertModel(config).save_pretrained(raw_dir)
+    fast.save_pretrained(raw_dir)
+    word = st_models.Transformer(raw_dir, max_seq_length=512)
+    SentenceTransformer(modules=[word, st_models.Pooling(hidden_size, pooling_mode="mean")]).save(emb_dir)
+
+    ce_dir = os.path.join(out_dir, "reranker")
+    BertForSequenceClassification(BertConfig(**config.to_dict(), num_labels=1)).save_pretrained(ce_dir)
+    fast.save_pretrained(ce_dir)
+    return emb_dir, ce_dir
+
+
+def _build_causal_lm(out_dir, texts, hidden_size, layers, seed):
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+
+    tok = Tokenizer(models.BPE())
+    tok.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tok.decoder = decoders.ByteLevel()
+    tok.train_from_iterator(texts, trainers.BpeTrainer(
+        vocab_size=4000, special_tokens=["<pad>", "<eos>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+    ))
+    fast = PreTrainedTokenizerFast(tokenizer_object=tok, eos_token="<eos>", pad_token="<pad>",
+                                   model_max_length=4096)
+    torch.manual_seed(seed)
+    config = Qwen2Config(vocab_size=len(fast), hidden_size=hidden_size, intermediate_size=hidden_size * 2,
+                         num_hidden_layers=layers, num_attention_heads=max(1, hidden_size // 32),
+                         num_key_value_heads=max(1, hidden_size // 64), max_position_embeddings=4096,
+                         eos_token_id=fast.eos_token_id, pad_token_id=fast.pad_token_id)
+    gen_dir = os.path.join(out_dir, "generator")
+    Qwen2ForCausalLM(config).save_pretrained(gen_dir)
+    fast.save_pretrained(gen_dir)
+    return gen_dir
+
+
+def ensure_tiny_models(out_dir, texts, hidden_size=64, layers=2, seed=0):
+    """
+    在 out_dir 下构建（或复用）三个小模型。texts 为训练分词器用的文本迭代器。
+    Returns:
+      - {"embedding": 路径, "reranker": 路径, "generator": 路径, "embedding_dim": hidden_size}
+    """
+    spec = {"version": SPEC_VERSION, "hidden_size": hidden_size, "layers": layers, "seed": seed}
+    spec_path = os.path.join(out_dir, "spec.json")
+    paths = {name: os.path.join(out_dir, name) for name in ("embedding", "reranker", "generator")}
+    try:
+        with open(spec_path, "r", encoding="utf-8") as f:
+            if json.load(f) == spec and all(os.path.isdir(p) for p in paths.values()):
+                return {**paths, "embedding_dim": hidden_size}
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    os.makedirs(out_dir, exist_ok=True)
+    texts = _train_texts(texts)
+    _build_bert_models(out_dir, texts, hidden_size, layers, seed)
+    _build_causal_lm(out_dir, texts, hidden_size, layers, seed)
+    with open(spec_path, "w", encoding="utf-8") as f:
+        json.dump(spec, f)
+    return {**paths, "embedding_dim": hidden_size}
@@ -0,0 +1,318 @@
+"""
+流式批量导入：不把数据文件整体读入内存，按批 读取 -> 编码 -> 写入 Milvus，三个阶段由有界队列串成流水线：
+  - reader 线程逐行解析 JSONL，按批与 doc store 的 manifest 比对，只把新增/修改的 chunk 交给下游；
+  - encoder 线程对每批调用 embedding 模型（读穿持久化 embedding 缓存）；
+  - 主线程 upsert 到 Milvus，每 flush_every 批 flush 一次，随后在同一个 SQLite 事务中提交
+    这些批次的 manifest 与断点（数据文件中的字节偏移）。
+队列深度 INDEX_QUEUE_SIZE 限制在途批次数，峰值内存只与批大小有关，与语料规模无关。
+中断后再次运行从最后提交的断点继续；数据文件或模型变化时从头读取（未变化的 chunk 仍按 manifest 跳过）。
+读完后删除语料中已不存在的 chunk、重建 BM25 索引并记录数据源指纹，app 启动时据此跳过数据加载。
+"""
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+from config import (
+    DATA_FILE, COLLECTION_NAME, EMBEDDING_MODEL_NAME, MAX_ARTICLES_TO_INDEX,
+    INDEX_BATCH_SIZE, INDEX_QUEUE_SIZE
+)
+from data_utils import iter_data
+from runtime import configure_logging, log
+
+_DONE = object()
+# 一次 delete 请求携带的最大 ID 数
+_DELETE_BATCH_SIZE = 16384
+
+
+def iter_records(data_file, position=0):
+    """
+    从断点 position 开始逐条读取数据文件，返回 (record, 读完该条后的断点)。
+    JSONL 的断点是字节偏移，可直接 seek；其它格式（整个 JSON 数组）退回记录序号，需整体解析。
+    """
+    if not data_file.endswith(".jsonl"):
+        for i, doc in enumerate(iter_data(data_file)):
+            if i >= position:
+                yield doc, i + 1
+        return
+    with open(data_file, "rb") as f:
+        f.seek(position)
+        for line in f:
+            position += len(line)
+            line = line.strip()
+            if line:
+                yield json.loads(line), position
+
+
+def read_batches(data_file, store, trust_manifest, position=0, records=0,
+                 batch_size=INDEX_BATCH_SIZE, limit=MAX_ARTICLES_TO_INDEX):
+    """
+    每 batch_size 条记录组成一批。
+    Returns（逐批）:
+      - rows: 需要重新编码的 doc store 行；seen: 本批读到的全部 ID；
+      - position / records: 本批结束处的断点与累计记录数
+    """
+    from milvus_utils import doc_to_row
+
+    def make_batch(docs, position, records):
+        rows = {}
+        for doc in docs:
+            row = doc_to_row(doc)
+            if row is not None and row[0] not in rows:
+                rows[row[0]] = row
+        # 数据文件内重复的 doc_key 只保留第一次出现
+        for doc_id in store.seen_ids(rows):
+            del rows[doc_id]
+        seen = list(rows)
+        if trust_manifest:
+            indexed = store.content_hashes_for(seen)
+            rows = {doc_id: row for doc_id, row in rows.items() if indexed.get(doc_id) != row[6]}
+        return {"rows": list(rows.values()), "seen": seen, "position": position, "records": records}
+
+    docs = []
+    for doc, position in iter_records(data_file, position):
+        if limit is not None and records >= limit:
+            break
+        docs.append(doc)
+        records += 1
+        if len(docs) >= batch_size:
+            yield make_batch(docs, position, records)
+            docs = []
+    if docs:
+        yield make_batch(docs, position, records)
+
+
+def encode_batch(batch, embedding_model, cache=None):
+    """为一批中需要重新编码的行生成向量；cache 命中的文本不再编码（只写内存，结束时统一落盘）。"""
+    from milvus_utils import row_content
+    contents = [row_content(row) for row in batch["rows"]]
+    if not contents:
+        batch["embeddings"] = np.zeros((0, 0), dtype=np.float32)
+        return batch
+    if cache is None:
+        batch["embeddings"] = np.asarray(embedding_model.encode(contents), dtype=np.float32)
+        return batch
+    vectors, missing = cache.get_many(contents)
+    if missing:
+        new_vectors = np.asarray(embedding_model.encode([contents[i] for i in missing]), dtype=np.float32)
+        vectors[missing] = new_vectors
+        cache.put_many([contents[i] for i in missing], new_vectors)
+    batch["embeddings"] = vectors
+    return batch
+
+
+def _put(q, item, stop):
+    """放入有界队列；队列满时阻塞，流水线被停止时放弃。"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q, stop):
+    """逐个取出上游结果，直到上游结束或流水线被停止。"""
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        yield item
+
+
+def _run_stage(fn, items, outbox, stop, errors):
+    """线程主体：items 逐个经 fn 处理后放入 outbox；出错时记录异常并停止整条流水线。"""
+    try:
+        for item in items:
+            if not _put(outbox, fn(item), stop):
+                return
+    except BaseException as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        _put(outbox, _DONE, stop)
+
+
+def pipeline(batches, encode, queue_size=INDEX_QUEUE_SIZE):
+    """
+    reader / encoder 各一个线程，通过深度为 queue_size 的队列与调用方相连，
+    调用方消费编码好的批次时下一批已在读取和编码。任一阶段出错时在调用方重新抛出。
+    """
+    stop = threading.Event()
+    errors = []
+    read_q = queue.Queue(maxsize=queue_size)
+    encode_q = queue.Queue(maxsize=queue_size)
+    threads = [
+        threading.Thread(target=_run_stage, args=(lambda b: b, batches, read_q, stop, errors),
+                         name="ingest-reader", daemon=True),
+        threading.Thread(target=_run_stage, args=(encode, _drain(read_q, stop), encode_q, stop, errors),
+                         name="ingest-encoder", daemon=True),
+    ]
+    for t in threads:
+        t.start()
+    try:
+        yield from _drain(encode_q, stop)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
+
+
+def ingest(client, embedding_model, data_file=DATA_FILE, batch_size=INDEX_BATCH_SIZE,
+           queue_size=INDEX_QUEUE_SIZE, flush_every=8, limit=MAX_ARTICLES_TO_INDEX,
+           resume=True, use_cache=True, build_lexical=True):
+    """
+    把 data_file 流式导入 Milvus 与 doc store。
+    BM25 索引是全量内存结构，重建的内存与语料规模成正比；build_lexical=False 时推迟到首次混合检索时
+    由 load_or_build_lexical_index 按需重建。
+    Returns:
+      - 统计 dict：records / embedded / removed / resumed_from / seconds
+    """
+    from doc_store import get_doc_store
+    from embedding_cache import get_embedding_cache
+    from lexical_index import build_lexical_index
+    from metrics import span, count
+    from milvus_utils import (
+        check_manifest, get_entity_count, upsert_rows, ingest_checkpoint_key, mark_index_synced
+    )
+    from query_cache import bump_index_version
+
+    start = time.perf_counter()
+    store = get_doc_store()
+    current_count = get_entity_count(client, COLLECTION_NAME)
+    has_manifest = len(store) > 0
+    trust_manifest = check_manifest(client, store, has_manifest, current_count)
+    if trust_manifest is None:
+        raise RuntimeError("Could not clear legacy data from Milvus.")
+
+    # 断点只在数据文件与模型都未变化、且 Milvus 中的数据没有丢失时可续用
+    key = ingest_checkpoint_key(data_file)
+    position = records = 0
+    if (resume and store.get_meta("ingest_checkpoint") == key
+            and not (current_count == 0 and has_manifest)):
+        position = int(store.get_meta("ingest_position", 0))
+        records = int(store.get_meta("ingest_records", 0))
+    if position:
+        log.write(f"Resuming ingestion of {data_file} after {records} records.")
+    else:
+        store.clear_ingest()
+    stats = {"records": records, "embedded": 0, "removed": 0, "resumed_from": records}
+
+    cache = get_embedding_cache() if use_cache else None
+    batches = read_batches(data_file, store, trust_manifest, position, records, batch_size, limit)
+    pending_rows, pending_seen, pending_ids = [], [], set()
+    checkpoint = None
+
+    def commit():
+        # flush 之后 Milvus 中的数据已持久化，此时提交 manifest 与断点，崩溃后不会跳过未落盘的批次
+        with span("ingest_flush"):
+            client.flush(COLLECTION_NAME)
+        store.commit_ingest_batch(pending_rows, pending_seen, ingest_checkpoint=key,
+                                  ingest_position=checkpoint["position"], ingest_records=checkpoint["records"])
+        # 本批变更此时已对检索可见：递增版本号，其它进程的检索结果 / 图 / BM25 缓存随之失效
+        if pending_rows:
+            bump_index_version()
+        pending_rows.clear()
+        pending_seen.clear()
+        pending_ids.clear()
+
+    unflushed = 0
+    for batch in pipeline(batches, lambda b: encode_batch(b, embedding_model, cache), queue_size):
+        # 上游读取时在途批次尚未提交，跨批次重复的 doc_key 在这里按 已提交 + 待提交 再剔除一次
+        ids = [row[0] for row in batch["rows"]]
+        duplicates = pending_ids.intersection(ids) | store.seen_ids(ids)
+        keep = [i for i, doc_id in enumerate(ids) if doc_id not in duplicates]
+        rows = [batch["rows"][i] for i in keep]
+        if rows:
+            with span("ingest_upsert"):
+                upsert_rows(client, rows, batch["embeddings"][keep])
+            count("rag_indexed_chunks_total", len(rows), help="Chunks embedded and upserted by indexing.")
+        pending_rows.extend(rows)
+        pending_seen.extend(batch["seen"])
+        pending_ids.update(batch["seen"])
+        checkpoint = batch
+        stats["records"] = batch["records"]
+        stats["embedded"] += len(rows)
+        unflushed += 1
+        if unflushed >= flush_every:
+            commit()
+            unflushed = 0
+            log.write(f"Ingested {stats['records']} records ({stats['embedded']} embedded) "
+                      f"in {time.perf_counter() - start:.1f}s.")
+    if unflushed:
+        commit()
+    if cache is not None:
+        cache.flush()
+
+    # 本轮没有读到的 chunk 已从语料中删除
+    vanished = store.unseen_ids()
+    for i in range(0, len(vanished), _DELETE_BATCH_SIZE):
+        client.delete(collection_name=COLLECTION_NAME, ids=vanished[i:i + _DELETE_BATCH_SIZE])
+    if vanished:
+        store.delete_docs(vanished)
+        bump_index_version()
+    stats["removed"] = len(vanished)
+
+    if build_lexical and (stats["embedded"] or vanished):
+        try:
+            build_lexical_index(store)
+        except Exception as e:
+            log.warning(f"Could not build lexical index: {e}")
+    store.clear_ingest()
+    store.set_meta(ingest_checkpoint="", ingest_position=0, ingest_records=0)
+    mark_index_synced(data_file)
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream the processed corpus into Milvus in resumable batches.")
+    parser.add_argument("--data-file", default=DATA_FILE, help="preprocess.py 输出的 JSONL")
+    parser.add_argument("--batch-size", type=int, default=INDEX_BATCH_SIZE, help="每批编码并写入的记录数")
+    parser.add_argument("--queue-size", type=int, default=INDEX_QUEUE_SIZE, help="各阶段之间最多在途的批次数")
+    parser.add_argument("--flush-every", type=int, default=8, help="每多少批 flush Milvus 并提交一次断点")
+    parser.add_argument("--limit", type=int, default=MAX_ARTICLES_TO_INDEX, help="只导入前 N 条记录")
+    parser.add_argument("--restart", action="store_true", help="忽略断点，从数据文件开头重新读取")
+    parser.add_argument("--force", action="store_true", help="索引已是最新时也重新读取一遍")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="不读写持久化 embedding 缓存")
+    parser.add_argument("--skip-lexical-index", action="store_true", help="不在导入后重建 BM25 索引")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    from models import load_embedding_model
+    from milvus_utils import get_milvus_client, setup_milvus_collection, index_is_up_to_date
+
+    client = get_milvus_client()
+    if not client or not setup_milvus_collection(client):
+        print("Milvus collection is not available.")
+        return 1
+    if not args.force and not args.restart and index_is_up_to_date(client, args.data_file):
+        print(f"Index is already up to date with {args.data_file}.")
+        return 0
+    embedding_model = load_embedding_model(EMBEDDING_MODEL_NAME)
+    if embedding_model is None:
+        print(f"Failed to load embedding model '{EMBEDDING_MODEL_NAME}'.")
+        return 1
+
+    stats = ingest(client, embedding_model, args.data_file, batch_size=max(1, args.batch_size),
+                   queue_size=max(1, args.queue_size), flush_every=max(1, args.flush_every),
+                   limit=args.limit, resume=not args.restart, use_cache=not args.no_embedding_cache,
+                   build_lexical=not args.skip_lexical_index)
+    print(f"Ingested {stats['records']} records in {stats['seconds']}s: {stats['embedded']} embedded, "
+          f"{stats['removed']} removed"
+          + (f", resumed after {stats['resumed_from']} records." if stats["resumed_from"] else "."))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+按句子边界、以 embedding 分词器的 token 数为单位切块：
+  1. 正则一次扫描切出中英文句子（保留字符偏移）；
+  2. 一批文档的全部句子合并为一次批量分词调用，得到每句的 token 数；
+  3. 每篇文档内用前缀和 + 二分贪心装句，相邻块重叠若干完整句子；超长句子按 token 偏移硬切。
+整体对文本长度线性。输出块在原文中的字符偏移 [start, end)，下游可据此拼回原文或判断重叠。
+分词器直接用 tokenizers 库加载 tokenizer.json，preprocess 的每个 worker 不必导入 transformers；
+加载失败（离线且无本地模型、只有 slow tokenizer 等）时退回近似计数：CJK 字符、单词、标点各计 1 个 token。
+"""
+import os
+import re
+
+import numpy as np
+
+from config import EMBEDDING_MODEL_NAME, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from runtime import cache_resource, log
+
+# 中英文句末标点（可带后引号 / 括号）；英文句点需后接空白，避免截断小数和缩写
+SENTENCE_END = re.compile(r'[。！？；!?;…]+[”’」』）)]*|\n+|\.(?=\s)')
+# 近似分词：CJK 单字、连续的字母数字、单个标点
+_APPROX_TOKEN = re.compile(r'[㐀-鿿豈-﫿]|[^\W㐀-鿿豈-﫿]+|[^\w\s]')
+
+
+@cache_resource
+def load_chunk_tokenizer(model_name=EMBEDDING_MODEL_NAME):
+    """
+    加载 embedding 模型的 tokenizers.Tokenizer：本地目录读 tokenizer.json，否则从 Hub 获取
+    （sentence-transformers 的短名称自动补全命名空间）；关闭截断与 padding。
+    失败时返回 None，由调用方退回近似计数。
+    """
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        log.warning("tokenizers is not installed, chunking with approximate token counts.")
+        return None
+    names = [model_name]
+    if "/" not in model_name and not os.path.isdir(model_name):
+        names.append(f"sentence-transformers/{model_name}")
+    for name in names:
+        try:
+            local = os.path.join(name, "tokenizer.json")
+            tokenizer = Tokenizer.from_file(local) if os.path.isfile(local) else Tokenizer.from_pretrained(name)
+        except Exception as e:
+            error = e
+            continue
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+        return tokenizer
+    log.warning(f"Failed to load tokenizer '{model_name}' ({error}), chunking with approximate token counts.")
+    return None
+
+
+def sentence_spans(text):
+    """切出句子的字符区间 [(start, end)]，去掉首尾空白，跳过空句。"""
+    spans, start = [], 0
+    for m in SENTENCE_END.finditer(text):
+        spans.append((start, m.end()))
+        start = m.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    result = []
+    for start, end in spans:
+        segment = text[start:end]
+        left = len(segment) - len(segment.lstrip())
+        right = len(segment.rstrip())
+        if right > left:
+            result.append((start + left, start + right))
+    return result
+
+
+def token_lengths(texts, tokenizer):
+    """一次批量分词，返回每段文本的 token 数（不含特殊 token）。"""
+    if not texts:
+        return np.zeros(0, dtype=np.int64)
+    if tokenizer is None:
+        return np.fromiter((len(_APPROX_TOKEN.findall(t)) for t in texts), dtype=np.int64, count=len(texts))
+    encodings = tokenizer.encode_batch(texts, add_special_tokens=False)
+    return np.fromiter((len(e.ids) for e in encodings), dtype=np.int64, count=len(encodings))
+
+
+def _token_ends(text, tokenizer):
+    """每个 token 在 text 中的 (start, end) 字符区间。"""
+    if tokenizer is None:
+        return [m.span() for m in _APPROX_TOKEN.finditer(text)]
+    return tokenizer.encode(text, add_special_tokens=False).offsets
+
+
+def _split_long_sentence(text, start, end, tokenizer, max_tokens):
+    """把超过 max_tokens 的句子按 token 边界切成若干段，返回 [(start, end, n_tokens)]。"""
+    offsets = _token_ends(text[start:end], tokenizer)
+    pieces = []
+    for i in range(0, len(offsets), max_tokens):
+        window = offsets[i:i + max_tokens]
+        pieces.append((start + window[0][0], start + window[-1][1], len(window)))
+    return pieces
+
+
+def pack_sentences(lengths, max_tokens, overlap_tokens):
+    """
+    贪心装句：每块从第 i 句起尽量多装（前缀和上二分），下一块回退若干末尾句子作为重叠，
+    总数不超过 overlap_tokens；回退后装不进新句子时不重叠。
+    Returns:
+      - [(first, last)]，句子下标区间（last 不含）
+    """
+    n = len(lengths)
+    cum = np.concatenate(([0], np.cumsum(lengths)))
+    ranges, i = [], 0
+    while i < n:
+        j = max(int(np.searchsorted(cum, cum[i] + max_tokens, side="right")) - 1, i + 1)
+        ranges.append((i, j))
+        if j >= n:
+            break
+        k = int(np.searchsorted(cum, cum[j] - overlap_tokens, side="left"))
+        if k <= i or cum[j + 1] - cum[k] > max_tokens:
+            k = j
+        i = k
+    return ranges
+
+
+def chunk_documents(texts, tokenizer=None, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+                    prefixes=None):
+    """
+    批量切块。max_tokens 含分词器自动添加的特殊 token（[CLS]/[SEP] 等）。
+    prefixes: 可选，与 texts 一一对应，编码时拼在每块之前的文本（标题与模板），其 token 数从该文档的预算中扣除。
+    token 数按句子分别计数后相加：对按空白与标点预切分的分词器（BERT WordPiece 等）是精确的。
+    Returns:
+      - 与 texts 一一对应：[(start, end)]，块在原文中的字符区间
+    """
+    if tokenizer is None:
+        specials = 2
+    else:
+        specials = tokenizer.post_processor.num_special_tokens_to_add(False) if tokenizer.post_processor else 0
+    reserved = token_lengths(list(prefixes), tokenizer) if prefixes is not None else np.zeros(len(texts), np.int64)
+
+    doc_spans = [sentence_spans(text or "") for text in texts]
+    lengths = token_lengths([text[s:e] for text, spans in zip(texts, doc_spans) for s, e in spans], tokenizer)
+
+    results, pos = [], 0
+    for text, spans, prefix_tokens in zip(texts, doc_spans, reserved):
+        budget = max(1, max_tokens - specials - int(prefix_tokens))
+        overlap = min(overlap_tokens, budget - 1)
+        doc_lengths = lengths[pos:pos + len(spans)]
+        pos += len(spans)
+        if (doc_lengths > budget).any():
+            pieces = []
+            for (s, e), n in zip(spans, doc_lengths):
+                pieces.extend(_split_long_sentence(text, s, e, tokenizer, budget) if n > budget else [(s, e, n)])
+            spans = [(s, e) for s, e, _ in pieces]
+            doc_lengths = np.asarray([n for _, _, n in pieces], dtype=np.int64)
+        results.append([(spans[first][0], spans[last - 1][1])
+                        for first, last in pack_sentences(doc_lengths, budget, overlap)])
+    return results
@@ -1,35 +1,136 @@
+import os
+
 # Milvus Lite Configuration
 MILVUS_LITE_DATA_PATH = "./milvus_lite_data.db" # Path to store Milvus Lite data
 COLLECTION_NAME = "medical_rag_lite" # Use a different name if needed
 
 # Data Configuration
-DATA_FILE = "./data/processed_data.json"
+DATA_FILE = "./data/processed_data.jsonl"  # preprocess.py 输出的 JSONL
+# SQLite 文档存储：按 Milvus 主键懒加载 chunk，content_hash 列兼作增量索引 manifest
+DOC_STORE_PATH = "./data/doc_store.sqlite3"
 
 # Model Configuration
 # Example: 'all-MiniLM-L6-v2' (dim 384), 'thenlper/gte-large' (dim 1024)
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 GENERATION_MODEL_NAME = "Qwen/Qwen2.5-0.5B"
 EMBEDDING_DIM = 384 # Must match EMBEDDING_MODEL_NAME
+# 推理后端："torch" | "int8"（CPU 动态量化）| "onnx"（需 optimum[onnxruntime]）| "bf16"
+# 环境不支持时自动退回 torch；切换后用 parity_check.py 对比与 fp32 基线的偏差
+EMBEDDING_BACKEND = "torch"
+GENERATION_BACKEND = "torch"
+# 持久化 embedding 缓存（memmap 矩阵 + ID 索引），模型名/维度变化时自动失效
+EMBEDDING_CACHE_DIR = "./data/embedding_cache"
+EMBEDDING_CACHE_MAX_ENTRIES = 200000
+# preprocess 切块（chunker.py）：按句子边界把句子装入不超过 CHUNK_MAX_TOKENS 个 embedding 分词器 token
+# 的块（含 [CLS]/[SEP] 与 "Title: ...\nAbstract: " 前缀，即实际编码的文本，与 embedding 模型的 max_seq_length
+# 一致，编码时不会截断），
+# 相邻块重叠不超过 CHUNK_OVERLAP_TOKENS 个 token 的完整句子
+CHUNK_MAX_TOKENS = 256
+CHUNK_OVERLAP_TOKENS = 32
+# 近重复过滤（near_dup.py）：字符 shingle 的 MinHash 估计 Jaccard 相似度 >= 阈值的 chunk 只保留最先出现的一个；
+# LSH 索引持久化在 NEAR_DUP_INDEX_PATH，增量运行时新文档与已有语料比对
+NEAR_DUP_THRESHOLD = 0.8
+NEAR_DUP_NUM_PERM = 128
+NEAR_DUP_SHINGLE_SIZE = 5
+NEAR_DUP_INDEX_PATH = "./data/near_dup.sqlite3"
 
 # Indexing and Search Parameters
-MAX_ARTICLES_TO_INDEX = 500
+# 只索引数据文件中的前 N 条记录（快速演示用），None 表示索引全部语料
+MAX_ARTICLES_TO_INDEX = None
+# 建索引时每批编码并写入 Milvus 的 chunk 数；每批完成后提交 manifest，中断后从下一批继续
+INDEX_BATCH_SIZE = 512
+# bulk_ingest.py 读取 -> 编码 -> 写入 各阶段之间的队列深度（批次数），决定峰值内存
+INDEX_QUEUE_SIZE = 4
 TOP_K = 3
 # Milvus index parameters (adjust based on data size and needs)
 INDEX_METRIC_TYPE = "L2" # Or "IP"
-INDEX_TYPE = "IVF_FLAT"  # Milvus Lite 支持的索引类型
-# HNSW index params (adjust as needed)
+# 默认索引配置；运行 index_tuner.py 后以 INDEX_PROFILE_PATH 中的配置为准
+INDEX_TYPE = "IVF_FLAT"  # 也支持 IVF_SQ8 / IVF_PQ / HNSW / HNSW_SQ（视 Milvus 版本而定）
 INDEX_PARAMS = {"nlist": 128}
-# HNSW search params (adjust as needed)
 SEARCH_PARAMS = {"nprobe": 16}
+# 当前生效的索引配置（类型、构建参数、检索参数），与已建索引不一致时启动时重建
+INDEX_PROFILE_PATH = "./data/index_profile.json"
+# index_tuner.py：在满足延迟目标的候选中，选 recall@k 达标且每条向量占用最小的配置
+INDEX_TUNER_K = 10
+INDEX_TUNER_QUERIES = 200
+INDEX_TUNER_LATENCY_TARGET_MS = 50.0
+INDEX_TUNER_MIN_RECALL = 0.95
+# search_many 每次 Milvus 请求携带的最大查询向量数（同时作为查询编码的 batch size）
+SEARCH_BATCH_SIZE = 256
+# 查询向量 / 检索结果缓存（LRU + TTL），索引内容变化时检索结果自动失效
+QUERY_CACHE_MAX_ENTRIES = 10000
+QUERY_CACHE_TTL_SECONDS = 3600
+
+# Similarity graph parameters
+GRAPH_SIMILARITY_THRESHOLD = 0.7
+GRAPH_TILE_SIZE = 1024  # 分块相似度计算的 tile 边长，决定峰值内存
+GRAPH_BUILD_WORKERS = None  # None 表示使用全部 CPU 核
+GRAPH_PATH = "./data/similarity_graph"  # CSR 图持久化目录
+# Graph-augmented retrieval: Milvus 命中作为种子沿图扩展，候选总数（含种子）不超过预算
+GRAPH_HOPS = 1
+GRAPH_TOP_K_PER_NODE = 5
+GRAPH_MIN_WEIGHT = None
+GRAPH_CANDIDATE_BUDGET = 10
+
+# Lexical (BM25) index + hybrid retrieval
+LEXICAL_INDEX_PATH = "./data/lexical_index"  # CSR postings 持久化目录
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 混合检索：Milvus top_k 命中与 BM25 前 HYBRID_LEXICAL_TOP_K 个命中做 RRF 融合，
+# 候选总数不超过 HYBRID_CANDIDATE_BUDGET，再交给 rerank
+HYBRID_LEXICAL_TOP_K = 20
+HYBRID_RRF_K = 60
+HYBRID_CANDIDATE_BUDGET = 10
+
+# Rerank Parameters
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_MAX_LENGTH = 512  # cross-encoder 输入 token 上限
+RERANK_BACKEND = "torch"
+RERANK_CHARS_PER_TOKEN = 4  # 分词前按 max_length * 该值 截断段落字符数
+RERANK_MAX_BATCH_SIZE = 32  # 合批推理的最大 pair 数
+RERANK_MAX_WAIT_MS = 5  # 合批时等待其它并发请求的最长时间
+RERANK_CACHE_MAX_ENTRIES = 50000
+RERANK_CACHE_TTL_SECONDS = 3600
+
+# Context packing: prompt 中上下文文档的 token 预算
+CONTEXT_TOKEN_BUDGET = 1536
+CONTEXT_MAX_OVERLAP_CHARS = 400  # 不小于 CHUNK_OVERLAP_TOKENS 个 token 的句子重叠对应的字符数
+TOKEN_CACHE_MAX_ENTRIES = 20000
+TOKEN_CACHE_TTL_SECONDS = 3600
 
 # Generation Parameters
 MAX_NEW_TOKENS_GEN = 512
 TEMPERATURE = 0.7
 TOP_P = 0.9
 REPETITION_PENALTY = 1.1
+# 连续合批生成调度器：多个会话共享同一模型实例
+GENERATION_SCHEDULER_ENABLED = True
+GEN_MAX_BATCH_SIZE = 8
+GEN_DO_SAMPLE = False  # 与直接调用 generate 时的默认（贪心解码）保持一致
+# 前缀 KV 缓存（静态指令头 + 上下文块）保留的条目数
+KV_CACHE_MAX_ENTRIES = 4
 
-# Global map to store document content (populated during indexing)
-# Key: document ID (int), Value: dict {'title': str, 'abstract': str, 'content': str}
-id_to_doc_map = {} 
+# HTTP 服务（server.py）
+API_HOST = "0.0.0.0"
+API_PORT = 8000
+# 阻塞调用所用线程池的大小
+API_SEARCH_WORKERS = 4
+API_RERANK_WORKERS = 2
+API_GENERATION_WORKERS = 16  # 只负责从生成流中拉取文本，实际 decode 由调度器合批
+# 各接口的并发上限；queue 超时内拿不到空位返回 503
+API_MAX_CONCURRENT_SEARCH = 32
+API_MAX_CONCURRENT_RERANK = 16
+API_MAX_CONCURRENT_ANSWER = 16
+API_QUEUE_TIMEOUT_S = 0.5
+API_REQUEST_TIMEOUT_S = 30
+API_ANSWER_TIMEOUT_S = 300
+# 非空时 app.py 作为瘦客户端调用该地址的 server.py，不在本进程加载模型
+RAG_API_URL = os.environ.get("RAG_API_URL", "")
+API_CLIENT_TIMEOUT_S = 60
 
-id_to_embedding_map = {}
\ No newline at end of file
+# 指标与追踪（metrics.py）：各阶段耗时直方图 + 吞吐计数器，server.py 在 /metrics 导出
+METRICS_ENABLED = True
+# 耗时直方图的桶上界（秒）
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 非空时每个 span 追加一行到该 JSONL 文件，便于离线定位 p99 慢请求
+METRICS_TRACE_PATH = os.environ.get("RAG_TRACE_PATH", "")
@@ -0,0 +1,105 @@
+from chunker import SENTENCE_END
+from config import (
+    CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_OVERLAP_CHARS,
+    TOKEN_CACHE_MAX_ENTRIES, TOKEN_CACHE_TTL_SECONDS
+)
+from data_utils import content_hash, format_content
+from query_cache import TTLLRUCache
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+# (tokenizer 名称, 文本哈希) -> token ids
+token_cache = TTLLRUCache(TOKEN_CACHE_MAX_ENTRIES, TOKEN_CACHE_TTL_SECONDS)
+
+
+def count_tokens(text, tokenizer) -> int:
+    """返回文本的 token 数；同一文本只分词一次。"""
+    key = (getattr(tokenizer, "name_or_path", ""), content_hash(text))
+    ids = token_cache.get(key)
+    if ids is None:
+        ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+        token_cache.put(key, ids)
+    return len(ids)
+
+
+def _overlap_len(left, right, max_overlap):
+    """left 的结尾与 right 的开头重合的最长字符数（不超过 max_overlap）。"""
+    for k in range(min(max_overlap, len(left), len(right)), 0, -1):
+        if left.endswith(right[:k]):
+            return k
+    return 0
+
+
+def _trim_to_sentence(text, tokenizer, budget):
+    """把文本截到 budget 个 token 以内，并回退到最后一个完整句子的结尾；找不到句界时返回空串。"""
+    if budget <= 0:
+        return ""
+    ids = tokenizer(text, add_special_tokens=False)["input_ids"][:budget]
+    prefix = tokenizer.decode(ids, skip_special_tokens=True)
+    ends = [m.end() for m in SENTENCE_END.finditer(prefix)]
+    if not ends:
+        return ""
+    trimmed = prefix[:ends[-1]].rstrip()
+    # decode/encode 不一定完全可逆，超出时再退一句
+    while trimmed and count_tokens(trimmed, tokenizer) > budget:
+        ends.pop()
+        trimmed = prefix[:ends[-1]].rstrip() if ends else ""
+    return trimmed
+
+
+def _with_abstract(doc, abstract):
+    packed = dict(doc)
+    packed['abstract'] = abstract
+    packed['content'] = format_content(doc.get('title', ''), abstract)
+    return packed
+
+
+def pack_context(docs, tokenizer, budget=CONTEXT_TOKEN_BUDGET, max_overlap=CONTEXT_MAX_OVERLAP_CHARS):
+    """
+    按 rerank 顺序把文档装入固定的 token 预算：
+      1. 同一 source_file 中相邻 chunk 的重叠部分（chunker 的句子重叠）只保留一份；
+      2. 放不下的文档在句子边界处截断，剩余预算不足一句时停止；
+    使 prompt 预填充的 token 数可预期。
+    Returns:
+      - (装入的文档列表, 已使用的 token 数)
+    """
+    packed = []
+    by_position = {}  # (source_file, chunk_index) -> 已装入的 abstract
+    used = 0
+    sep_tokens = count_tokens(CONTEXT_SEPARATOR, tokenizer)
+
+    for doc in docs:
+        remaining = budget - used - (sep_tokens if packed else 0)
+        if remaining <= 0:
+            break
+        abstract = doc.get('abstract', '') or ''
+        source, idx = doc.get('source_file'), doc.get('chunk_index')
+        if source is not None and idx is not None:
+            prev = by_position.get((source, idx - 1))
+            if prev:
+                abstract = abstract[_overlap_len(prev, abstract, max_overlap):]
+            nxt = by_position.get((source, idx + 1))
+            if nxt:
+                cut = _overlap_len(abstract, nxt, max_overlap)
+                abstract = abstract[:len(abstract) - cut]
+            abstract = abstract.strip()
+            if not abstract:
+                continue
+
+        candidate = _with_abstract(doc, abstract)
+        n_tokens = count_tokens(candidate['content'], tokenizer)
+        if n_tokens > remaining:
+            abstract = _trim_to_sentence(abstract, tokenizer,
+                                         remaining - (n_tokens - count_tokens(abstract, tokenizer)))
+            if not abstract:
+                break
+            candidate = _with_abstract(doc, abstract)
+            n_tokens = count_tokens(candidate['content'], tokenizer)
+            if n_tokens > remaining:
+                break
+
+        packed.append(candidate)
+        used += n_tokens + (sep_tokens if len(packed) > 1 else 0)
+        if source is not None and idx is not None:
+            by_position[(source, idx)] = abstract
+    return packed, used
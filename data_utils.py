@@ -1,38 +1,88 @@
 import json
-import streamlit as st
+from runtime import log
 import re
 import hashlib
-import streamlit as st
+from collections import OrderedDict
+
+def iter_data(filepath):
+    """
+    流式读取处理后的语料：.jsonl 逐行解析，其它扩展名按单个 JSON 数组读取。
+    """
+    if filepath.endswith('.jsonl'):
+        with open(filepath, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+    else:
+        with open(filepath, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
 
 def load_data(filepath):
-    """Loads data from the JSON file."""
+    """Loads data from the JSON / JSONL file."""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        st.write(f"Loaded {len(data)} articles from {filepath}")
+        data = list(iter_data(filepath))
+        log.write(f"Loaded {len(data)} articles from {filepath}")
         return data
     except FileNotFoundError:
-        st.error(f"Data file not found: {filepath}")
+        log.error(f"Data file not found: {filepath}")
         return []
     except json.JSONDecodeError:
-        st.error(f"Error decoding JSON from file: {filepath}")
+        log.error(f"Error decoding JSON from file: {filepath}")
         return []
     except Exception as e:
-        st.error(f"An error occurred loading data: {e}")
+        log.error(f"An error occurred loading data: {e}")
         return [] 
+
+def content_prefix(title) -> str:
+    """embedding / 检索使用的文本中位于正文之前的部分（标题与模板），切块时需从 token 预算中扣除。"""
+    return f"Title: {title or ''}\nAbstract: "
+
+
+def format_content(title, abstract) -> str:
+    """chunk 被 embedding、检索与放入 prompt 时使用的文本。"""
+    return f"{content_prefix(title)}{abstract or ''}".strip()
+
+
+def content_hash(text: str) -> str:
+    """返回文本的 MD5 十六进制摘要，用作去重与增量索引的内容指纹。"""
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
     
-def filter_documents(raw_data, min_length: int = 200):
+def _drop_near_duplicates(batch, near_dup, stats):
+    """用 near_dup.NearDupIndex 过滤一批文档，保持原有顺序。"""
+    duplicates = near_dup.find_duplicates(
+        [doc.get("id") or content_hash(doc.get("title", "") + doc["abstract"]) for doc in batch],
+        [doc["abstract"] for doc in batch],
+        [doc.get("source_file") for doc in batch],
+    )
+    for doc, duplicate_of in zip(batch, duplicates):
+        if duplicate_of is not None:
+            if stats is not None:
+                stats["near_duplicates"] += 1
+            continue
+        if stats is not None:
+            stats["after"] += 1
+        yield doc
+
+
+def iter_filter_documents(docs, min_length: int = 200, max_seen: int = 1_000_000, stats: dict = None,
+                          near_dup=None, near_dup_batch_size: int = 512):
     """
-    过滤文档列表：
-      1. 内容长度过滤：abstract 或 content 字段长度 < min_length 时丢弃
-      2. 去重：基于 title+abstract 的 MD5 哈希去重
-      3. 噪声清洗：去掉常见 HTML 残留标签和广告标记
+    filter_documents 的流式版本：逐条产出通过过滤的文档。
+    去重集合按 LRU 保留最近 max_seen 个哈希，内存占用与语料规模无关。
+    near_dup 为 near_dup.NearDupIndex 时，精确去重后再按批做近重复过滤（与索引中已有的文档及本次先出现的文档比较）。
+    stats 若传入 dict，会累计写入 'before' / 'after' / 'near_duplicates' 计数。
     """
-    before = len(raw_data)
-    seen_hashes = set()
-    cleaned = []
+    seen_hashes = OrderedDict()
+    batch = []
+    if stats is not None:
+        stats.setdefault("before", 0)
+        stats.setdefault("after", 0)
+        stats.setdefault("near_duplicates", 0)
 
-    for doc in raw_data:
+    for doc in docs:
+        if stats is not None:
+            stats["before"] += 1
         text = doc.get("abstract") or doc.get("content") or ""
         # 清理 HTML 残留
         text = re.sub(r'<[^>]+>', '', text)               # 去掉所有 <...> 标签
@@ -45,13 +95,40 @@ def filter_documents(raw_data, min_length: int = 200):
 
         # 去重：基于 title+text 哈希
         title = doc.get("title", "").strip()
-        h = hashlib.md5((title + text).encode("utf-8")).hexdigest()
+        h = content_hash(title + text)
         if h in seen_hashes:
+            seen_hashes.move_to_end(h)
             continue
-        seen_hashes.add(h)
+        seen_hashes[h] = None
+        if len(seen_hashes) > max_seen:
+            seen_hashes.popitem(last=False)
 
-        cleaned.append(doc)
+        if near_dup is not None:
+            batch.append(doc)
+            if len(batch) >= near_dup_batch_size:
+                yield from _drop_near_duplicates(batch, near_dup, stats)
+                batch = []
+            continue
+        if stats is not None:
+            stats["after"] += 1
+        yield doc
+    if batch:
+        yield from _drop_near_duplicates(batch, near_dup, stats)
 
-    after = len(cleaned)
-    st.write(f"🧹 filter_documents: 原始 {before} 条 → 过滤后 {after} 条")
-    return cleaned
\ No newline at end of file
+def filter_documents(raw_data, min_length: int = 200, near_dup_threshold: float = None):
+    """
+    过滤文档列表：
+      1. 内容长度过滤：abstract 或 content 字段长度 < min_length 时丢弃
+      2. 去重：基于 title+abstract 的 MD5 哈希去重
+      3. 噪声清洗：去掉常见 HTML 残留标签和广告标记
+      4. 近重复过滤（可选）：near_dup_threshold 给定时，按 MinHash 估计的 Jaccard 相似度去掉近重复文档
+    """
+    stats = {}
+    near_dup = None
+    if near_dup_threshold:
+        from near_dup import NearDupIndex
+        near_dup = NearDupIndex(threshold=near_dup_threshold)
+    cleaned = list(iter_filter_documents(raw_data, min_length=min_length, stats=stats, near_dup=near_dup))
+    log.write(f"🧹 filter_documents: 原始 {stats['before']} 条 → 过滤后 {stats['after']} 条"
+              f"（近重复 {stats['near_duplicates']} 条）")
+    return cleaned
@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+from config import DOC_STORE_PATH
+from data_utils import format_content
+from runtime import cache_resource
+
+_DOC_COLUMNS = "id, doc_key, title, abstract, source_file, chunk_index"
+# SQLite 默认单条语句最多 999 个绑定参数
+_MAX_SQL_VARS = 900
+
+
+def _row_to_doc(row) -> dict:
+    """把 docs 表的一行转成检索/生成阶段使用的文档 dict（content 按需拼接，不落盘冗余存储）。"""
+    doc_id, doc_key, title, abstract, source_file, chunk_index = row
+    title = title or ""
+    abstract = abstract or ""
+    return {
+        'id': doc_id,
+        'doc_key': doc_key,
+        'title': title,
+        'abstract': abstract,
+        'content': format_content(title, abstract),
+        'source_file': source_file,
+        'chunk_index': chunk_index,
+    }
+
+
+class DocStore(Mapping):
+    """
+    基于 SQLite 的文档存储，按 Milvus 主键 O(1) 懒加载 chunk：
+      - docs 表：id -> title/abstract/source_file/chunk_index/content_hash；
+      - meta 表：索引所对应的 collection、embedding 模型、数据源指纹以及索引版本号；
+      - ingest_seen 表：bulk_ingest.py 本轮已读到的 ID，导入结束后据此删除语料中已不存在的 chunk。
+    content_hash 列同时充当增量索引的 manifest。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " id INTEGER PRIMARY KEY,"
+                " doc_key TEXT,"
+                " title TEXT,"
+                " abstract TEXT,"
+                " source_file TEXT,"
+                " chunk_index INTEGER,"
+                " content_hash TEXT NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            self._conn.execute("CREATE TABLE IF NOT EXISTS ingest_seen (id INTEGER PRIMARY KEY)")
+
+    # --- Mapping 接口：doc_store[doc_id] / doc_id in doc_store / len(doc_store) ---
+    def __getitem__(self, doc_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_DOC_COLUMNS} FROM docs WHERE id = ?", (int(doc_id),)
+            ).fetchone()
+        if row is None:
+            raise KeyError(doc_id)
+        return _row_to_doc(row)
+
+    def __contains__(self, doc_id):
+        try:
+            doc_id = int(doc_id)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM docs WHERE id = ?", (doc_id,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def __iter__(self):
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute("SELECT id FROM docs")]
+        return iter(ids)
+
+    def items(self):
+        """一次 SELECT 流式返回 (id, doc)，避免逐条 __getitem__ 查询。"""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {_DOC_COLUMNS} FROM docs").fetchall()
+        for row in rows:
+            yield row[0], _row_to_doc(row)
+
+    def get_docs(self, doc_ids) -> list[dict]:
+        """按给定顺序批量取回文档，跳过不存在的 ID（用于检索命中后的回表）。"""
+        doc_ids = [int(i) for i in doc_ids]
+        found = {}
+        with self._lock:
+            for start in range(0, len(doc_ids), _MAX_SQL_VARS):
+                batch = doc_ids[start:start + _MAX_SQL_VARS]
+                placeholders = ",".join("?" * len(batch))
+                for row in self._conn.execute(
+                    f"SELECT {_DOC_COLUMNS} FROM docs WHERE id IN ({placeholders})", batch
+                ):
+                    found[row[0]] = _row_to_doc(row)
+        return [found[i] for i in doc_ids if i in found]
+
+    # --- manifest 相关 ---
+    def content_hashes(self) -> dict:
+        """返回 {doc_id: content_hash}，作为增量索引的 manifest。"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT id, content_hash FROM docs"))
+
+    def upsert_docs(self, rows):
+        """
+        rows: 可迭代的 (id, doc_key, title, abstract, source_file, chunk_index, content_hash)。
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docs "
+                "(id, doc_key, title, abstract, source_file, chunk_index, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def delete_docs(self, doc_ids):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM docs WHERE id = ?", [(int(i),) for i in doc_ids]
+            )
+
+    def _select_in(self, sql, doc_ids):
+        """按 _MAX_SQL_VARS 分批执行 `sql`（含一个 IN ({}) 占位）并合并结果行。"""
+        doc_ids = [int(i) for i in doc_ids]
+        rows = []
+        with self._lock:
+            for start in range(0, len(doc_ids), _MAX_SQL_VARS):
+                batch = doc_ids[start:start + _MAX_SQL_VARS]
+                rows.extend(self._conn.execute(sql.format(",".join("?" * len(batch))), batch))
+        return rows
+
+    def content_hashes_for(self, doc_ids) -> dict:
+        """只取给定 ID 的 {doc_id: content_hash}，流式导入时按批对比，不必载入整个 manifest。"""
+        return dict(self._select_in("SELECT id, content_hash FROM docs WHERE id IN ({})", doc_ids))
+
+    # --- 流式导入（bulk_ingest.py）的断点 ---
+    def seen_ids(self, doc_ids) -> set:
+        """给定 ID 中本轮导入已经读到过的部分（数据文件内重复的 doc_key 只保留第一次出现）。"""
+        return {row[0] for row in self._select_in("SELECT id FROM ingest_seen WHERE id IN ({})", doc_ids)}
+
+    def commit_ingest_batch(self, rows, seen_ids, **meta):
+        """
+        一个事务内写入本批变更行、记录本批读到的 ID 并更新断点（meta），
+        崩溃后要么整批可见、要么整批重做。
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docs "
+                "(id, doc_key, title, abstract, source_file, chunk_index, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO ingest_seen (id) VALUES (?)", [(int(i),) for i in seen_ids]
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [(k, str(v)) for k, v in meta.items()]
+            )
+
+    def unseen_ids(self) -> list:
+        """doc store 中本轮导入没有读到的 ID，即语料中已不存在的 chunk。"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT id FROM docs WHERE id NOT IN (SELECT id FROM ingest_seen)"
+            )]
+
+    def clear_ingest(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM ingest_seen")
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM docs")
+            # 索引版本号跨清空保持单调递增，其它进程按版本缓存的结果不会被误用
+            self._conn.execute("DELETE FROM meta WHERE key != 'index_version'")
+            self._conn.execute("DELETE FROM ingest_seen")
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, **values):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [(k, str(v)) for k, v in values.items()]
+            )
+
+    def increment_meta(self, key) -> int:
+        """把整数型 meta 原子地加一并返回新值（多个进程同时导入时不会丢失递增）。"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, '1') "
+                "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                (key,)
+            )
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return int(row[0])
+
+
+@cache_resource
+def get_doc_store():
+    """Returns the process-wide SQLite document store."""
+    return DocStore(DOC_STORE_PATH)
@@ -0,0 +1,243 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows：只做进程内互斥
+    fcntl = None
+
+from config import (
+    EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, EMBEDDING_DIM
+)
+from data_utils import content_hash
+from models import embedding_backend
+from runtime import cache_resource
+
+# SQLite 默认单条语句最多 999 个绑定参数
+_MAX_SQL_VARS = 900
+
+
+class EmbeddingCache:
+    """
+    持久化的 embedding 缓存，可被多个进程（app / server / bulk_ingest）同时使用：
+      - 向量存放在预分配的 float32 memmap 矩阵 (capacity, dim) 中；
+      - index.sqlite3 的 slots 表为每一行记录 文本哈希 与 最近访问时间，写入按批增量提交；
+      - 容量写满时按最近最少使用 (LRU) 淘汰：先提交淘汰、再覆盖向量、最后登记新键，
+        任何时刻崩溃都不会出现键指向别的文本的向量；
+      - 读取持共享文件锁、写入持排他文件锁，跨进程一致；
+      - 模型名、维度或容量与配置不一致时整体失效重建；每次重建生成新的 epoch，
+        其它进程在下一次加锁时发现 epoch 变化即重新打开，不会按旧的行号读到别的模型的向量。
+    不同模型 / 后端各用 cache_dir 下的独立子目录（见 get_embedding_cache），互不重建对方的缓存。
+    """
+
+    def __init__(self, cache_dir, model_name, dim, max_entries):
+        self.cache_dir = cache_dir
+        self.model_name = model_name
+        self.dim = int(dim)
+        self.capacity = int(max_entries)
+        self.vectors_path = os.path.join(cache_dir, "vectors.npy")
+        self._lock = threading.Lock()
+        self._touched = {}  # 命中但尚未落盘的 文本哈希 -> 访问时间
+        self._epoch = None
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock_file = open(os.path.join(cache_dir, "lock"), "a+")
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"),
+                                     timeout=60, check_same_thread=False)
+        with self._locked(exclusive=True):  # _epoch 为 None，此时不做 epoch 检查
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            if not self._load():
+                self._reset()
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """进程内线程锁 + 跨进程文件锁（读共享、写排他）。"""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                if self._epoch is not None:
+                    self._check_epoch()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _check_epoch(self):
+        """其它进程重建过缓存（epoch 变化）时重新打开，必要时按本进程的配置重建。"""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()
+        if row and row[0] == self._epoch:
+            return
+        self._touched = {}
+        if not self._load():
+            self._reset()
+
+    def _load(self):
+        """打开已有缓存；元数据与当前模型配置不一致时返回 False。"""
+        try:
+            meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+            if (meta.get("model_name") != self.model_name
+                    or meta.get("dim") != str(self.dim)
+                    or meta.get("capacity") != str(self.capacity)):
+                return False
+            self._vectors = np.load(self.vectors_path, mmap_mode='r+')
+            if self._vectors.shape != (self.capacity, self.dim):
+                return False
+        except (sqlite3.Error, ValueError, OSError):
+            return False
+        self._epoch = meta.get("epoch")
+        return True
+
+    def _reset(self):
+        """清空缓存并按当前配置重新分配 memmap 文件与 slots 表（调用方持排他锁）。"""
+        with self._conn:
+            self._conn.execute("DROP TABLE IF EXISTS slots")
+            self._conn.execute("DROP TABLE IF EXISTS meta")
+            self._conn.execute(
+                "CREATE TABLE slots (row INTEGER PRIMARY KEY, key TEXT UNIQUE, tick INTEGER NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX slots_tick ON slots (tick)")
+            self._conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.executemany("INSERT INTO slots (row, key, tick) VALUES (?, NULL, 0)",
+                                   ((r,) for r in range(self.capacity)))
+            # 新文件写好后再替换：其它进程仍 mmap 着的旧文件不会被原地截断
+            tmp_path = f"{self.vectors_path}.tmp-{os.getpid()}.npy"
+            self._vectors = np.lib.format.open_memmap(
+                tmp_path, mode='w+', dtype=np.float32,
+                shape=(self.capacity, self.dim)
+            )
+            self._vectors.flush()
+            os.replace(tmp_path, self.vectors_path)
+            self._epoch = uuid.uuid4().hex
+            self._conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+                ("model_name", self.model_name), ("dim", str(self.dim)), ("capacity", str(self.capacity)),
+                ("epoch", self._epoch),
+            ])
+        self._touched = {}
+
+    def __len__(self):
+        with self._locked():
+            return self._conn.execute("SELECT COUNT(*) FROM slots WHERE key IS NOT NULL").fetchone()[0]
+
+    def _rows_for(self, keys) -> dict:
+        """{文本哈希: 行号}，只含已缓存的键。"""
+        found = {}
+        for start in range(0, len(keys), _MAX_SQL_VARS):
+            batch = keys[start:start + _MAX_SQL_VARS]
+            found.update(self._conn.execute(
+                f"SELECT key, row FROM slots WHERE key IN ({','.join('?' * len(batch))})", batch
+            ))
+        return found
+
+    def get_many(self, texts):
+        """
+        批量查询缓存。
+        Returns:
+          - vectors: (len(texts), dim) float32 矩阵，未命中的行为 0
+          - missing: 未命中的下标列表
+        """
+        keys = [content_hash(text) for text in texts]
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        with self._locked():
+            rows = self._rows_for(list(dict.fromkeys(keys)))
+            hit = [i for i, key in enumerate(keys) if key in rows]
+            if hit:
+                out[hit] = self._vectors[[rows[keys[i]] for i in hit]]
+            now = time.time_ns()
+            for i in hit:
+                self._touched[keys[i]] = now
+        missing = [i for i, key in enumerate(keys) if key not in rows]
+        self.hits += len(hit)
+        self.misses += len(missing)
+        return out, missing
+
+    def _save_ticks(self):
+        """把命中时更新的访问时间写入 slots（调用方持排他锁）；只影响淘汰顺序。"""
+        if self._touched:
+            self._conn.executemany("UPDATE slots SET tick = ? WHERE key = ?",
+                                   [(tick, key) for key, tick in self._touched.items()])
+            self._touched = {}
+
+    def put_many(self, texts, vectors):
+        """写入一批向量；没有空行时淘汰最久未访问的行。"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        latest = {}
+        for text, vec in zip(texts, vectors):
+            latest[content_hash(text)] = vec
+        with self._locked(exclusive=True):
+            # 先落盘命中时的访问时间，淘汰顺序才反映最近的读取
+            with self._conn:
+                self._save_ticks()
+            cached = self._rows_for(list(latest))
+            new_keys = [key for key in latest if key not in cached][:self.capacity]
+            if not new_keys:
+                return
+            free = [r for (r,) in self._conn.execute(
+                "SELECT row FROM slots WHERE key IS NULL LIMIT ?", (len(new_keys),))]
+            if len(free) < len(new_keys):
+                evicted = [r for (r,) in self._conn.execute(
+                    "SELECT row FROM slots WHERE key IS NOT NULL ORDER BY tick LIMIT ?",
+                    (len(new_keys) - len(free),))]
+                # 先让被淘汰的键失效并提交，之后才覆盖这些行的向量
+                with self._conn:
+                    self._conn.executemany("UPDATE slots SET key = NULL, tick = 0 WHERE row = ?",
+                                           [(r,) for r in evicted])
+                free += evicted
+            self._vectors[free] = np.stack([latest[key] for key in new_keys])
+            self._vectors.flush()
+            now = time.time_ns()
+            with self._conn:
+                self._conn.executemany("UPDATE slots SET key = ?, tick = ? WHERE row = ?",
+                                       [(key, now, r) for key, r in zip(new_keys, free)])
+
+    def encode(self, texts, embedding_model, **encode_kwargs):
+        """读穿式编码：已缓存的文本直接返回，仅对未命中的文本调用 embedding_model.encode。"""
+        vectors, missing = self.get_many(texts)
+        if missing:
+            new_vectors = embedding_model.encode([texts[i] for i in missing], **encode_kwargs)
+            new_vectors = np.asarray(new_vectors, dtype=np.float32)
+            vectors[missing] = new_vectors
+            self.put_many([texts[i] for i in missing], new_vectors)
+        return vectors
+
+    def flush(self):
+        """把尚未落盘的访问时间写入索引（向量与键在 put_many 中已同步提交）。"""
+        if not self._touched:
+            return
+        with self._locked(exclusive=True):
+            with self._conn:
+                self._save_ticks()
+
+
+def get_embedding_cache():
+    """Returns the process-wide embedding cache for the embedding model and the backend it actually runs on."""
+    return _open_embedding_cache(embedding_backend(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND))
+
+
+def _cache_subdir(model_id) -> str:
+    """模型标识 -> 可读且不冲突的子目录名（模型名可能是含 / 的本地路径）。"""
+    slug = re.sub(r'[^A-Za-z0-9._@-]+', '_', model_id).strip('_')[-64:]
+    return f"{slug}-{hashlib.md5(model_id.encode('utf-8')).hexdigest()[:8]}"
+
+
+@cache_resource
+def _open_embedding_cache(backend):
+    # 量化 / 半精度后端的向量与 fp32 有偏差，不能与其缓存混用；按回退后的实际后端区分，
+    # 各用一个子目录，使用不同后端的进程（如 int8 的 bulk_ingest 与 torch 的 server）不会互相清空
+    model_id = EMBEDDING_MODEL_NAME if backend == "torch" else f"{EMBEDDING_MODEL_NAME}@{backend}"
+    return EmbeddingCache(
+        os.path.join(EMBEDDING_CACHE_DIR, _cache_subdir(model_id)), model_id, EMBEDDING_DIM,
+        EMBEDDING_CACHE_MAX_ENTRIES
+    )
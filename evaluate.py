@@ -0,0 +1,302 @@
+"""
+离线检索评测：在已建好的索引上，用带标注的查询集扫描检索配置
+（检索模式 × TOP_K × nprobe/ef × rerank 深度），报告 recall@k、MRR、nDCG@k 以及每查询的延迟与成本，
+并标出质量-延迟的 Pareto 前沿，用于调 TOP_K / SEARCH_PARAMS / rerank 深度。
+查询文件为 JSONL，每行：
+  {"query": "...", "relevant_ids": [chunk 的 Milvus ID, ...]}
+也可以改用 "relevant_doc_keys"（preprocess 生成的 '{filename}_{i}'）或 "relevant_files"
+（source_file，展开为该文件的全部 chunk）标注；bench/corpus.py 生成的 queries.jsonl 可直接使用。
+查询按批并行执行：每批一次 Milvus 多向量请求、一次 doc store 回表，rerank 由 RerankBatcher 合批。
+用法：python evaluate.py queries.jsonl --modes vector hybrid --top-k 3 10 --search-params 8 16 32 --rerank-depth 0 10
+"""
+import argparse
+import itertools
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import (
+    TOP_K, EMBEDDING_MODEL_NAME, SEARCH_BATCH_SIZE,
+    GRAPH_CANDIDATE_BUDGET, HYBRID_LEXICAL_TOP_K, HYBRID_RRF_K, HYBRID_CANDIDATE_BUDGET
+)
+from index_profile import SEARCH_PARAM_NAMES
+from milvus_utils import (
+    get_milvus_client, setup_milvus_collection, get_index_profile, search_by_vectors, embed_queries,
+    doc_key_to_milvus_id
+)
+from runtime import configure_logging
+
+RETRIEVAL_MODES = ("vector", "graph", "hybrid")
+OBJECTIVES = ("recall", "mrr", "ndcg")
+
+
+def load_queries(path, doc_store):
+    """
+    读取标注查询，把各种标注方式统一为 chunk ID 集合。
+    Returns:
+      - ([(query, {relevant_id, ...})], 因标注无法解析而跳过的查询数)
+    """
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    ids_by_file = None
+    if any("relevant_files" in row for row in rows):
+        ids_by_file = {}
+        for doc_id, doc in doc_store.items():
+            ids_by_file.setdefault(doc["source_file"], []).append(doc_id)
+
+    queries, skipped = [], 0
+    for row in rows:
+        relevant = {int(i) for i in row.get("relevant_ids", [])}
+        relevant.update(doc_key_to_milvus_id(key) for key in row.get("relevant_doc_keys", []))
+        for name in row.get("relevant_files", []):
+            relevant.update(ids_by_file.get(name, []))
+        if row.get("query") and relevant:
+            queries.append((row["query"], relevant))
+        else:
+            skipped += 1
+    return queries, skipped
+
+
+def recall_at_k(ranked, relevant, k):
+    return len(set(ranked[:k]) & relevant) / len(relevant)
+
+
+def reciprocal_rank(ranked, relevant):
+    for rank, doc_id in enumerate(ranked, start=1):
+        if doc_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked, relevant, k):
+    """二值相关度的 nDCG@k。"""
+    dcg = sum(1.0 / math.log2(rank + 1) for rank, doc_id in enumerate(ranked[:k], start=1) if doc_id in relevant)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal
+
+
+def config_grid(modes, top_ks, param_values, rerank_depths):
+    """
+    展开配置网格。rerank 深度超过候选数时与“全部 rerank”等价，只保留一个。
+    Returns:
+      - [{"mode", "top_k", "search_param", "rerank_depth"}]
+    """
+    configs, seen = [], set()
+    for mode, top_k, param, depth in itertools.product(modes, top_ks, param_values, rerank_depths):
+        max_candidates = {"vector": top_k, "graph": GRAPH_CANDIDATE_BUDGET, "hybrid": HYBRID_CANDIDATE_BUDGET}[mode]
+        key = (mode, top_k, param, min(depth, max_candidates))
+        if key in seen:
+            continue
+        seen.add(key)
+        configs.append({"mode": mode, "top_k": top_k, "search_param": param, "rerank_depth": key[3]})
+    return configs
+
+
+def _search_profile(cfg):
+    """当前索引配置，检索参数（nprobe / ef）按 cfg 覆盖；索引结构不变，无需重建。"""
+    profile = dict(get_index_profile())
+    name = SEARCH_PARAM_NAMES.get(profile["index_type"])
+    if name and cfg["search_param"] is not None:
+        profile["search_params"] = dict(profile["search_params"], **{name: cfg["search_param"]})
+    return profile
+
+
+def retrieve_batch(res, cfg, texts, vectors):
+    """
+    按 cfg 检索一批查询，与 retrieval.py 中对应模式的逻辑一致，但整批只发一次 Milvus 请求、
+    只回表一次，且检索参数取自 cfg（不经过按索引版本缓存的 search_many）。
+    Returns:
+      - 每个查询排序后的 chunk ID 列表
+    """
+    from retrieval import expand_seeds, rank_by_similarity, reciprocal_rank_fusion
+    from rerank_utils import rerank_with_scores
+
+    dense = search_by_vectors(res["client"], vectors, cfg["top_k"], profile=_search_profile(cfg))
+    if cfg["mode"] == "graph":
+        candidates = [expand_seeds(res["graph"], ids, budget=GRAPH_CANDIDATE_BUDGET) for ids, _ in dense]
+    elif cfg["mode"] == "hybrid":
+        candidates = [
+            [doc_id for doc_id, _ in reciprocal_rank_fusion(
+                [ids, res["lexical_index"].search(text, HYBRID_LEXICAL_TOP_K)[0]], HYBRID_RRF_K
+            )[:HYBRID_CANDIDATE_BUDGET]]
+            for text, (ids, _) in zip(texts, dense)
+        ]
+    else:
+        candidates = [ids for ids, _ in dense]
+
+    doc_by_id = {doc["id"]: doc for doc in res["doc_store"].get_docs(set(itertools.chain(*candidates)))}
+    rankings = []
+    for text, vector, ids in zip(texts, vectors, candidates):
+        docs = [doc_by_id[i] for i in ids if i in doc_by_id]
+        if cfg["mode"] == "graph":
+            docs, _ = rank_by_similarity(vector, docs, res["embedding_model"])
+        depth = cfg["rerank_depth"]
+        if depth:
+            head, _ = rerank_with_scores(text, docs[:depth], res["reranker"])
+            docs = head + docs[depth:]
+        rankings.append([doc["id"] for doc in docs])
+    return rankings
+
+
+def evaluate_config(res, cfg, queries, vectors, k, batch_size, workers, latency_queries):
+    """
+    1. 并行批量跑全部查询：质量指标、吞吐（qps）与每查询成本（各批耗时之和 / 查询数）；
+    2. 逐条单查询跑前 latency_queries 个查询：p50 / p95 延迟。
+    两遍之前都清空 rerank 分数缓存，避免不同配置之间互相命中。
+    """
+    from rerank_utils import rerank_score_cache
+
+    texts = [q for q, _ in queries]
+
+    def run(start):
+        begin = time.perf_counter()
+        rankings = retrieve_batch(res, cfg, texts[start:start + batch_size], vectors[start:start + batch_size])
+        return rankings, time.perf_counter() - begin
+
+    rerank_score_cache.clear()
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        batches = list(pool.map(run, range(0, len(texts), batch_size)))
+    wall_s = time.perf_counter() - begin
+    rankings = list(itertools.chain(*(r for r, _ in batches)))
+
+    rerank_score_cache.clear()
+    latencies = []
+    for i in range(min(latency_queries, len(texts))):
+        begin = time.perf_counter()
+        retrieve_batch(res, cfg, texts[i:i + 1], vectors[i:i + 1])
+        latencies.append((time.perf_counter() - begin) * 1000)
+
+    relevant = [r for _, r in queries]
+    return dict(
+        cfg,
+        recall=float(np.mean([recall_at_k(r, rel, k) for r, rel in zip(rankings, relevant)])),
+        mrr=float(np.mean([reciprocal_rank(r, rel) for r, rel in zip(rankings, relevant)])),
+        ndcg=float(np.mean([ndcg_at_k(r, rel, k) for r, rel in zip(rankings, relevant)])),
+        qps=len(texts) / wall_s,
+        cost_ms=sum(s for _, s in batches) * 1000 / len(texts),
+        latency_p50_ms=float(np.percentile(latencies, 50)) if latencies else None,
+        latency_p95_ms=float(np.percentile(latencies, 95)) if latencies else None,
+    )
+
+
+def mark_pareto(results, objective, latency_key):
+    """质量不低于、延迟不高于且至少一项严格更好的配置不存在时，该配置在 Pareto 前沿上。"""
+    for r in results:
+        r["pareto"] = not any(
+            o[objective] >= r[objective] and o[latency_key] <= r[latency_key]
+            and (o[objective] > r[objective] or o[latency_key] < r[latency_key])
+            for o in results
+        )
+    return results
+
+
+def format_table(results, k, latency_key):
+    lines = [f"{'':<2}{'mode':<8}{'top_k':>6}{'param':>7}{'rerank':>7}{f'recall@{k}':>11}{'MRR':>8}"
+             f"{f'nDCG@{k}':>9}{'p50_ms':>9}{'p95_ms':>9}{'cost_ms':>9}{'qps':>9}"]
+    fmt = lambda v: "-" if v is None else f"{v:.1f}"
+    for r in sorted(results, key=lambda r: r[latency_key]):
+        lines.append(
+            f"{'*' if r['pareto'] else ' ':<2}{r['mode']:<8}{r['top_k']:>6}{str(r['search_param'] or '-'):>7}"
+            f"{r['rerank_depth'] or '-':>7}{r['recall']:>11.3f}{r['mrr']:>8.3f}{r['ndcg']:>9.3f}"
+            f"{fmt(r['latency_p50_ms']):>9}{fmt(r['latency_p95_ms']):>9}{r['cost_ms']:>9.2f}{r['qps']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency over a labelled query set.")
+    parser.add_argument("queries", help="JSONL，每行 {query, relevant_ids | relevant_doc_keys | relevant_files}")
+    parser.add_argument("--modes", nargs="+", default=list(RETRIEVAL_MODES), choices=RETRIEVAL_MODES)
+    parser.add_argument("--top-k", nargs="+", type=int, default=[TOP_K], help="第一阶段 Milvus 取回的条数")
+    parser.add_argument("--search-params", nargs="+", type=int,
+                        help="nprobe（IVF）或 ef（HNSW）的取值；默认使用当前索引配置")
+    parser.add_argument("--rerank-depth", nargs="+", type=int, default=[0, GRAPH_CANDIDATE_BUDGET],
+                        help="交给 cross-encoder 的候选数，0 表示不 rerank")
+    parser.add_argument("--k", type=int, default=TOP_K, help="recall@k / nDCG@k 的 k")
+    parser.add_argument("--objective", choices=OBJECTIVES, default="ndcg", help="Pareto 前沿使用的质量指标")
+    parser.add_argument("--limit", type=int, help="只评测前 N 个查询")
+    parser.add_argument("--batch-size", type=int, default=64, help="每批查询数")
+    parser.add_argument("--workers", type=int, default=4, help="并行执行批次的线程数")
+    parser.add_argument("--latency-queries", type=int, default=50, help="测量单查询延迟的查询数，0 表示不测")
+    parser.add_argument("--output", help="另存 JSON 报告的路径")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    from doc_store import get_doc_store
+    from models import load_embedding_model
+
+    client = get_milvus_client()
+    if not client or not setup_milvus_collection(client):
+        raise SystemExit("Milvus collection is not available.")
+    doc_store = get_doc_store()
+    queries, skipped = load_queries(args.queries, doc_store)
+    queries = queries[:args.limit] if args.limit else queries
+    if not queries:
+        raise SystemExit(f"No labelled queries in {args.queries} match the indexed chunks.")
+    print(f"Loaded {len(queries)} queries ({skipped} skipped: no resolvable relevant chunks).")
+
+    embedding_model = load_embedding_model(EMBEDDING_MODEL_NAME)
+    if embedding_model is None:
+        raise SystemExit("Failed to load the embedding model, see the error above.")
+    res = {"client": client, "doc_store": doc_store, "embedding_model": embedding_model}
+    if any(args.rerank_depth):
+        from rerank_utils import load_reranker
+        res["reranker"] = load_reranker()
+        if res["reranker"] is None:
+            raise SystemExit("Failed to load the reranker, see the error above.")
+    if "graph" in args.modes:
+        from graph_utils import load_or_build_graph
+        from query_cache import get_index_version
+        res["graph"] = load_or_build_graph(doc_store, embedding_model, get_index_version())
+    if "hybrid" in args.modes:
+        from lexical_index import load_or_build_lexical_index
+        from query_cache import get_index_version
+        res["lexical_index"] = load_or_build_lexical_index(doc_store, get_index_version())
+
+    # 查询编码与配置无关：只做一次，并单独报告其每查询成本（不计入下表的延迟）
+    texts = [q for q, _ in queries]
+    begin = time.perf_counter()
+    vectors = np.concatenate([embed_queries(texts[i:i + SEARCH_BATCH_SIZE], embedding_model)
+                              for i in range(0, len(texts), SEARCH_BATCH_SIZE)])
+    encode_ms = (time.perf_counter() - begin) * 1000 / len(texts)
+
+    profile = get_index_profile()
+    param_name = SEARCH_PARAM_NAMES.get(profile["index_type"])
+    param_values = args.search_params if param_name and args.search_params else [None]
+    if args.search_params and not param_name:
+        print(f"Index type {profile['index_type']} has no search-time parameter; --search-params ignored.")
+    print(f"Index {profile['index_type']} {profile['search_params']}; query encoding {encode_ms:.2f} ms/query "
+          f"(excluded from the latencies below).")
+
+    results = []
+    for cfg in config_grid(args.modes, args.top_k, param_values, args.rerank_depth):
+        try:
+            results.append(evaluate_config(res, cfg, queries, vectors, args.k, args.batch_size,
+                                           args.workers, args.latency_queries))
+        except Exception as e:
+            print(f"skip {cfg}: {e}")
+    if not results:
+        raise SystemExit("No configuration could be evaluated.")
+
+    latency_key = "latency_p95_ms" if args.latency_queries else "cost_ms"
+    mark_pareto(results, args.objective, latency_key)
+    print()
+    print(format_table(results, args.k, latency_key))
+    print(f"\n* Pareto-optimal for {args.objective} vs {latency_key}; "
+          f"param = {param_name or 'n/a'}, cost_ms = worker time per query in batched runs.")
+
+    if args.output:
+        report = {
+            "queries": len(queries), "skipped": skipped, "k": args.k, "objective": args.objective,
+            "index_profile": profile, "encode_ms_per_query": encode_ms, "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
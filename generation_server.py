@@ -0,0 +1,411 @@
+import argparse
+import queue
+import threading
+import time
+from collections import deque
+
+import torch
+from transformers import DynamicCache
+
+from kv_cache import cache_to_legacy, cache_from_legacy, prefix_kv_cache
+from metrics import span, observe, count
+from runtime import cache_resource, configure_logging, log
+from config import (
+    MAX_NEW_TOKENS_GEN, TEMPERATURE, TOP_P, REPETITION_PENALTY,
+    GEN_MAX_BATCH_SIZE, GEN_DO_SAMPLE
+)
+
+
+class GenerationRequest:
+    """一次生成请求：调度线程写入文本片段，调用方通过 stream() 消费。"""
+
+    _END = object()
+
+    def __init__(self, prompt_ids, max_new_tokens, prefix_segments=None):
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        # 可复用 KV 的前缀分段（如 [header_ids, context_ids]），拼接后是 prompt_ids 的前缀
+        self.prefix_segments = prefix_segments
+        self.cached_tokens = 0
+        self.generated = []
+        self.error = None
+        self.cancelled = threading.Event()
+        self.enqueued_at = time.perf_counter()
+        self.started_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        self._emitted_text = ""
+        self._out = queue.Queue()
+
+    def cancel(self):
+        """调用方放弃请求（如客户端断开），调度器会在下一个 decode 步移除该序列。"""
+        self.cancelled.set()
+
+    def stream(self):
+        """逐段产出生成的文本；生成器被提前关闭时自动取消请求。"""
+        try:
+            while True:
+                item = self._out.get()
+                if item is self._END:
+                    break
+                yield item
+        finally:
+            if self.finished_at is None:
+                self.cancel()
+        if self.error is not None:
+            raise self.error
+
+    def latency(self) -> dict:
+        """排队等待 / 首 token / 总耗时（秒）。"""
+        def since_enqueue(t):
+            return t - self.enqueued_at if t is not None else None
+        return {
+            "queue_wait_s": since_enqueue(self.started_at),
+            "ttft_s": since_enqueue(self.first_token_at),
+            "total_s": since_enqueue(self.finished_at),
+            "new_tokens": len(self.generated),
+        }
+
+
+class GenerationScheduler:
+    """
+    独占生成模型的调度器，多个会话并发提交请求：
+      - 新请求左侧 padding 后合批预填充；带前缀分段的请求从 prefix_kv_cache 取出
+        header+context 的 KV，只预填充问题部分；
+      - decode 按迭代级别连续合批：每一步都可以有新序列加入、已完成序列退出，
+        不必等整批结束。
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = GEN_MAX_BATCH_SIZE,
+                 max_new_tokens: int = MAX_NEW_TOKENS_GEN, do_sample: bool = GEN_DO_SAMPLE,
+                 temperature: float = TEMPERATURE, top_p: float = TOP_P,
+                 repetition_penalty: float = REPETITION_PENALTY):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+        self.eos_token_id = tokenizer.eos_token_id
+        self.device = model.device
+
+        self._pending = queue.Queue()
+        self._active = []          # 与 batch 行一一对应的 GenerationRequest
+        self._cache = None         # legacy KV: tuple((k, v) per layer)，形状 [B, H, L, D]
+        self._mask = None          # [B, L] attention mask（左侧 padding 为 0）
+        self._last_tokens = None   # [B] 上一步生成的 token
+        self._positions = None     # [B] 下一个 token 的 position id
+        self._completed = deque(maxlen=1000)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+        self._thread.start()
+
+    # --- 对外接口 ---
+    def submit(self, prompt, max_new_tokens: int = None, prefix_segments=None) -> GenerationRequest:
+        """
+        提交 prompt（字符串或 token id 列表），立即返回可流式消费的请求对象。
+        prefix_segments 为 prompt 开头依次拼接的 token 分段，其 KV 经 prefix_kv_cache 复用。
+        """
+        if isinstance(prompt, str):
+            prompt = self.tokenizer(prompt)["input_ids"]
+        request = GenerationRequest(prompt, max_new_tokens or self.max_new_tokens, prefix_segments)
+        self._pending.put(request)
+        return request
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending.qsize()
+
+    def stats(self) -> dict:
+        completed = list(self._completed)
+
+        def pct(key, q):
+            values = sorted(c[key] for c in completed if c[key] is not None)
+            return values[min(len(values) - 1, int(q * len(values)))] if values else None
+        return {
+            "queue_depth": self.queue_depth,
+            "active": len(self._active),
+            "completed": len(completed),
+            "ttft_p50_s": pct("ttft_s", 0.5),
+            "ttft_p95_s": pct("ttft_s", 0.95),
+            "total_p50_s": pct("total_s", 0.5),
+            "total_p95_s": pct("total_s", 0.95),
+        }
+
+    def shutdown(self):
+        self._stop.set()
+        self._thread.join()
+
+    # --- 调度循环 ---
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with torch.no_grad():
+                    self._admit()
+                    if not self._active:
+                        continue
+                    with span("scheduler_decode_step"):
+                        self._decode_step()
+            except Exception as e:
+                # 出错时让当前批次的所有请求失败，调度器继续服务后续请求
+                for request in self._active:
+                    request.error = e
+                    self._finish(request)
+                self._reset_batch()
+
+    def _admit(self):
+        """把等待中的请求合批预填充后并入正在 decode 的批次。"""
+        free = self.max_batch_size - len(self._active)
+        new = []
+        try:
+            # 没有进行中的序列时阻塞等待，避免空转
+            timeout = 0.05 if not self._active else 0
+            while len(new) < free:
+                request = self._pending.get(timeout=timeout) if not new and timeout else \
+                    self._pending.get_nowait()
+                if not request.cancelled.is_set():
+                    new.append(request)
+        except queue.Empty:
+            pass
+        if not new:
+            return
+        try:
+            with span("scheduler_prefill"):
+                self._prefill(new)
+        except Exception as e:
+            # 预填充失败只影响新加入的请求，进行中的批次不受影响
+            for request in new:
+                if request not in self._active:
+                    request.error = e
+                    self._finish(request)
+
+    def _prefill(self, requests):
+        now = time.perf_counter()
+        for request in requests:
+            request.started_at = now
+        plain = []
+        for request in requests:
+            if not request.prefix_segments:
+                plain.append(request)
+                continue
+            try:
+                self._prefill_with_prefix(request)
+            except Exception as e:
+                log.write(f"Prefix KV cache unavailable, prefilling full prompt: {e}")
+                request.cached_tokens = 0
+                plain.append(request)
+        if plain:
+            self._prefill_batch(plain)
+
+    def _prefill_with_prefix(self, request):
+        """单个请求：前缀 KV 取自 prefix_kv_cache（未命中部分在其中补算），这里只预填充剩余后缀。"""
+        past_key_values, request.cached_tokens = prefix_kv_cache.prefill(self.model, request.prefix_segments)
+        prefix_len = sum(len(seg) for seg in request.prefix_segments)
+        suffix = request.prompt_ids[prefix_len:]
+        if not suffix:
+            raise ValueError("prompt has no tokens after the cached prefix")
+        total = len(request.prompt_ids)
+        input_ids = torch.tensor([suffix], device=self.device)
+        mask = torch.ones((1, total), dtype=torch.long, device=self.device)
+        position_ids = torch.arange(prefix_len, total, device=self.device)[None, :]
+        out = self.model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids,
+                         past_key_values=past_key_values, use_cache=True)
+        next_tokens = self._sample(out.logits[:, -1, :], [request])
+        offset = len(self._active)
+        self._merge([request], cache_to_legacy(out.past_key_values), mask, next_tokens, mask.sum(-1))
+        self._emit(next_tokens, offset)
+
+    def _prefill_batch(self, requests):
+        max_len = max(len(r.prompt_ids) for r in requests)
+        pad_id = self.tokenizer.pad_token_id if self.tokenizer.pad_token_id is not None else self.eos_token_id
+        input_ids = torch.full((len(requests), max_len), pad_id, dtype=torch.long)
+        mask = torch.zeros((len(requests), max_len), dtype=torch.long)
+        for i, request in enumerate(requests):
+            n = len(request.prompt_ids)
+            input_ids[i, max_len - n:] = torch.tensor(request.prompt_ids)
+            mask[i, max_len - n:] = 1
+        input_ids, mask = input_ids.to(self.device), mask.to(self.device)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)
+
+        out = self.model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids,
+                         past_key_values=DynamicCache(), use_cache=True)
+        cache = cache_to_legacy(out.past_key_values)
+        next_tokens = self._sample(out.logits[:, -1, :], requests)
+        positions = mask.sum(-1)
+        offset = len(self._active)
+        self._merge(requests, cache, mask, next_tokens, positions)
+        self._emit(next_tokens, offset)
+
+    def _merge(self, requests, cache, mask, next_tokens, positions):
+        """左侧补齐 KV 长度后在 batch 维拼接。"""
+        if not self._active:
+            self._active = list(requests)
+            self._cache, self._mask = cache, mask
+            self._last_tokens, self._positions = next_tokens, positions
+            return
+        old_len, new_len = self._mask.shape[1], mask.shape[1]
+        target = max(old_len, new_len)
+
+        def left_pad(kv, length):
+            if kv.shape[2] == length:
+                return kv
+            pad = kv.new_zeros(kv.shape[0], kv.shape[1], length - kv.shape[2], kv.shape[3])
+            return torch.cat([pad, kv], dim=2)
+
+        def pad_mask(m, length):
+            if m.shape[1] == length:
+                return m
+            return torch.cat([m.new_zeros(m.shape[0], length - m.shape[1]), m], dim=1)
+
+        self._cache = tuple(
+            (torch.cat([left_pad(k_old, target), left_pad(k_new, target)], dim=0),
+             torch.cat([left_pad(v_old, target), left_pad(v_new, target)], dim=0))
+            for (k_old, v_old), (k_new, v_new) in zip(self._cache, cache)
+        )
+        self._mask = torch.cat([pad_mask(self._mask, target), pad_mask(mask, target)], dim=0)
+        self._last_tokens = torch.cat([self._last_tokens, next_tokens])
+        self._positions = torch.cat([self._positions, positions])
+        self._active.extend(requests)
+
+    def _decode_step(self):
+        mask = torch.cat([self._mask, self._mask.new_ones(self._mask.shape[0], 1)], dim=1)
+        out = self.model(
+            input_ids=self._last_tokens[:, None],
+            attention_mask=mask,
+            position_ids=self._positions[:, None],
+            past_key_values=cache_from_legacy(self._cache),
+            use_cache=True,
+        )
+        self._cache = cache_to_legacy(out.past_key_values)
+        self._mask = mask
+        self._positions = self._positions + 1
+        self._last_tokens = self._sample(out.logits[:, -1, :], self._active)
+        self._emit(self._last_tokens)
+
+    def _sample(self, logits, requests):
+        """逐行应用 repetition penalty，再按配置做贪心或 top-p 采样。"""
+        logits = logits.float()
+        if self.repetition_penalty and self.repetition_penalty != 1.0:
+            for i, request in enumerate(requests):
+                seen = torch.tensor(sorted(set(request.prompt_ids + request.generated)),
+                                    device=logits.device)
+                scores = logits[i, seen]
+                logits[i, seen] = torch.where(scores < 0, scores * self.repetition_penalty,
+                                              scores / self.repetition_penalty)
+        if not self.do_sample:
+            return logits.argmax(dim=-1)
+        probs = torch.softmax(logits / max(self.temperature, 1e-5), dim=-1)
+        sorted_probs, sorted_idx = probs.sort(dim=-1, descending=True)
+        cutoff = sorted_probs.cumsum(-1) - sorted_probs > self.top_p
+        sorted_probs = sorted_probs.masked_fill(cutoff, 0.0)
+        choice = torch.multinomial(sorted_probs / sorted_probs.sum(-1, keepdim=True), 1)
+        return sorted_idx.gather(-1, choice).squeeze(-1)
+
+    def _emit(self, tokens, offset: int = 0):
+        """
+        把新 token 增量解码给 batch 中第 offset 行起的各请求，
+        并移除已结束（EOS / 达到上限 / 被取消）的序列。
+        """
+        now = time.perf_counter()
+        keep = list(range(offset))
+        for i, (request, token) in enumerate(zip(self._active[offset:], tokens.tolist()), start=offset):
+            done = request.cancelled.is_set()
+            if not done and token != self.eos_token_id:
+                request.generated.append(token)
+                if request.first_token_at is None:
+                    request.first_token_at = now
+                text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+                # 末尾是不完整的多字节字符时先不输出
+                if not text.endswith("\ufffd") and len(text) > len(request._emitted_text):
+                    request._out.put(text[len(request._emitted_text):])
+                    request._emitted_text = text
+            done = done or token == self.eos_token_id or len(request.generated) >= request.max_new_tokens
+            if done:
+                self._finish(request)
+            else:
+                keep.append(i)
+        if len(keep) < len(self._active):
+            self._select(keep)
+
+    def _finish(self, request):
+        request.finished_at = time.perf_counter()
+        latency = request.latency()
+        self._completed.append(latency)
+        request._out.put(GenerationRequest._END)
+        # 与直接生成相同的阶段划分：排队 -> prefill（至首个 token）-> decode
+        if latency["queue_wait_s"] is not None:
+            observe("queue_wait", latency["queue_wait_s"], path="scheduler")
+        if latency["ttft_s"] is not None:
+            observe("prefill", latency["ttft_s"] - (latency["queue_wait_s"] or 0.0), path="scheduler")
+            observe("decode", latency["total_s"] - latency["ttft_s"], path="scheduler")
+        count("rag_generated_tokens_total", latency["new_tokens"], path="scheduler",
+              help="Tokens generated, by generation path.")
+
+    def _select(self, rows):
+        """只保留 rows 对应的序列，并裁掉所有序列共有的左侧 padding 列。"""
+        if not rows:
+            self._reset_batch()
+            return
+        self._active = [self._active[i] for i in rows]
+        idx = torch.tensor(rows, device=self._mask.device)
+        mask = self._mask.index_select(0, idx)
+        start = int((mask.sum(0) > 0).int().argmax())
+        self._mask = mask[:, start:]
+        self._cache = tuple(
+            (k.index_select(0, idx)[:, :, start:], v.index_select(0, idx)[:, :, start:])
+            for k, v in self._cache
+        )
+        self._last_tokens = self._last_tokens.index_select(0, idx)
+        self._positions = self._positions.index_select(0, idx)
+
+    def _reset_batch(self):
+        self._active = []
+        self._cache = self._mask = self._last_tokens = self._positions = None
+
+
+@cache_resource
+def get_generation_scheduler(_model, _tokenizer):
+    """Returns the process-wide scheduler that owns the generation model."""
+    return GenerationScheduler(_model, _tokenizer)
+
+
+def main(argv=None):
+    """在 CPU 上用少量并发请求试跑调度器，打印每个请求的延迟与整体统计。"""
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    from config import GENERATION_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Continuous-batching generation scheduler smoke run.")
+    parser.add_argument("--model", default=GENERATION_MODEL_NAME, help="模型名或本地路径")
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--max-batch-size", type=int, default=GEN_MAX_BATCH_SIZE)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+    model = AutoModelForCausalLM.from_pretrained(args.model, trust_remote_code=True,
+                                                 torch_dtype=torch.float32)
+    model.eval()
+    scheduler = GenerationScheduler(model, tokenizer, max_batch_size=args.max_batch_size,
+                                    max_new_tokens=args.max_new_tokens)
+    prompts = [f"Question {i}: what is {'very ' * i}important about health?\nAnswer:"
+               for i in range(args.requests)]
+    start = time.perf_counter()
+    requests = []
+    for prompt in prompts:
+        requests.append(scheduler.submit(prompt))
+        time.sleep(0.01)  # 错开到达时间，让后到的请求加入进行中的批次
+    for request in requests:
+        "".join(request.stream())
+        print(request.latency())
+    elapsed = time.perf_counter() - start
+    total_tokens = sum(len(r.generated) for r in requests)
+    print(scheduler.stats())
+    print(f"{total_tokens} tokens in {elapsed:.2f}s ({total_tokens / elapsed:.1f} tokens/s)")
+    scheduler.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,231 @@
-import streamlit as st
-import networkx as nx
+from runtime import cache_resource, log, atomic_dir, dir_lock
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
-@st.cache_resource
-def build_similarity_graph(id_to_embedding_map: dict, threshold: float = 0.7) -> nx.Graph:
+from config import GRAPH_SIMILARITY_THRESHOLD, GRAPH_TILE_SIZE, GRAPH_BUILD_WORKERS, GRAPH_PATH
+
+from embedding_cache import get_embedding_cache
+
+def load_doc_embeddings(doc_store, embedding_model) -> dict:
+    """
+    通过持久化 embedding 缓存取回 doc store 中所有文档的向量，
+    只有缓存中没有的文本才会调用 embedding_model 编码。
+    返回 {doc_id: embedding}，可直接传给 build_similarity_graph。
+    """
+    ids, texts = [], []
+    for doc_id, doc in doc_store.items():
+        ids.append(doc_id)
+        texts.append(doc['content'])
+    embs = get_embedding_cache().encode(texts, embedding_model)
+    return dict(zip(ids, embs))
+
+def _similarity_tile(X, row_start, col_start, tile_size, threshold):
+    """计算一个 tile 内的余弦相似度，只保留上三角（col > row）且 >= threshold 的边。"""
+    block = X[row_start:row_start + tile_size] @ X[col_start:col_start + tile_size].T
+    r, c = np.nonzero(block >= threshold)
+    w = block[r, c]
+    r = r + row_start
+    c = c + col_start
+    upper = c > r
+    return r[upper], c[upper], w[upper]
+
+
+def build_similarity_adjacency(embs, threshold: float = GRAPH_SIMILARITY_THRESHOLD,
+                               tile_size: int = GRAPH_TILE_SIZE, workers: int = None):
+    """
+    分块计算阈值化的余弦近邻，返回对称 CSR 邻接 (indptr, indices, weights)。
+    每次只在内存中保留 tile_size x tile_size 的相似度块，多个 tile 由线程池并行计算
+    （矩阵乘法在 BLAS 中释放 GIL）。每行的邻居按权重降序排列。
+    """
+    X = np.asarray(embs, dtype=np.float32)
+    n = len(X)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    X = X / np.maximum(norms, 1e-12)
+
+    starts = range(0, n, tile_size)
+    tiles = [(i, j) for i in starts for j in starts if j >= i]
+    workers = workers or GRAPH_BUILD_WORKERS or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(
+            lambda t: _similarity_tile(X, t[0], t[1], tile_size, threshold), tiles
+        ))
+
+    if parts:
+        rows = np.concatenate([p[0] for p in parts])
+        cols = np.concatenate([p[1] for p in parts])
+        weights = np.concatenate([p[2] for p in parts])
+    else:
+        rows = cols = np.zeros(0, dtype=np.int64)
+        weights = np.zeros(0, dtype=np.float32)
+
+    # 无向图：两个方向各存一份，按 (行, 权重降序) 排序后即为 CSR
+    rows, cols = np.concatenate([rows, cols]), np.concatenate([cols, rows])
+    weights = np.concatenate([weights, weights])
+    order = np.lexsort((-weights, rows))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols[order].astype(np.int32), weights[order].astype(np.float32)
+
+
+class CSRGraph:
+    """
+    紧凑的数组图表示：节点 i 的邻居为 indices[indptr[i]:indptr[i+1]]，按边权降序排列。
+    ids[i] 为节点 i 对应的文档 ID。
+    """
+
+    def __init__(self, ids, indptr, indices, weights):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self._order = np.argsort(self.ids, kind='stable')
+        self._sorted_ids = self.ids[self._order]
+
+    @property
+    def num_nodes(self):
+        return len(self.ids)
+
+    @property
+    def num_edges(self):
+        return len(self.indices) // 2
+
+    def positions(self, doc_ids):
+        """把文档 ID 映射为节点下标，不在图中的 ID 被忽略。"""
+        doc_ids = np.asarray(list(doc_ids), dtype=np.int64)
+        if not len(doc_ids) or not self.num_nodes:
+            return np.zeros(0, dtype=np.int64)
+        loc = np.minimum(np.searchsorted(self._sorted_ids, doc_ids), self.num_nodes - 1)
+        found = self._sorted_ids[loc] == doc_ids
+        return self._order[loc[found]]
+
+    def expand(self, seed_ids, hops: int = 1, min_weight: float = None, top_k: int = None):
+        """
+        多源、限跳数的 frontier 扩展，所有种子在同一次向量化操作中处理。
+        Args:
+          - min_weight: 只沿权重 >= min_weight 的边扩展
+          - top_k: 每个节点只沿权重最高的 top_k 条边扩展
+        Returns:
+          - 种子及 hops 跳内邻居的文档 ID 数组：先是种子（保持给定顺序），之后逐跳排列，
+            同一跳内按连到该节点的最大边权降序，调用方截断时保留最相似的邻居
+        """
+        visited = np.zeros(self.num_nodes, dtype=bool)
+        frontier = self.positions(seed_ids)
+        _, first = np.unique(frontier, return_index=True)
+        frontier = frontier[np.sort(first)]
+        visited[frontier] = True
+        reached = [frontier]
+        for _ in range(hops):
+            if not len(frontier):
+                break
+            starts = self.indptr[frontier]
+            ends = self.indptr[frontier + 1]
+            if top_k is not None:
+                ends = np.minimum(ends, starts + top_k)
+            lengths = ends - starts
+            total = int(lengths.sum())
+            if total == 0:
+                break
+            # 把各节点的 [start, end) 区间拼接成一个扁平的边下标数组
+            offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+            if min_weight is not None:
+                offsets = offsets[self.weights[offsets] >= min_weight]
+            neighbors, weights = self.indices[offsets], self.weights[offsets]
+            unseen = ~visited[neighbors]
+            # 按边权降序后取每个邻居第一次出现的位置，即其最大边权的名次
+            neighbors = neighbors[unseen][np.argsort(-weights[unseen], kind='stable')]
+            _, first = np.unique(neighbors, return_index=True)
+            frontier = neighbors[np.sort(first)].astype(np.int64)
+            visited[frontier] = True
+            reached.append(frontier)
+        return self.ids[np.concatenate(reached)]
+
+    def save(self, path, **meta):
+        """
+        保存为目录下的若干 .npy 文件 + meta.json，加载时可直接 mmap。
+        经 atomic_dir 先写临时目录再换入，中途失败或并发读取时不会看到新旧文件混杂的目录。
+        """
+        with atomic_dir(path) as tmp_path:
+            for name in ("ids", "indptr", "indices", "weights"):
+                np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+            with open(os.path.join(tmp_path, "meta.json"), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path):
+        """Returns (graph, meta)."""
+        with dir_lock(path):
+            with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            arrays = [
+                np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                for name in ("ids", "indptr", "indices", "weights")
+            ]
+        return cls(*arrays), meta
+
+
+@cache_resource
+def build_similarity_graph(id_to_embedding_map: dict, threshold: float = GRAPH_SIMILARITY_THRESHOLD) -> CSRGraph:
     """
     构建基于 cosine 相似度的无向图：
     节点：每个文档 ID；
-    边：当两节点相似度 >= threshold 时连接。
+    边：当两节点相似度 >= threshold 时连接（由 build_similarity_adjacency 分块计算）。
     """
-    G = nx.Graph()
     ids = list(id_to_embedding_map.keys())
+    if not ids:
+        return CSRGraph([], [0], [], [])
     embs = np.stack([id_to_embedding_map[i] for i in ids])
-    sims = cosine_similarity(embs)
-    for i, u in enumerate(ids):
-        G.add_node(u)
-        for j, v in enumerate(ids[i+1:], start=i+1):
-            if sims[i, j] >= threshold:
-                G.add_edge(u, v, weight=float(sims[i, j]))
-    return G
+    return CSRGraph(ids, *build_similarity_adjacency(embs, threshold))
+
+
+def _graph_fingerprint(doc_store, threshold):
+    """doc store 中全部 (id, content_hash) 与阈值的摘要；语料或阈值变化时图需要重建。"""
+    h = hashlib.md5(f"{threshold}".encode("utf-8"))
+    for doc_id, chash in sorted(doc_store.content_hashes().items()):
+        h.update(f"{doc_id}:{chash};".encode("utf-8"))
+    return h.hexdigest()
+
+
+@cache_resource(latest_per=("path",))
+def load_or_build_graph(_doc_store, _embedding_model, index_version: int = 0, path: str = GRAPH_PATH,
+                        threshold: float = GRAPH_SIMILARITY_THRESHOLD) -> CSRGraph:
+    """
+    优先从磁盘加载相似度图；语料或阈值变化时重新构建并持久化。
+    index_version 只参与缓存键：索引内容变化（bump_index_version）后重新加载，
+    同一路径只缓存最新加载的一份，旧版本的图随之释放。
+    """
+    fingerprint = _graph_fingerprint(_doc_store, threshold)
+    try:
+        graph, meta = CSRGraph.load(path)
+        if meta.get("fingerprint") == fingerprint:
+            log.write(f"Loaded similarity graph ({graph.num_nodes} nodes, {graph.num_edges} edges).")
+            return graph
+    except (FileNotFoundError, json.JSONDecodeError, ValueError):
+        pass
+
+    log.write("Building similarity graph...")
+    start = time.time()
+    embeddings = load_doc_embeddings(_doc_store, _embedding_model)
+    ids = list(embeddings.keys())
+    if ids:
+        graph = CSRGraph(ids, *build_similarity_adjacency(np.stack(list(embeddings.values())), threshold))
+    else:
+        graph = CSRGraph([], [0], [], [])
+    graph.save(path, fingerprint=fingerprint, threshold=threshold)
+    log.write(f"Built similarity graph ({graph.num_nodes} nodes, {graph.num_edges} edges) "
+             f"in {time.time() - start:.2f}s.")
+    return graph
+
 
-def retrieve_graph_neighbors(graph: nx.Graph, seed_ids: list[int], hops: int = 1) -> set[int]:
+def retrieve_graph_neighbors(graph: CSRGraph, seed_ids: list[int], hops: int = 1,
+                             min_weight: float = None, top_k: int = None) -> set[int]:
     """
-    从 seed_ids 开始做 BFS，扩展 hops 跳范围内的所有节点。
-    返回 seed_ids 与它们的邻居集合。
+    从 seed_ids 开始做多源 frontier 扩展，返回 hops 跳范围内的所有节点（含 seed_ids）。
+    min_weight / top_k 可限制每个节点沿哪些边扩展。
     """
     neighbors = set(seed_ids)
-    for u in seed_ids:
-        # single_source_shortest_path_length 的 cutoff 指 hops 跳数
-        sp = nx.single_source_shortest_path_length(graph, u, cutoff=hops)
-        neighbors |= set(sp.keys())
+    neighbors.update(int(i) for i in graph.expand(seed_ids, hops, min_weight, top_k))
     return neighbors
@@ -0,0 +1,85 @@
+import json
+import os
+
+from config import (
+    EMBEDDING_DIM, INDEX_METRIC_TYPE, INDEX_TYPE, INDEX_PARAMS, SEARCH_PARAMS,
+    INDEX_PROFILE_PATH
+)
+
+# 每种索引类型的检索时参数名（IVF 系列为 nprobe，HNSW 系列为 ef）
+SEARCH_PARAM_NAMES = {
+    "FLAT": None,
+    "BRUTE_FORCE": None,
+    "IVF_FLAT": "nprobe",
+    "IVF_SQ8": "nprobe",
+    "IVF_PQ": "nprobe",
+    "HNSW": "ef",
+    "HNSW_SQ": "ef",
+}
+
+# Milvus Lite 重启后只能加载这些索引类型（IVF_PQ 可以建，但之后无法 load）
+MILVUS_LITE_INDEX_TYPES = ("FLAT", "BRUTE_FORCE", "IVF_FLAT", "IVF_SQ8", "HNSW", "HNSW_SQ")
+
+
+def is_milvus_lite(uri) -> bool:
+    """本地文件路径（而非 http(s)/tcp 地址）对应 Milvus Lite。"""
+    return "://" not in uri
+
+
+def default_index_profile() -> dict:
+    """config.py 中的索引配置，尚未运行 index_tuner.py 时使用。"""
+    return {
+        "index_type": INDEX_TYPE,
+        "metric_type": INDEX_METRIC_TYPE,
+        "index_params": dict(INDEX_PARAMS),
+        "search_params": dict(SEARCH_PARAMS),
+    }
+
+
+def load_index_profile(path=INDEX_PROFILE_PATH) -> dict:
+    """
+    读取 index_tuner.py 写入的当前索引配置；文件不存在、损坏或度量类型与 config 不一致时
+    退回默认配置。
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return default_index_profile()
+    if (profile.get("index_type") not in SEARCH_PARAM_NAMES
+            or profile.get("metric_type") != INDEX_METRIC_TYPE):
+        return default_index_profile()
+    profile.setdefault("index_params", {})
+    profile.setdefault("search_params", {})
+    return profile
+
+
+def save_index_profile(profile, path=INDEX_PROFILE_PATH):
+    """原子地写入索引配置（先写临时文件再替换）。"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def profile_signature(profile) -> str:
+    """决定索引结构的部分（类型 / 度量 / 构建参数）；检索参数变化不需要重建索引。"""
+    return json.dumps(
+        [profile["index_type"], profile["metric_type"], profile.get("index_params", {})],
+        sort_keys=True
+    )
+
+
+def bytes_per_vector(index_type, index_params, dim=EMBEDDING_DIM) -> float:
+    """估算每条向量在索引中占用的字节数（不含 IVF 聚类中心等与条数无关的部分）。"""
+    graph_links = 2 * index_params.get("M", 16) * 4  # HNSW 底层每个节点约 2M 条 int32 边
+    if index_type == "IVF_SQ8":
+        return float(dim)
+    if index_type == "IVF_PQ":
+        return index_params.get("m", dim // 8) * index_params.get("nbits", 8) / 8
+    if index_type == "HNSW":
+        return 4.0 * dim + graph_links
+    if index_type == "HNSW_SQ":
+        return float(dim) + graph_links
+    return 4.0 * dim
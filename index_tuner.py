@@ -0,0 +1,282 @@
+"""
+为当前 collection 选择索引配置：
+  1. 从 Milvus 取出全部向量，随机留出一组查询向量，用 numpy 精确检索得到真实近邻；
+  2. 在临时 collection 中依次构建候选索引（IVF_FLAT / IVF_SQ8 / IVF_PQ / HNSW / HNSW_SQ），
+     扫描 nprobe / ef，测量 recall@k 与单查询延迟；
+  3. 在满足延迟目标的候选中，选 recall 达标且每条向量占用最小的配置，写入 INDEX_PROFILE_PATH。
+下次启动（或加 --apply）时 setup_milvus_collection 会按新配置重建索引。
+用法：python index_tuner.py --latency-target-ms 30 --min-recall 0.95 [--apply]
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+from pymilvus import DataType, CollectionSchema, FieldSchema
+
+from config import (
+    MILVUS_LITE_DATA_PATH, COLLECTION_NAME, EMBEDDING_DIM, EMBEDDING_MODEL_NAME,
+    INDEX_METRIC_TYPE, INDEX_PROFILE_PATH,
+    INDEX_TUNER_K, INDEX_TUNER_QUERIES, INDEX_TUNER_LATENCY_TARGET_MS, INDEX_TUNER_MIN_RECALL
+)
+from index_profile import (
+    SEARCH_PARAM_NAMES, MILVUS_LITE_INDEX_TYPES, bytes_per_vector, is_milvus_lite, save_index_profile
+)
+from milvus_utils import (
+    get_milvus_client, get_entity_count, create_vector_index, apply_index_profile, search_by_vectors, embed_queries
+)
+from runtime import configure_logging
+
+TUNE_COLLECTION = f"{COLLECTION_NAME}__tune"
+INSERT_BATCH_SIZE = 5000
+
+
+def fetch_vectors(client, collection_name=COLLECTION_NAME, batch_size=INSERT_BATCH_SIZE):
+    """
+    用 query_iterator 分批取出 collection 中的全部 (id, 向量)。
+    按行数预分配 int64 / float32 数组逐页写入，不经过嵌套的 Python 列表；
+    期间有新写入导致行数超出时按倍数扩容。
+    """
+    client.load_collection(collection_name)
+    capacity = max(get_entity_count(client, collection_name), 1)
+    ids = np.empty(capacity, dtype=np.int64)
+    vectors = np.empty((capacity, EMBEDDING_DIM), dtype=np.float32)
+    n = 0
+    iterator = client.query_iterator(collection_name, batch_size=batch_size, filter="id >= 0",
+                                     output_fields=["id", "embedding"])
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            if n + len(batch) > len(ids):
+                capacity = max(2 * len(ids), n + len(batch))
+                ids = np.resize(ids, capacity)
+                vectors = np.resize(vectors, (capacity, EMBEDDING_DIM))
+            for i, row in enumerate(batch, start=n):
+                ids[i] = row["id"]
+                vectors[i] = row["embedding"]
+            n += len(batch)
+    finally:
+        iterator.close()
+    return ids[:n], vectors[:n]
+
+
+def exact_neighbors(vectors, queries, k, metric=INDEX_METRIC_TYPE, exclude=None, tile_size=8192):
+    """
+    分块暴力检索每个查询的 top-k 行号，按块维护当前最优的 k 个，峰值内存与库大小无关。
+    exclude: 可选，每个查询需要排除的行号（留出的查询向量本身）。
+    """
+    if metric == "COSINE":
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_cost = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), tile_size):
+        block = vectors[start:start + tile_size]
+        if metric == "L2":
+            cost = (np.sum(block ** 2, axis=1)[None, :] - 2.0 * queries @ block.T)
+        else:
+            cost = -(queries @ block.T)  # IP / COSINE：越大越近
+        rows = np.arange(start, start + len(block))
+        if exclude is not None:
+            cost[exclude[:, None] == rows[None, :]] = np.inf
+        cost = np.concatenate([best_cost, cost], axis=1)
+        rows = np.concatenate([best_rows, np.broadcast_to(rows, (len(queries), len(rows)))], axis=1)
+        keep = min(k, cost.shape[1])
+        top = np.argpartition(cost, keep - 1, axis=1)[:, :keep]
+        best_cost = np.take_along_axis(cost, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    return best_rows
+
+
+def _ivf_nlists(n):
+    """nlist 取 4·sqrt(n) 附近的 2 的幂，且每个聚类至少约 39 个训练样本。"""
+    upper = max(8, n // 39)
+    base = 2 ** round(math.log2(max(8.0, 4 * math.sqrt(n))))
+    return sorted({min(max(8, v), upper) for v in (base // 2, base)})
+
+
+def candidate_profiles(n, dim=EMBEDDING_DIM, k=INDEX_TUNER_K, metric=INDEX_METRIC_TYPE):
+    """生成 (index_type, index_params, [search_params...]) 候选。"""
+    candidates = []
+    for nlist in _ivf_nlists(n):
+        nprobes = [p for p in (1, 2, 4, 8, 16, 32, 64, 128) if p <= nlist]
+        for index_type in ("IVF_FLAT", "IVF_SQ8"):
+            candidates.append((index_type, {"nlist": nlist}, [{"nprobe": p} for p in nprobes]))
+        for m in (dim // 8, dim // 4):
+            if m and dim % m == 0:
+                candidates.append(("IVF_PQ", {"nlist": nlist, "m": m, "nbits": 8},
+                                   [{"nprobe": p} for p in nprobes]))
+    efs = [{"ef": ef} for ef in (16, 32, 64, 128, 256) if ef >= k]
+    candidates.append(("HNSW", {"M": 16, "efConstruction": 200}, efs))
+    candidates.append(("HNSW_SQ", {"M": 16, "efConstruction": 200, "sq_type": "SQ8"}, efs))
+    return [
+        {"index_type": t, "metric_type": metric, "index_params": p, "search_params": sp}
+        for t, p, sps in candidates for sp in sps
+    ]
+
+
+def _create_tune_collection(client, ids, vectors):
+    if TUNE_COLLECTION in client.list_collections():
+        client.drop_collection(TUNE_COLLECTION)
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True),
+        FieldSchema(name="embedding", dtype=DataType.FLOAT_VECTOR, dim=vectors.shape[1]),
+    ]
+    client.create_collection(collection_name=TUNE_COLLECTION,
+                             schema=CollectionSchema(fields, "index_tuner scratch collection"))
+    for start in range(0, len(ids), INSERT_BATCH_SIZE):
+        client.insert(TUNE_COLLECTION, [
+            {"id": int(i), "embedding": v.tolist()}
+            for i, v in zip(ids[start:start + INSERT_BATCH_SIZE], vectors[start:start + INSERT_BATCH_SIZE])
+        ])
+
+
+def _build(client, profile):
+    try:
+        client.release_collection(TUNE_COLLECTION)
+    except Exception:
+        pass
+    for index_name in client.list_indexes(TUNE_COLLECTION):
+        client.drop_index(TUNE_COLLECTION, index_name)
+    create_vector_index(client, TUNE_COLLECTION, profile)
+    client.load_collection(TUNE_COLLECTION)
+
+
+def measure(client, profile, queries, truth_ids, k, exclude_ids=None, latency_queries=50):
+    """
+    recall@k：批量检索结果与精确近邻的交集比例；延迟：逐条单查询检索的 p50 / p95（毫秒）。
+    留出的查询向量仍在库中，检索时多取一条并去掉其自身。
+    """
+    extra = 1 if exclude_ids is not None else 0
+    results = search_by_vectors(client, queries, k + extra, TUNE_COLLECTION, profile)
+    hits = 0
+    for i, (found, _) in enumerate(results):
+        if exclude_ids is not None:
+            found = [h for h in found if h != exclude_ids[i]]
+        hits += len(set(found[:k]) & set(truth_ids[i].tolist()))
+    latencies = []
+    for vector in queries[:latency_queries]:
+        start = time.perf_counter()
+        search_by_vectors(client, vector[None, :], k + extra, TUNE_COLLECTION, profile)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "recall": hits / float(len(queries) * k),
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def select_profile(results, latency_target_ms, min_recall):
+    """
+    1. 延迟达标且 recall 达标：每条向量占用最小者（同占用取 recall 高、延迟低）；
+    2. 只有延迟达标：recall 最高者；
+    3. 都不达标：延迟最低者。
+    """
+    fast = [r for r in results if r["latency_p95_ms"] <= latency_target_ms]
+    good = [r for r in fast if r["recall"] >= min_recall]
+    if good:
+        return min(good, key=lambda r: (r["bytes_per_vector"], -r["recall"], r["latency_p95_ms"]))
+    if fast:
+        return max(fast, key=lambda r: (r["recall"], -r["latency_p95_ms"]))
+    return min(results, key=lambda r: r["latency_p95_ms"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tune the Milvus index type and parameters for recall/latency.")
+    parser.add_argument("--k", type=int, default=INDEX_TUNER_K, help="recall@k 的 k")
+    parser.add_argument("--queries", type=int, default=INDEX_TUNER_QUERIES, help="留出的查询向量数")
+    parser.add_argument("--query-file", help="可选，每行一个真实查询文本；给定时代替留出向量")
+    parser.add_argument("--latency-target-ms", type=float, default=INDEX_TUNER_LATENCY_TARGET_MS)
+    parser.add_argument("--min-recall", type=float, default=INDEX_TUNER_MIN_RECALL)
+    parser.add_argument("--latency-queries", type=int, default=50, help="测量单查询延迟的查询数")
+    parser.add_argument("--index-types", nargs="*", choices=sorted(SEARCH_PARAM_NAMES),
+                        help="只评估这些索引类型（Milvus Lite 下自动排除重启后无法加载的类型）")
+    parser.add_argument("--output", default=INDEX_PROFILE_PATH)
+    parser.add_argument("--dry-run", action="store_true", help="只打印结果，不写入配置")
+    parser.add_argument("--apply", action="store_true", help="写入后立即在主 collection 上重建索引")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    client = get_milvus_client()
+    ids, vectors = fetch_vectors(client)
+    if len(ids) <= args.k:
+        raise SystemExit(f"Collection '{COLLECTION_NAME}' has only {len(ids)} vectors, nothing to tune.")
+    print(f"Loaded {len(ids)} vectors from '{COLLECTION_NAME}'.")
+
+    if args.query_file:
+        from models import load_embedding_model
+        with open(args.query_file, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        queries = embed_queries(texts, load_embedding_model(EMBEDDING_MODEL_NAME))
+        exclude_rows = exclude_ids = None
+    else:
+        rng = np.random.default_rng(args.seed)
+        exclude_rows = rng.choice(len(ids), size=min(args.queries, len(ids)), replace=False)
+        queries = vectors[exclude_rows]
+        exclude_ids = ids[exclude_rows].tolist()
+    truth_ids = ids[exact_neighbors(vectors, queries, args.k, exclude=exclude_rows)]
+
+    index_types = args.index_types or sorted(SEARCH_PARAM_NAMES)
+    if is_milvus_lite(MILVUS_LITE_DATA_PATH):
+        index_types = [t for t in index_types if t in MILVUS_LITE_INDEX_TYPES]
+
+    _create_tune_collection(client, ids, vectors)
+    results = []
+    try:
+        built = None
+        for profile in candidate_profiles(len(ids), vectors.shape[1], args.k):
+            if profile["index_type"] not in index_types:
+                continue
+            structure = (profile["index_type"], tuple(sorted(profile["index_params"].items())))
+            try:
+                if structure != built:
+                    start = time.perf_counter()
+                    _build(client, profile)
+                    built, build_s = structure, time.perf_counter() - start
+                stats = measure(client, profile, queries, truth_ids, args.k, exclude_ids, args.latency_queries)
+            except Exception as e:
+                print(f"skip {profile['index_type']} {profile['index_params']}: {e}")
+                built = None
+                continue
+            result = dict(profile, **stats, build_s=build_s,
+                          bytes_per_vector=bytes_per_vector(profile["index_type"], profile["index_params"],
+                                                            vectors.shape[1]))
+            results.append(result)
+            print(f"{profile['index_type']:<9} {str(profile['index_params']):<42} {str(profile['search_params']):<16} "
+                  f"recall@{args.k}={stats['recall']:.3f} p50={stats['latency_p50_ms']:.1f}ms "
+                  f"p95={stats['latency_p95_ms']:.1f}ms {result['bytes_per_vector']:.0f}B/vec")
+    finally:
+        client.drop_collection(TUNE_COLLECTION)
+
+    if not results:
+        raise SystemExit("No candidate index could be built.")
+    best = select_profile(results, args.latency_target_ms, args.min_recall)
+    profile = {
+        "index_type": best["index_type"],
+        "metric_type": best["metric_type"],
+        "index_params": best["index_params"],
+        "search_params": best["search_params"],
+        "k": args.k,
+        "recall": best["recall"],
+        "latency_p50_ms": best["latency_p50_ms"],
+        "latency_p95_ms": best["latency_p95_ms"],
+        "bytes_per_vector": best["bytes_per_vector"],
+        "num_vectors": int(len(ids)),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    print(f"Selected {profile['index_type']} {profile['index_params']} {profile['search_params']} "
+          f"(recall@{args.k}={profile['recall']:.3f}, p95={profile['latency_p95_ms']:.1f}ms)")
+    if args.dry_run:
+        return
+    save_index_profile(profile, args.output)
+    print(f"Index profile written to {args.output}")
+    if args.apply:
+        rebuilt = apply_index_profile(client, profile)
+        print("Index rebuilt." if rebuilt else "Index already matches the profile.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import copy
+import threading
+from collections import OrderedDict
+
+import torch
+from transformers import DynamicCache
+
+from config import KV_CACHE_MAX_ENTRIES
+
+
+def cache_to_legacy(cache):
+    """DynamicCache -> tuple((key, value) per layer)，兼容新旧版本 transformers。"""
+    if hasattr(cache, "to_legacy_cache"):
+        return cache.to_legacy_cache()
+    return tuple((layer.keys, layer.values) for layer in cache.layers)
+
+
+def cache_from_legacy(legacy):
+    """tuple((key, value) per layer) -> DynamicCache，兼容新旧版本 transformers。"""
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(legacy)
+    return DynamicCache(ddp_cache_data=legacy)
+
+
+class PrefixKVCache:
+    """
+    按 token 前缀缓存 past_key_values：
+      - 静态指令头只预填充一次；
+      - 同一组上下文（如回答与其"再检索"优化）复用整段 header+context 的 KV；
+      - 新前缀从已缓存的最长前缀继续预填充，只计算差异部分。
+    取出的缓存是深拷贝，generate 对其的原地扩展不会污染缓存本身。
+    """
+
+    def __init__(self, max_entries: int = KV_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # tuple(token ids) -> DynamicCache
+        self._lock = threading.Lock()
+        self._model_id = None
+        self.hits = 0
+        self.misses = 0
+
+    def _longest_prefix(self, ids):
+        best = ()
+        for key in self._entries:
+            if len(best) < len(key) <= len(ids) and ids[:len(key)] == key:
+                best = key
+        return best
+
+    def _store(self, key, cache):
+        self._entries[key] = cache
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @torch.no_grad()
+    def _extend(self, model, cache, ids, start):
+        """在 cache（覆盖 ids[:start]）的基础上预填充 ids[start:]。"""
+        cache = copy.deepcopy(cache) if cache is not None else DynamicCache()
+        input_ids = torch.tensor([ids[start:]], device=model.device)
+        attention_mask = torch.ones((1, len(ids)), dtype=torch.long, device=model.device)
+        out = model(input_ids=input_ids, attention_mask=attention_mask,
+                    past_key_values=cache, use_cache=True)
+        return out.past_key_values
+
+    def prefill(self, model, segments):
+        """
+        segments: 依次拼接的 token id 列表（如 [header_ids, context_ids]），
+        每个分段边界都会作为一个可复用的缓存点。
+        Returns:
+          - (覆盖全部 segments 的 past_key_values 深拷贝, 命中缓存的 token 数)
+        """
+        with self._lock:
+            if self._model_id != id(model):
+                self._entries.clear()
+                self._model_id = id(model)
+
+        ids = ()
+        cache, cache_len, reused = None, 0, 0
+        for segment in segments:
+            ids = ids + tuple(segment)
+            with self._lock:
+                prefix = self._longest_prefix(ids)
+                if prefix:
+                    self._entries.move_to_end(prefix)
+                    if len(prefix) > cache_len:
+                        cache, cache_len = self._entries[prefix], len(prefix)
+                        reused = cache_len
+            if cache_len == len(ids):
+                self.hits += 1
+                continue
+            self.misses += 1
+            cache = self._extend(model, cache, ids, cache_len)
+            cache_len = len(ids)
+            with self._lock:
+                self._store(ids, cache)
+        return copy.deepcopy(cache), reused
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+prefix_kv_cache = PrefixKVCache()
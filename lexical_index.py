@@ -0,0 +1,172 @@
+from runtime import cache_resource, log, atomic_dir, dir_lock
+import numpy as np
+import os
+import re
+import json
+import time
+import hashlib
+import unicodedata
+
+from config import LEXICAL_INDEX_PATH, BM25_K1, BM25_B
+
+# 分词规则变化时递增，使已持久化的索引失效
+TOKENIZER_VERSION = 1
+_TOKEN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+(?:[.\-][a-z0-9]+)*')
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    中英文混合分词：连续的汉字切成字 bigram（单字保留 unigram），
+    拉丁字母 / 数字按词切分并转小写，药名、剂量（如 "5-fu"、"2.5mg"）保持完整。
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        run = match.group()
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 倒排索引，postings 按词项以 CSR 形式存储：
+    词项 t 的 postings 为 doc_idx[term_ptr[t]:term_ptr[t+1]]（文档下标）与对应的词频 tf。
+    ids[i] 为文档下标 i 对应的文档 ID。
+    """
+
+    def __init__(self, ids, doc_len, term_ptr, doc_idx, tf, terms, k1: float = BM25_K1, b: float = BM25_B):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.doc_len = np.asarray(doc_len, dtype=np.int32)
+        self.term_ptr = np.asarray(term_ptr, dtype=np.int64)
+        self.doc_idx = np.asarray(doc_idx, dtype=np.int32)
+        self.tf = np.asarray(tf, dtype=np.uint16)
+        self.terms = list(terms)
+        self.vocab = {term: i for i, term in enumerate(self.terms)}
+        self.k1 = k1
+        self.b = b
+        self.avgdl = float(self.doc_len.mean()) if len(self.doc_len) else 0.0
+
+    @property
+    def num_docs(self):
+        return len(self.ids)
+
+    @property
+    def num_postings(self):
+        return len(self.doc_idx)
+
+    @classmethod
+    def build(cls, items, **kwargs):
+        """items: 可迭代的 (doc_id, text)。"""
+        vocab = {}
+        ids, doc_len, token_ids = [], [], []
+        for doc_id, text in items:
+            tokens = tokenize(text)
+            ids.append(doc_id)
+            doc_len.append(len(tokens))
+            token_ids.append(np.fromiter((vocab.setdefault(t, len(vocab)) for t in tokens),
+                                         dtype=np.int64, count=len(tokens)))
+        n_docs = len(ids)
+        term_of = np.concatenate(token_ids) if token_ids else np.zeros(0, dtype=np.int64)
+        doc_of = np.repeat(np.arange(n_docs, dtype=np.int64), doc_len)
+        # (词项, 文档) 组合键去重计数即得 postings，且已按词项、文档下标升序排列
+        keys, tf = np.unique(term_of * max(n_docs, 1) + doc_of, return_counts=True)
+        term_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // max(n_docs, 1), minlength=len(vocab)), out=term_ptr[1:])
+        return cls(ids, doc_len, term_ptr,
+                   (keys % max(n_docs, 1)).astype(np.int32),
+                   np.minimum(tf, np.iinfo(np.uint16).max).astype(np.uint16),
+                   sorted(vocab, key=vocab.get), **kwargs)
+
+    def search(self, query: str, top_k: int):
+        """
+        BM25 检索，只访问查询词项的 postings。
+        Returns:
+          - (doc_ids, scores)，按分数降序，只含得分 > 0 的文档
+        """
+        term_ids = [self.vocab[t] for t in dict.fromkeys(tokenize(query)) if t in self.vocab]
+        if not term_ids or not self.num_docs or top_k <= 0:
+            return [], []
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        n = self.num_docs
+        for t in term_ids:
+            start, end = self.term_ptr[t], self.term_ptr[t + 1]
+            docs = self.doc_idx[start:end]
+            tf = self.tf[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log1p((n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[docs] / max(self.avgdl, 1e-9))
+            scores[docs] += idf * tf * (self.k1 + 1.0) / (tf + norm)
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        hits = hits[np.argsort(-scores[hits], kind='stable')]
+        return [int(i) for i in self.ids[hits]], [float(s) for s in scores[hits]]
+
+    def save(self, path, **meta):
+        """
+        保存为目录下的若干 .npy 文件 + terms.json + meta.json，加载时数组直接 mmap。
+        经 atomic_dir 先写临时目录再换入，其它进程已 mmap 的旧文件不会被原地截断。
+        """
+        with atomic_dir(path) as tmp_path:
+            for name in ("ids", "doc_len", "term_ptr", "doc_idx", "tf"):
+                np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+            with open(os.path.join(tmp_path, "terms.json"), 'w', encoding='utf-8') as f:
+                json.dump(self.terms, f, ensure_ascii=False)
+            with open(os.path.join(tmp_path, "meta.json"), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path):
+        """Returns (index, meta)."""
+        with dir_lock(path):
+            with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(os.path.join(path, "terms.json"), 'r', encoding='utf-8') as f:
+                terms = json.load(f)
+            arrays = [
+                np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+                for name in ("ids", "doc_len", "term_ptr", "doc_idx", "tf")
+            ]
+        return cls(*arrays, terms), meta
+
+
+def _lexical_fingerprint(doc_store):
+    """doc store 中全部 (id, content_hash) 与分词版本的摘要；语料变化时索引需要重建。"""
+    h = hashlib.md5(f"tokenizer-v{TOKENIZER_VERSION}".encode("utf-8"))
+    for doc_id, chash in sorted(doc_store.content_hashes().items()):
+        h.update(f"{doc_id}:{chash};".encode("utf-8"))
+    return h.hexdigest()
+
+
+def build_lexical_index(doc_store, path: str = LEXICAL_INDEX_PATH) -> LexicalIndex:
+    """从 doc store 全量构建 BM25 索引并持久化（由 index_data_if_needed 在索引变化后调用）。"""
+    start = time.time()
+    index = LexicalIndex.build((doc_id, doc['content']) for doc_id, doc in doc_store.items())
+    index.save(path, fingerprint=_lexical_fingerprint(doc_store))
+    log.write(f"Built lexical index ({index.num_docs} docs, {len(index.terms)} terms, "
+             f"{index.num_postings} postings) in {time.time() - start:.2f}s.")
+    return index
+
+
+@cache_resource(latest_per=("path",))
+def load_or_build_lexical_index(_doc_store, index_version: int = 0,
+                                path: str = LEXICAL_INDEX_PATH) -> LexicalIndex:
+    """
+    优先从磁盘加载 BM25 索引；语料变化时重新构建。
+    index_version 只参与缓存键：索引内容变化（bump_index_version）后重新加载，
+    同一路径只缓存最新加载的一份，旧版本的索引随之释放。
+    """
+    fingerprint = _lexical_fingerprint(_doc_store)
+    try:
+        index, meta = LexicalIndex.load(path)
+        if meta.get("fingerprint") == fingerprint:
+            log.write(f"Loaded lexical index ({index.num_docs} docs, {len(index.terms)} terms).")
+            return index
+    except (FileNotFoundError, json.JSONDecodeError, ValueError):
+        pass
+    return build_lexical_index(_doc_store, path)
@@ -0,0 +1,255 @@
+"""
+进程内指标与追踪，只依赖标准库：
+  - span(stage)：统计一个阶段的耗时，计入直方图 rag_stage_duration_seconds{stage=...}；
+  - observe(stage, seconds)：记录在别处测得的阶段耗时（如生成的 prefill / decode）；
+  - count(name)：吞吐计数器（查询数、生成 token 数等）；
+  - render_prometheus()：Prometheus 文本格式，server.py 在 /metrics 导出；
+  - 配置了 METRICS_TRACE_PATH 时，每个 span / observe 另写一行 JSONL，
+    带上 trace_context() 设置的请求 ID，可按请求还原各阶段耗时。
+"""
+import bisect
+import contextvars
+import json
+import math
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from config import METRICS_ENABLED, METRICS_LATENCY_BUCKETS, METRICS_TRACE_PATH
+
+_trace_id = contextvars.ContextVar("rag_trace_id", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+    """单调递增计数器，按标签组合分别计数。"""
+
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(items)]
+
+
+class Histogram:
+    """固定桶直方图（累积计数 + sum + count），分位数由桶线性插值估计。"""
+
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label key -> [各桶计数（含 +Inf）, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def quantile(self, q, **labels):
+        """估计分位数；该标签组合没有数据时返回 None。"""
+        with self._lock:
+            series = self._series.get(_label_key(labels))
+            if series is None:
+                return None
+            counts, _, total = list(series[0]), series[1], series[2]
+        rank = q * total
+        cumulative = 0
+        for i, c in enumerate(counts):
+            if c and cumulative + c >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower  # 落在 +Inf 桶：只能给出下界
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / c
+            cumulative += c
+        return self.buckets[-1]
+
+    def summary(self):
+        """{标签组合: {count, mean_s, p50_s, p95_s, p99_s}}，供 /health 与压测报告使用。"""
+        with self._lock:
+            keys = [(key, s[1], s[2]) for key, s in self._series.items()]
+        result = {}
+        for key, total_s, count in keys:
+            labels = dict(key)
+            result[",".join(f"{k}={v}" for k, v in key)] = {
+                "count": count,
+                "mean_s": total_s / count if count else 0.0,
+                **{f"p{int(q * 100)}_s": self.quantile(q, **labels) for q in (0.5, 0.95, 0.99)},
+            }
+        return result
+
+    def render(self):
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        lines = []
+        for key, counts, total_s, count in sorted(items):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total_s}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name, help, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, help, **kwargs)
+        return metric
+
+
+def counter(name, help=""):
+    return _get_or_create(Counter, name, help)
+
+
+def histogram(name, help="", buckets=METRICS_LATENCY_BUCKETS):
+    return _get_or_create(Histogram, name, help, buckets=buckets)
+
+
+stage_seconds = histogram("rag_stage_duration_seconds", "Latency of each pipeline stage.")
+
+
+class _TraceWriter:
+    """把 span 追加写入 JSONL 文件；写入失败不影响请求。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+                self._file.write(line)
+            except OSError:
+                pass
+
+
+_trace_writer = _TraceWriter(METRICS_TRACE_PATH) if METRICS_TRACE_PATH else None
+
+
+@contextmanager
+def trace_context(trace_id=None):
+    """在当前上下文内设置请求 ID，期间的 span 在 JSONL 中带上该 ID。"""
+    token = _trace_id.set(trace_id or uuid.uuid4().hex[:16])
+    try:
+        yield _trace_id.get()
+    finally:
+        _trace_id.reset(token)
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def observe(stage, seconds, **labels):
+    """记录一个阶段的耗时（秒）。"""
+    if not METRICS_ENABLED:
+        return
+    stage_seconds.observe(seconds, stage=stage, **labels)
+    if _trace_writer is not None:
+        _trace_writer.write({
+            "ts": time.time(), "trace": _trace_id.get(), "stage": stage,
+            "ms": round(seconds * 1000.0, 3), "thread": threading.current_thread().name, **labels
+        })
+
+
+class Span:
+    __slots__ = ("stage", "labels", "start", "seconds")
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+
+    @property
+    def ms(self):
+        return self.seconds * 1000.0
+
+
+@contextmanager
+def span(stage, timings=None, **labels):
+    """
+    统计 with 块的耗时并计入 stage 的直方图；块内抛出异常时额外带上 error="1" 标签。
+    timings 给定时同时写入 timings[stage]（毫秒），即检索函数返回的各阶段耗时。
+    """
+    s = Span(stage, labels)
+    error = False
+    try:
+        yield s
+    except BaseException:
+        error = True
+        raise
+    finally:
+        s.seconds = time.perf_counter() - s.start
+        if timings is not None:
+            timings[stage] = s.ms
+        if error:
+            labels = {**labels, "error": "1"}
+        observe(stage, s.seconds, **labels)
+
+
+def count(name, value=1, help="", **labels):
+    """吞吐计数器 name 加 value。"""
+    if METRICS_ENABLED:
+        counter(name, help).inc(value, **labels)
+
+
+def render_prometheus() -> str:
+    """所有指标的 Prometheus 文本格式（exposition format 0.0.4）。"""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines = []
+    for metric in metrics:
+        if metric.help:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,36 +1,47 @@
-import streamlit as st
+from runtime import cache_resource, log
 # Use MilvusClient for Lite version
 from pymilvus import MilvusClient, DataType, CollectionSchema, FieldSchema
-import time
 import os
+import hashlib
+import numpy as np
 
 # Import config variables including the global map
 from config import (
-    MILVUS_LITE_DATA_PATH, COLLECTION_NAME, EMBEDDING_DIM,
-    MAX_ARTICLES_TO_INDEX, INDEX_METRIC_TYPE, INDEX_TYPE, INDEX_PARAMS,
-    SEARCH_PARAMS, TOP_K, id_to_doc_map
+    MILVUS_LITE_DATA_PATH, COLLECTION_NAME, EMBEDDING_DIM, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND,
+    MAX_ARTICLES_TO_INDEX, INDEX_BATCH_SIZE, SEARCH_BATCH_SIZE, TOP_K
+)
+from data_utils import content_hash, format_content
+from embedding_cache import get_embedding_cache
+from doc_store import get_doc_store
+from lexical_index import build_lexical_index
+from metrics import span, count
+from models import embedding_backend
+from index_profile import load_index_profile, default_index_profile, profile_signature
+from query_cache import (
+    query_embedding_cache, search_result_cache, get_index_version,
+    bump_index_version, normalize_query
 )
 
-@st.cache_resource
+@cache_resource
 def get_milvus_client():
     """Initializes and returns a MilvusClient instance for Milvus Lite."""
     try:
-        st.write(f"Initializing Milvus Lite client with data path: {MILVUS_LITE_DATA_PATH}")
+        log.write(f"Initializing Milvus Lite client with data path: {MILVUS_LITE_DATA_PATH}")
         # Ensure the directory for the data file exists
         os.makedirs(os.path.dirname(MILVUS_LITE_DATA_PATH), exist_ok=True)
         # The client connects to the local file specified
         client = MilvusClient(uri=MILVUS_LITE_DATA_PATH)
-        st.success("Milvus Lite client initialized!")
+        log.success("Milvus Lite client initialized!")
         return client
     except Exception as e:
-        st.error(f"Failed to initialize Milvus Lite client: {e}")
+        log.error(f"Failed to initialize Milvus Lite client: {e}")
         return None
 
-@st.cache_resource
+@cache_resource
 def setup_milvus_collection(_client):
     """Ensures the specified collection exists and is set up correctly in Milvus Lite."""
     if not _client:
-        st.error("Milvus client not available.")
+        log.error("Milvus client not available.")
         return False
     try:
         collection_name = COLLECTION_NAME
@@ -39,7 +50,7 @@ def setup_milvus_collection(_client):
         has_collection = collection_name in _client.list_collections()
 
         if not has_collection:
-            st.write(f"Collection '{collection_name}' not found. Creating...")
+            log.write(f"Collection '{collection_name}' not found. Creating...")
             # Define fields using new API style if needed (older style might still work)
             fields = [
                 FieldSchema(name="id", dtype=DataType.INT64, is_primary=True),
@@ -58,186 +69,467 @@ def setup_milvus_collection(_client):
                 # vector_field_name="embedding",
                 # metric_type=INDEX_METRIC_TYPE
             )
-            st.write(f"Collection '{collection_name}' created.")
+            log.write(f"Collection '{collection_name}' created.")
 
             # Create an index
-            st.write(f"Creating index ({INDEX_TYPE})...")
-            index_params = _client.prepare_index_params()
-            index_params.add_index(
-                field_name="embedding",
-                index_type=INDEX_TYPE,
-                metric_type=INDEX_METRIC_TYPE,
-                params=INDEX_PARAMS
-            )
-            _client.create_index(collection_name, index_params)
-            st.success(f"Index created for collection '{collection_name}'.")
+            profile = get_index_profile()
+            log.write(f"Creating index ({profile['index_type']})...")
+            create_vector_index(_client, collection_name, profile)
+            get_doc_store().set_meta(index_profile=profile_signature(profile))
+            log.success(f"Index created for collection '{collection_name}'.")
         else:
-            st.write(f"Found existing collection: '{collection_name}'.")
+            log.write(f"Found existing collection: '{collection_name}'.")
             # Optional: Check schema compatibility if needed
+            # index_tuner.py 写入了新的索引配置时先重建索引
+            try:
+                apply_index_profile(_client, get_index_profile(reload=True))
+            except Exception as e:
+                log.write(f"Could not apply index profile: {e}")
+            # 重启后 collection 可能处于 released 状态，先加载才能 search
+            try:
+                _client.load_collection(collection_name)
+            except Exception as e:
+                log.write(f"Could not load collection '{collection_name}': {e}")
+                # 索引类型无法加载（如 Milvus Lite 中的 IVF_PQ）时退回 config 中的默认索引
+                if get_index_profile() != default_index_profile():
+                    global _index_profile
+                    _index_profile = default_index_profile()
+                    apply_index_profile(_client, _index_profile)
 
         # Determine current entity count (fallback between num_entities and stats)
         try:
-            if hasattr(_client, 'num_entities'):
-                current_count = _client.num_entities(collection_name)
-            else:
-                stats = _client.get_collection_stats(collection_name)
-                current_count = int(stats.get("row_count", stats.get("rowCount", 0)))
-            st.write(f"Collection '{collection_name}' ready. Current entity count: {current_count}")
+            current_count = get_entity_count(_client, collection_name)
+            log.write(f"Collection '{collection_name}' ready. Current entity count: {current_count}")
         except Exception:
-            st.write(f"Collection '{collection_name}' ready.")
+            log.write(f"Collection '{collection_name}' ready.")
+
+        # 启动时探测一次 search 的调用方式，之后的查询直接复用
+        detect_search_variant(_client)
 
         return True # Indicate collection is ready
 
     except Exception as e:
-        st.error(f"Error setting up Milvus collection '{COLLECTION_NAME}': {e}")
+        log.error(f"Error setting up Milvus collection '{COLLECTION_NAME}': {e}")
         return False
 
 
-def index_data_if_needed(client, data, embedding_model):
-    """Checks if data needs indexing and performs it using MilvusClient."""
-    global id_to_doc_map  # Modify the global map
+# 当前生效的索引配置（index_profile.py），setup_milvus_collection 时重新读取
+_index_profile = None
+
+
+def get_index_profile(reload=False) -> dict:
+    global _index_profile
+    if _index_profile is None or reload:
+        _index_profile = load_index_profile()
+    return _index_profile
+
+
+def create_vector_index(client, collection_name, profile):
+    """按索引配置在 embedding 字段上建索引。"""
+    index_params = client.prepare_index_params()
+    index_params.add_index(
+        field_name="embedding",
+        index_type=profile["index_type"],
+        metric_type=profile["metric_type"],
+        params=profile["index_params"]
+    )
+    client.create_index(collection_name, index_params)
+
+
+def _current_index_type(client, collection_name):
+    for index_name in client.list_indexes(collection_name):
+        desc = client.describe_index(collection_name, index_name)
+        if desc.get("field_name", "embedding") == "embedding":
+            return desc.get("index_type")
+    return None
+
+
+def apply_index_profile(client, profile, collection_name=COLLECTION_NAME) -> bool:
+    """
+    已建索引与 profile 不一致时 release -> drop_index -> create_index -> load。
+    describe_index 不返回构建参数，所以已应用的配置签名记在 doc store meta 中。
+    Returns:
+      - 是否重建了索引
+    """
+    store = get_doc_store()
+    signature = profile_signature(profile)
+    current_type = _current_index_type(client, collection_name)
+    applied = store.get_meta("index_profile")
+    if current_type == profile["index_type"] and applied in (None, signature):
+        if applied is None:
+            store.set_meta(index_profile=signature)
+        return False
+
+    log.write(f"Rebuilding index: {current_type} -> {profile['index_type']} {profile['index_params']}")
+    try:
+        client.release_collection(collection_name)
+    except Exception:
+        pass
+    for index_name in client.list_indexes(collection_name):
+        client.drop_index(collection_name, index_name)
+    create_vector_index(client, collection_name, profile)
+    client.load_collection(collection_name)
+    store.set_meta(index_profile=signature)
+    bump_index_version()
+    return True
+
+
+def doc_key_to_milvus_id(doc_key) -> int:
+    """把 preprocess 生成的字符串 ID（'{filename}_{i}'）映射为稳定的 INT64 主键。"""
+    digest = hashlib.md5(str(doc_key).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & 0x7FFFFFFFFFFFFFFF
+
+
+def _index_identity():
+    """Milvus 中的向量与 doc store 对应的 collection / 模型标识（后端取回退后的实际值），任一变化都需重建。"""
+    return {
+        "collection": COLLECTION_NAME,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "embedding_backend": embedding_backend(EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND),
+        "dim": str(EMBEDDING_DIM),
+    }
+
+
+def _source_fingerprint(data_file):
+    """数据文件的大小 + 修改时间 + 索引上限，用于判断启动时能否跳过加载数据。"""
+    stat = os.stat(data_file)
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{MAX_ARTICLES_TO_INDEX}"
+
+
+def index_is_up_to_date(client, data_file):
+    """
+    若数据文件自上次成功索引后未变化，且 Milvus 行数与 doc store 一致，返回 True。
+    此时启动无需 json.load 整个语料。
+    """
+    store = get_doc_store()
+    try:
+        if store.get_meta("source_fingerprint") != _source_fingerprint(data_file):
+            return False
+        if any(store.get_meta(k) != v for k, v in _index_identity().items()):
+            return False
+        return get_entity_count(client, COLLECTION_NAME) == len(store) > 0
+    except Exception:
+        return False
+
+
+def mark_index_synced(data_file):
+    """记录当前数据文件指纹与索引标识，供下次启动时 index_is_up_to_date 判断。"""
+    get_doc_store().set_meta(source_fingerprint=_source_fingerprint(data_file), **_index_identity())
+
+
+def ingest_checkpoint_key(data_file) -> str:
+    """bulk_ingest 断点的有效条件：数据文件、索引上限与 collection / 模型都未变化。"""
+    identity = ",".join(f"{k}={v}" for k, v in sorted(_index_identity().items()))
+    return f"{_source_fingerprint(data_file)}|{identity}"
+
+
+def get_entity_count(client, collection_name):
+    """Returns the collection row count (fallback between num_entities and stats)."""
+    if hasattr(client, 'num_entities'):
+        return client.num_entities(collection_name)
+    stats = client.get_collection_stats(collection_name)
+    return int(stats.get("row_count", stats.get("rowCount", 0)))
+
+
+def doc_to_row(doc):
+    """
+    把 preprocess 输出的一条记录转换为 doc store 行：
+    (id, doc_key, title, abstract, source_file, chunk_index, content_hash)；没有内容时返回 None。
+    """
+    title = doc.get('title', '') or ""
+    abstract = doc.get('abstract', '') or ""
+    content = format_content(title, abstract)
+    if not content:
+        return None
+    # 使用 preprocess 生成的 '{filename}_{i}' 派生稳定 ID，缺失时退回内容哈希
+    h = content_hash(content)
+    doc_key = doc.get('id') or h
+    return (
+        doc_key_to_milvus_id(doc_key), str(doc_key), title, abstract,
+        doc.get('source_file'), doc.get('chunk_index'), h
+    )
+
+
+def row_content(row) -> str:
+    return format_content(row[2], row[3])
+
+
+def upsert_rows(client, rows, embeddings, collection_name=COLLECTION_NAME):
+    """一批 doc store 行及其向量写入 Milvus（upsert 幂等，中断后重放同一批次不会产生重复）。"""
+    client.upsert(collection_name=collection_name, data=[
+        {"id": row[0], "embedding": emb, "content_preview": row_content(row)[:500]}
+        for row, emb in zip(rows, embeddings)
+    ])
+
+
+def check_manifest(client, store, has_manifest, current_count, collection_name=COLLECTION_NAME):
+    """
+    判断 doc store 中的 content_hash 能否作为增量依据：collection / 模型与记录一致，且 Milvus 中确有数据。
+    Milvus 有数据但没有 manifest（旧版本按位置编号写入）时清空 collection。
+    Returns:
+      - True / False；清空旧数据失败时返回 None
+    """
+    trust_manifest = all(store.get_meta(k) == v for k, v in _index_identity().items())
+    if not trust_manifest and has_manifest:
+        log.write("Doc store does not match current collection/model, re-embedding all chunks.")
+    if current_count == 0 and has_manifest:
+        log.write("Collection is empty but doc store is not, re-embedding all chunks.")
+        return False
+    if current_count > 0 and not has_manifest:
+        # 旧版本按位置编号 i 写入的数据无法与 chunk 对应，清空后按内容哈希重建
+        log.warning("No index manifest found for existing data, re-indexing from scratch.")
+        try:
+            client.delete(collection_name=collection_name, filter="id >= 0")
+        except Exception as e:
+            log.error(f"Error clearing legacy data from Milvus Lite: {e}")
+            return None
+    return trust_manifest
+
 
+def index_data_if_needed(client, data, embedding_model):
+    """
+    增量索引：按内容哈希对比 doc store 中的 manifest，只对新增/修改的 chunk 做 embedding 并 upsert，
+    删除已不存在的 chunk。耗时与变更量成正比，而不是与语料规模成正比。
+    变更按 INDEX_BATCH_SIZE 分批编码、写入并提交 manifest，中断后重试只处理未完成的批次。
+    语料很大时用 bulk_ingest.py 流式导入，无需把整个数据文件读入内存。
+    """
     if not client:
-        st.error("Milvus client not available for indexing.")
+        log.error("Milvus client not available for indexing.")
         return False
 
     collection_name = COLLECTION_NAME
     # Retrieve current entity count with fallback
     try:
-        if hasattr(client, 'num_entities'):
-            current_count = client.num_entities(collection_name)
-        else:
-            stats = client.get_collection_stats(collection_name)
-            current_count = int(stats.get("row_count", stats.get("rowCount", 0)))
+        current_count = get_entity_count(client, collection_name)
     except Exception:
-        st.write(f"Could not retrieve entity count, attempting to (re)setup collection.")
+        log.write(f"Could not retrieve entity count, attempting to (re)setup collection.")
         if not setup_milvus_collection(client):
             return False
         current_count = 0
 
-    st.write(f"Entities currently in Milvus collection '{collection_name}': {current_count}")
+    log.write(f"Entities currently in Milvus collection '{collection_name}': {current_count}")
+
+    store = get_doc_store()
+    indexed_hashes = store.content_hashes()
+    trust_manifest = check_manifest(client, store, bool(indexed_hashes), current_count, collection_name)
+    if trust_manifest is None:
+        return False
 
-    data_to_index = data[:MAX_ARTICLES_TO_INDEX]
-    docs_for_embedding = []
-    data_to_insert = []
-    temp_id_map = {}  # 临时存放 id->doc 信息
+    data_to_index = data if MAX_ARTICLES_TO_INDEX is None else data[:MAX_ARTICLES_TO_INDEX]
+    changed_rows = []  # 需要重新 embedding 的 doc store 行
+    current_ids = set()
 
     # Prepare data
-    with st.spinner("Preparing data for indexing..."):
-        for i, doc in enumerate(data_to_index):
-            title = doc.get('title', '') or ""
-            abstract = doc.get('abstract', '') or ""
-            content = f"Title: {title}\nAbstract: {abstract}".strip()
-            if not content:
+    with log.spinner("Preparing data for indexing..."):
+        for doc in data_to_index:
+            row = doc_to_row(doc)
+            if row is None or row[0] in current_ids:
                 continue
+            current_ids.add(row[0])
+            if trust_manifest and indexed_hashes.get(row[0]) == row[6]:
+                continue
+            changed_rows.append(row)
 
-            # 使用 i 作为文档 ID
-            doc_id = i
-            temp_id_map[doc_id] = {
-                'title': title,
-                'abstract': abstract,
-                'content': content
-            }
-            docs_for_embedding.append(content)
-            data_to_insert.append({
-                "id": doc_id,
-                "embedding": None,
-                "content_preview": content[:500]
-            })
-
-    # 如果需要索引
-    if current_count < len(docs_for_embedding) and docs_for_embedding:
-        st.warning(f"Indexing required ({current_count}/{len(docs_for_embedding)}).")
-
-        # 生成 embeddings
-        with st.spinner("Generating embeddings..."):
-            start_embed = time.time()
-            embeddings = embedding_model.encode(docs_for_embedding, show_progress_bar=True)
-            end_embed = time.time()
-            st.write(f"Embedding took {end_embed - start_embed:.2f} seconds.")
-
-        # —— 新增：把 embedding 存到全局 map —— 
-        from config import id_to_embedding_map
-        for idx, emb in enumerate(embeddings):
-            data_to_insert[idx]["embedding"] = emb
-            # idx 就是 doc_id
-            id_to_embedding_map[idx] = emb
-
-        st.write("Inserting data into Milvus Lite...")
-        with st.spinner("Inserting..."):
-            try:
-                start_insert = time.time()
-                client.insert(collection_name=collection_name, data=data_to_insert)
-                end_insert = time.time()
-                st.success(f"Indexed {len(data_to_insert)} docs in {end_insert - start_insert:.2f}s.")
-
-                # —— 原有：更新文档映射 —— 
-                id_to_doc_map.update(temp_id_map)
-                return True
+    if not current_ids:
+        log.error("No valid content to index.")
+        return False
 
-            except Exception as e:
-                st.error(f"Error inserting data into Milvus Lite: {e}")
-                return False
+    vanished_ids = [doc_id for doc_id in indexed_hashes if doc_id not in current_ids]
 
-    elif current_count >= len(docs_for_embedding):
-        st.write("Data count suggests indexing is complete.")
-        if not id_to_doc_map:
-            id_to_doc_map.update(temp_id_map)
+    if not changed_rows and not vanished_ids:
+        log.write("Index manifest is up to date, no indexing required.")
         return True
-    else:
-        st.error("No valid content to index.")
-        return False
-
 
+    log.warning(
+        f"Incremental indexing required: {len(changed_rows)} new/changed, "
+        f"{len(vanished_ids)} removed (of {len(current_ids)} chunks)."
+    )
+
+    embed_s = upsert_s = 0.0
+    for start in range(0, len(changed_rows), INDEX_BATCH_SIZE):
+        rows = changed_rows[start:start + INDEX_BATCH_SIZE]
+        # 只为新增/修改的 chunk 生成 embeddings
+        with log.spinner(f"Embedding chunks {start + 1}-{start + len(rows)} of {len(changed_rows)}..."), \
+                span("index_embedding") as s:
+            # 读穿持久化缓存：重启后已见过的文本无需重新编码
+            embeddings = get_embedding_cache().encode([row_content(row) for row in rows], embedding_model)
+        embed_s += s.seconds
+        try:
+            with span("index_upsert") as s:
+                upsert_rows(client, rows, embeddings, collection_name)
+        except Exception as e:
+            log.error(f"Error upserting data into Milvus Lite: {e}")
+            return False
+        upsert_s += s.seconds
+        # Milvus 写入成功后再更新 doc store（即 manifest），保证崩溃后可重试
+        store.upsert_docs(rows)
+        count("rag_indexed_chunks_total", len(rows), help="Chunks embedded and upserted by indexing.")
+    if changed_rows:
+        log.success(f"Embedded and upserted {len(changed_rows)} chunks "
+                    f"(embedding {embed_s:.2f}s, upsert {upsert_s:.2f}s).")
+        bump_index_version()
+
+    if vanished_ids:
+        try:
+            client.delete(collection_name=collection_name, ids=vanished_ids)
+            log.write(f"Deleted {len(vanished_ids)} vanished chunks from Milvus Lite.")
+        except Exception as e:
+            log.error(f"Error deleting vanished chunks from Milvus Lite: {e}")
+            return False
+        store.delete_docs(vanished_ids)
+        bump_index_version()
 
-def search_similar_documents(client, query, embedding_model):
-    """Searches Milvus Lite for documents similar to the query using MilvusClient."""
+    # BM25 倒排索引随 doc store 一起更新，混合检索不会读到旧语料
+    try:
+        build_lexical_index(store)
+    except Exception as e:
+        log.warning(f"Could not build lexical index: {e}")
+
+    store.set_meta(**_index_identity())
+    return True
+
+
+# 不同 pymilvus 版本 search 接受参数的方式不同：启动时探测一次可用的调用方式并缓存，
+# 避免每次查询都走 try/except 回退链。 key: id(client) -> 调用方式名称
+_search_variants = {}
+
+
+def _call_search(client, variant, vectors, limit, collection_name=COLLECTION_NAME, profile=None):
+    """
+    按指定方式调用 client.search，返回每个查询向量对应的 hits 列表。
+    profile 默认为当前生效的索引配置，决定度量类型与 nprobe / ef 等检索参数。
+    """
+    profile = profile or get_index_profile()
+    params = profile["search_params"]
+    search_params = {
+        "collection_name": collection_name,
+        "data": vectors,
+        "anns_field": "embedding",
+        "limit": limit,
+        "output_fields": ["id"]
+    }
+    if variant == "search_params":
+        return client.search(
+            **search_params,
+            search_params={"metric_type": profile["metric_type"], "params": params}
+        )
+    if variant == "search_with_params":
+        return client.search_with_params(**search_params, search_params=params)
+    if variant == "kwargs":
+        return client.search(**search_params, **params)
+    return client.search(**search_params)
+
+
+def detect_search_variant(client):
+    """用零向量探测当前 client 支持的 search 调用方式（每个 client 只探测一次）。"""
+    key = id(client)
+    if key in _search_variants:
+        return _search_variants[key]
+    candidates = ["search_params", "kwargs", "plain"]
+    if hasattr(client, 'search_with_params'):
+        candidates.insert(0, "search_with_params")
+    probe = [[0.0] * EMBEDDING_DIM]
+    for variant in candidates:
+        try:
+            _call_search(client, variant, probe, 1)
+        except Exception as e:
+            log.write(f"Search variant '{variant}' not supported: {e}")
+            count("rag_milvus_search_variant_failures_total", variant=variant,
+                  help="Search call styles rejected while probing the client.")
+            continue
+        log.write(f"Using Milvus search variant: '{variant}'.")
+        _search_variants[key] = variant
+        return variant
+    # 探测全部失败（例如 collection 尚未就绪）：不缓存，下次再探测
+    return "plain"
+
+
+def search_by_vectors(client, query_vectors, top_k=TOP_K, collection_name=COLLECTION_NAME, profile=None):
+    """
+    用一组查询向量做批量检索，每 SEARCH_BATCH_SIZE 个向量合并为一次 Milvus 请求。
+    collection_name / profile 默认为主 collection 与当前索引配置（index_tuner.py 会指定候选配置）。
+    Returns:
+      - List[(hit_ids, distances)]，与 query_vectors 一一对应
+    """
+    variant = detect_search_variant(client)
+    results = []
+    for start in range(0, len(query_vectors), SEARCH_BATCH_SIZE):
+        batch = [list(map(float, v)) for v in query_vectors[start:start + SEARCH_BATCH_SIZE]]
+        with span("milvus_search", variant=variant):
+            res = _call_search(client, variant, batch, top_k, collection_name, profile) or []
+        count("rag_milvus_search_queries_total", len(batch), variant=variant,
+              help="Query vectors sent to Milvus, by search call style.")
+        for i in range(len(batch)):
+            hits = res[i] if i < len(res) and res[i] else []
+            results.append((
+                [hit['id'] for hit in hits],
+                [hit['distance'] for hit in hits]
+            ))
+    return results
+
+
+def embed_queries(queries, embedding_model):
+    """
+    编码一批查询，经过 (规范化查询文本 -> 向量) 缓存；未命中的查询合并为一次批量 encode。
+    Returns:
+      - (len(queries), dim) float32 矩阵
+    """
+    normalized = [normalize_query(q) for q in queries]
+    vectors = [query_embedding_cache.get(q) for q in normalized]
+    missing = list(dict.fromkeys(q for q, v in zip(normalized, vectors) if v is None))
+    count("rag_cache_requests_total", len(queries) - len(missing), cache="query_embedding", result="hit",
+          help="Query-side cache lookups.")
+    if missing:
+        count("rag_cache_requests_total", len(missing), cache="query_embedding", result="miss")
+        with span("query_encode"):
+            encoded = np.asarray(
+                embedding_model.encode(missing, batch_size=SEARCH_BATCH_SIZE), dtype=np.float32
+            )
+        fresh = dict(zip(missing, encoded))
+        for q, v in fresh.items():
+            query_embedding_cache.put(q, v)
+        vectors = [fresh[q] if v is None else v for q, v in zip(normalized, vectors)]
+    return np.stack(vectors)
+
+
+def search_many(client, queries, embedding_model, top_k=TOP_K, query_embeddings=None):
+    """
+    批量检索：一次前向计算编码所有查询，再以多向量请求发往 Milvus。
+    调用方已编码过查询时传入 query_embeddings（与 queries 一一对应），不再重复查缓存 / 编码。
+    检索结果按 (查询向量, top_k, 索引版本) 缓存，索引变化后自动失效。
+    Returns:
+      - List[(hit_ids, distances)]，与 queries 一一对应；出错时每项为 ([], [])
+    """
     if not client or not embedding_model:
-        st.error("Milvus client or embedding model not available for search.")
-        return [], []
+        log.error("Milvus client or embedding model not available for search.")
+        return [([], []) for _ in queries]
+    if not queries:
+        return []
 
-    collection_name = COLLECTION_NAME
     try:
-        query_embedding = embedding_model.encode([query])[0]
-
-        # 重写search调用，使用更兼容的方式
-        search_params = {
-            "collection_name": collection_name,
-            "data": [query_embedding],
-            "anns_field": "embedding",
-            "limit": TOP_K,
-            "output_fields": ["id"]
-        }
-        
-        # 尝试不同的方式传递搜索参数
-        if hasattr(client, 'search_with_params'):
-            # 如果存在专门的方法
-            res = client.search_with_params(**search_params, search_params=SEARCH_PARAMS)
-        else:
-            # 标准方法，直接设置参数（当前版本会导致参数冲突）
-            try:
-                # 尝试1：不传递param参数
-                res = client.search(**search_params)
-            except Exception as e1:
-                st.warning(f"搜索尝试1失败: {e1}，将尝试备用方法...")
-                try:
-                    # 尝试2：通过搜索参数关键字传递
-                    res = client.search(**search_params, **SEARCH_PARAMS)
-                except Exception as e2:
-                    st.warning(f"搜索尝试2失败: {e2}，将尝试最后一种方法...")
-                    # 尝试3：结合参数
-                    final_params = search_params.copy()
-                    final_params["nprobe"] = SEARCH_PARAMS.get("nprobe", 16)
-                    res = client.search(**final_params)
-
-        # Process results (structure might differ slightly)
-        # client.search returns a list of lists of hits (one list per query vector)
-        if not res or not res[0]:
-            return [], []
-
-        hit_ids = [hit['id'] for hit in res[0]]
-        distances = [hit['distance'] for hit in res[0]]
-        return hit_ids, distances
+        if query_embeddings is None:
+            query_embeddings = embed_queries(queries, embedding_model)
+        version = get_index_version()
+        keys = [
+            (hashlib.md5(v.tobytes()).hexdigest(), top_k, version)
+            for v in query_embeddings
+        ]
+        results = [search_result_cache.get(k) for k in keys]
+        missing = [i for i, r in enumerate(results) if r is None]
+        count("rag_cache_requests_total", len(keys) - len(missing), cache="search_result", result="hit")
+        count("rag_cache_requests_total", len(missing), cache="search_result", result="miss")
+        if missing:
+            fresh = search_by_vectors(client, query_embeddings[missing], top_k)
+            for i, r in zip(missing, fresh):
+                search_result_cache.put(keys[i], r)
+                results[i] = r
+        return results
     except Exception as e:
-        st.error(f"Error during Milvus Lite search: {e}")
-        return [], [] 
\ No newline at end of file
+        log.error(f"Error during Milvus Lite search: {e}")
+        count("rag_errors_total", stage="milvus_search", help="Errors swallowed by pipeline stages.")
+        return [([], []) for _ in queries]
+
+
+def search_similar_documents(client, query, embedding_model):
+    """Searches Milvus Lite for documents similar to the query using MilvusClient."""
+    return search_many(client, [query], embedding_model)[0]
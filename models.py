@@ -1,37 +1,167 @@
-import streamlit as st
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, AutoModelForCausalLM
-import torch
-
-@st.cache_resource
-def load_embedding_model(model_name):
-    """Loads the sentence transformer model."""
-    st.write(f"Loading embedding model: {model_name}...")
+import sys
+
+from config import EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND, GENERATION_BACKEND
+from runtime import cache_resource, log
+
+# torch / transformers / sentence_transformers 在首次加载模型时才导入，
+# 只做检索、索引或预处理的进程不必承担其导入耗时与内存
+
+# torch: 原始精度；int8: 动态量化 nn.Linear（仅 CPU）；onnx: ONNX Runtime；bf16: bfloat16 权重
+SUPPORTED_BACKENDS = ("torch", "int8", "onnx", "bf16")
+
+# (embedding 模型名, 配置的后端) -> 实际使用的后端（经过 resolve_backend 与 onnx 导出失败的回退）
+_embedding_backends = {}
+
+
+def bf16_supported() -> bool:
+    """GPU 或带 AVX512-BF16 / AMX 指令的 CPU 上 bf16 才比 fp32 快。"""
+    import torch
+    if torch.cuda.is_available():
+        return torch.cuda.is_bf16_supported()
+    checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+    return any(getattr(torch.cpu, name, lambda: False)() for name in checks)
+
+
+def onnx_available() -> bool:
+    try:
+        import onnxruntime  # noqa: F401
+        import optimum.onnxruntime  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+
+def resolve_backend(backend: str) -> str:
+    """
+    校验配置的后端，当前环境不支持时退回 torch：
+      - onnx 需要安装 optimum[onnxruntime]；
+      - int8 动态量化只有 CPU kernel；
+      - bf16 需要硬件支持。
+    """
+    import torch
+    if backend not in SUPPORTED_BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {SUPPORTED_BACKENDS}")
+    reason = None
+    if backend == "onnx" and not onnx_available():
+        reason = "onnxruntime / optimum are not installed"
+    elif backend == "int8" and torch.cuda.is_available():
+        reason = "dynamic int8 quantization only runs on CPU"
+    elif backend == "bf16" and not bf16_supported():
+        reason = "this device has no native bf16 support"
+    if reason:
+        log.warning(f"Backend '{backend}' unavailable ({reason}), falling back to 'torch'.")
+        return "torch"
+    return backend
+
+
+def quantize_int8(module):
+    """把 module 中所有 nn.Linear 原地替换为动态 int8 量化版本（权重 int8，激活按批动态量化）。"""
+    import torch
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_with_fallback(load, backend):
+    """
+    调用 load(backend)；onnx 导出失败（如 optimum 与 transformers 版本不匹配）时
+    警告并改用 load("torch")，服务仍可启动。
+    """
+    if backend == "onnx":
+        try:
+            model = load("onnx")
+            model.inference_backend = "onnx"
+            return model
+        except Exception as e:
+            log.warning(f"ONNX export failed ({e}), falling back to 'torch'.")
+            backend = "torch"
+    model = load(backend)
+    model.inference_backend = backend
+    return model
+
+
+def embedding_backend(model_name=EMBEDDING_MODEL_NAME, backend=EMBEDDING_BACKEND) -> str:
+    """
+    embedding 向量实际来自的后端，用于 embedding 缓存键与索引标识：
+    本进程已加载过该模型时取加载结果（含 onnx 导出失败的回退），否则按 resolve_backend 推断。
+    """
+    if backend == "torch":
+        return backend
+    key = (model_name, backend)
+    if key not in _embedding_backends:
+        _embedding_backends[key] = resolve_backend(backend)
+    return _embedding_backends[key]
+
+
+def is_torch_model(model) -> bool:
+    """ONNX Runtime 模型不是 nn.Module，不支持前缀 KV 缓存与连续合批调度。"""
+    torch = sys.modules.get("torch")  # 未导入 torch 时不可能是 torch 模型
+    return torch is not None and isinstance(model, torch.nn.Module)
+
+
+def _load_sentence_transformer(model_name, backend):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+    model = SentenceTransformer(model_name)
+    if backend == "int8":
+        return quantize_int8(model)
+    if backend == "bf16":
+        return model.to(torch.bfloat16)
+    return model
+
+
+@cache_resource
+def load_embedding_model(model_name, backend=EMBEDDING_BACKEND):
+    """Loads the sentence transformer model with the configured inference backend."""
+    configured, backend = backend, resolve_backend(backend)
+    log.write(f"Loading embedding model: {model_name} ({backend})...")
     try:
-        model = SentenceTransformer(model_name)
-        st.success("Embedding model loaded.")
+        model = load_with_fallback(lambda b: _load_sentence_transformer(model_name, b), backend)
+        _embedding_backends[(model_name, configured)] = model.inference_backend
+        log.success("Embedding model loaded.")
         return model
     except Exception as e:
-        st.error(f"Failed to load embedding model: {e}")
+        log.error(f"Failed to load embedding model: {e}")
         return None
 
-@st.cache_resource
-def load_generation_model(model_name):
-    """Loads the Hugging Face generative model and tokenizer."""
-    st.write(f"Loading generation model: {model_name}...")
-    try:
-        tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
-        # Adjust device_map and torch_dtype based on your hardware
+
+def _load_causal_lm(model_name, backend):
+    import torch
+    from transformers import AutoModelForCausalLM
+    if backend == "onnx":
+        from optimum.onnxruntime import ORTModelForCausalLM
+        return ORTModelForCausalLM.from_pretrained(model_name, export=True, trust_remote_code=True)
+    if backend == "int8":
+        # 动态量化只有 CPU kernel，不能交给 device_map 放到 GPU
         model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            trust_remote_code=True,
-            device_map="auto", # Use 'cpu' if no GPU or driver issues
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
+            model_name, trust_remote_code=True, torch_dtype=torch.float32
         )
+        return quantize_int8(model.eval())
+    if backend == "bf16":
+        dtype = torch.bfloat16
+    else:
+        dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+    return AutoModelForCausalLM.from_pretrained(
+        model_name,
+        trust_remote_code=True,
+        device_map="auto", # Use 'cpu' if no GPU or driver issues
+        torch_dtype=dtype
+    )
+
+
+@cache_resource
+def load_generation_model(model_name, backend=GENERATION_BACKEND):
+    """Loads the Hugging Face generative model and tokenizer with the configured inference backend."""
+    backend = resolve_backend(backend)
+    log.write(f"Loading generation model: {model_name} ({backend})...")
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+        model = load_with_fallback(lambda b: _load_causal_lm(model_name, b), backend)
         if tokenizer.pad_token is None:
              tokenizer.pad_token = tokenizer.eos_token
-        st.success("Generation model and tokenizer loaded.")
+        log.success("Generation model and tokenizer loaded.")
         return model, tokenizer
     except Exception as e:
-        st.error(f"Failed to load generation model: {e}")
-        return None, None 
\ No newline at end of file
+        log.error(f"Failed to load generation model: {e}")
+        return None, None
@@ -0,0 +1,266 @@
+"""
+近重复检测：字符 shingle 的 MinHash 签名 + LSH 分桶，估计 Jaccard 相似度不低于阈值即视为近重复
+（公众号转载的微改版本、不同来源的同一段落）。
+  - 签名按批向量化计算：整批文档的 shingle 哈希拼成一个数组，逐个哈希函数做乘移哈希，
+    再用 np.minimum.reduceat 按文档取最小值；
+  - LSH：签名切成 bands 段，每段哈希为一个桶键，只有至少一个桶键相同的文档才进一步比较签名，
+    代价与语料规模近似线性；bands / rows 按阈值选取，使漏检与误检的概率之和最小；
+  - 索引持久化在 SQLite（桶键表 + 签名表），新一批文档与已有语料比对，可流式、增量地运行。
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from config import NEAR_DUP_THRESHOLD, NEAR_DUP_NUM_PERM, NEAR_DUP_SHINGLE_SIZE
+from runtime import log
+
+_MAX_SQL_VARS = 900
+_IGNORED = re.compile(r'[\s\W_]+')
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz  # numpy < 2.0
+
+
+def lsh_params(threshold, num_perm):
+    """
+    选取 (bands, rows)，bands * rows <= num_perm，使阈值两侧的误检面积与漏检面积之和最小：
+    相似度为 s 的两篇文档至少落入一个相同桶的概率为 1 - (1 - s^rows)^bands。
+    """
+    below = np.linspace(0.0, threshold, 101)
+    above = np.linspace(threshold, 1.0, 101)
+    best, best_error = (1, num_perm), float("inf")
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positive = _trapezoid(1 - (1 - below ** rows) ** bands, below)
+            false_negative = _trapezoid((1 - above ** rows) ** bands, above)
+            if false_positive + false_negative < best_error:
+                best, best_error = (bands, rows), false_positive + false_negative
+    return best
+
+
+def shingle_hashes(text, size=NEAR_DUP_SHINGLE_SIZE):
+    """
+    去掉空白与标点、转小写后的字符 size-gram 的 32 位哈希（去重）。
+    用多项式滚动哈希对整段码点数组一次性计算，不逐个切片。
+    """
+    codes = np.frombuffer(_IGNORED.sub("", text.lower()).encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    n = len(codes) - size + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    h = np.zeros(n, dtype=np.uint64)
+    for j in range(size):
+        h = h * np.uint64(1000003) + codes[j:j + n]
+    return np.unique((h * _GOLDEN) >> np.uint64(32))
+
+
+class NearDupIndex:
+    """
+    MinHash LSH 索引，持久化在 SQLite：
+      - docs 表：rowid -> doc_key / source / 签名（uint32 数组的字节）；
+      - buckets 表：(桶键, rowid)，桶键已混入 band 序号，不同 band 之间不会互相命中；
+      - meta 表：签名参数，与当前参数不一致时清空重建。
+    path 为 None 时只在内存中运行。
+    """
+
+    def __init__(self, path=None, threshold=NEAR_DUP_THRESHOLD, num_perm=NEAR_DUP_NUM_PERM,
+                 shingle_size=NEAR_DUP_SHINGLE_SIZE, seed=0):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self._band_mix = rng.integers(1, 1 << 63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self._band_salt = rng.integers(0, 1 << 63, size=self.bands, dtype=np.uint64)
+
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " rowid INTEGER PRIMARY KEY, doc_key TEXT UNIQUE, source TEXT, signature BLOB NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS docs_source ON docs (source)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER NOT NULL, doc INTEGER NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_bucket ON buckets (bucket)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        params = json.dumps({"num_perm": num_perm, "bands": self.bands, "rows": self.rows,
+                             "shingle_size": shingle_size, "seed": seed})
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if row and row[0] != params:
+            log.warning(f"Near-duplicate index at {path} was built with other parameters, clearing it.")
+            self.clear()
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)", (params,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def signatures(self, texts) -> np.ndarray:
+        """
+        整批计算 MinHash 签名，(len(texts), num_perm) uint32；没有任何 shingle 的文本整行为 0xFFFFFFFF。
+        第 p 个哈希函数为乘移哈希 (a_p * x + b_p) mod 2^64 >> 32。
+        按哈希函数循环、在一维缓冲区上原地运算，比 (shingle 数 × num_perm) 的二维矩阵快且内存只与 shingle 数成正比。
+        """
+        sigs = np.full((len(texts), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        hashes = [shingle_hashes(t, self.shingle_size) for t in texts]
+        group = [i for i, h in enumerate(hashes) if len(h)]
+        if not group:
+            return sigs
+        x = np.concatenate([hashes[i] for i in group])
+        offsets = np.cumsum([0] + [len(hashes[i]) for i in group[:-1]])
+        values = np.empty_like(x)
+        minima = np.empty((len(group), self.num_perm), dtype=np.uint64)
+        for p in range(self.num_perm):
+            np.multiply(x, self._a[p], out=values)
+            values += self._b[p]
+            values >>= np.uint64(32)
+            minima[:, p] = np.minimum.reduceat(values, offsets)
+        sigs[group] = minima
+        return sigs
+
+    def bucket_keys(self, sigs) -> np.ndarray:
+        """每个签名的 bands 个桶键，(n, bands) int64（SQLite INTEGER）。"""
+        banded = sigs[:, :self.bands * self.rows].astype(np.uint64).reshape(len(sigs), self.bands, self.rows)
+        keys = (banded * self._band_mix).sum(axis=2) + self._band_salt
+        return (keys * _GOLDEN).view(np.int64)
+
+    def _lookup(self, keys):
+        """已入库文档中与任一桶键相同者：{桶键: [rowid]}。"""
+        found = {}
+        keys = list({int(k) for k in keys})
+        for start in range(0, len(keys), _MAX_SQL_VARS):
+            batch = keys[start:start + _MAX_SQL_VARS]
+            placeholders = ",".join("?" * len(batch))
+            for bucket, doc in self._conn.execute(
+                f"SELECT bucket, doc FROM buckets WHERE bucket IN ({placeholders})", batch
+            ):
+                found.setdefault(bucket, []).append(doc)
+        return found
+
+    def _existing(self, doc_keys):
+        """已入库的 doc_key 集合。"""
+        doc_keys = list(doc_keys)
+        found = set()
+        for start in range(0, len(doc_keys), _MAX_SQL_VARS):
+            batch = doc_keys[start:start + _MAX_SQL_VARS]
+            placeholders = ",".join("?" * len(batch))
+            found.update(r[0] for r in self._conn.execute(
+                f"SELECT doc_key FROM docs WHERE doc_key IN ({placeholders})", batch
+            ))
+        return found
+
+    def _stored(self, rowids):
+        """rowid -> (doc_key, 签名)。"""
+        rowids = list(rowids)
+        result = {}
+        for start in range(0, len(rowids), _MAX_SQL_VARS):
+            batch = rowids[start:start + _MAX_SQL_VARS]
+            placeholders = ",".join("?" * len(batch))
+            for rowid, doc_key, blob in self._conn.execute(
+                f"SELECT rowid, doc_key, signature FROM docs WHERE rowid IN ({placeholders})", batch
+            ):
+                result[rowid] = (doc_key, np.frombuffer(blob, dtype=np.uint32))
+        return result
+
+    def find_duplicates(self, doc_keys, texts, sources=None, add=True):
+        """
+        逐条判断一批文档是否与已入库文档、或本批中排在前面的文档近重复。
+        doc_key 已在库中的文档（增量运行时未变化文件中上次保留的块）直接视为非重复，不再计算签名；
+        短到没有 shingle 的文本不参与判断。
+        add=True 时把非重复文档写入索引。
+        Returns:
+          - 与输入一一对应：重复时为被重复的 doc_key，否则为 None
+        """
+        sources = sources or [None] * len(texts)
+        with self._lock:
+            known = self._existing(doc_keys)
+        todo = [i for i, doc_key in enumerate(doc_keys) if doc_key not in known]
+        result = [None] * len(doc_keys)
+        if not todo:
+            return result
+        doc_keys = [doc_keys[i] for i in todo]
+        sigs = self.signatures([texts[i] for i in todo])
+        keys = self.bucket_keys(sigs)
+        empty = (sigs == np.iinfo(np.uint32).max).all(axis=1)
+        with self._lock:
+            stored_buckets = self._lookup(keys.ravel())
+            stored = self._stored({doc for docs in stored_buckets.values() for doc in docs})
+
+            accepted, batch_buckets = [], {}
+            for i, doc_key in enumerate(doc_keys):
+                if empty[i]:
+                    continue
+                candidates = {}
+                for key in keys[i].tolist():
+                    for doc in stored_buckets.get(key, ()):
+                        if doc in stored:
+                            candidates[stored[doc][0]] = stored[doc][1]
+                    for j in batch_buckets.get(key, ()):
+                        candidates[doc_keys[j]] = sigs[j]
+                candidates.pop(doc_key, None)
+                duplicate_of = None
+                for other_key, other_sig in candidates.items():
+                    if np.mean(other_sig == sigs[i]) >= self.threshold:
+                        duplicate_of = other_key
+                        break
+                result[todo[i]] = duplicate_of
+                if duplicate_of is None and doc_key not in known:
+                    known.add(doc_key)
+                    accepted.append(i)
+                    for key in keys[i].tolist():
+                        batch_buckets.setdefault(key, []).append(i)
+
+            if add and accepted:
+                self._insert([doc_keys[i] for i in accepted], [sources[todo[i]] for i in accepted],
+                             sigs[accepted], keys[accepted])
+        return result
+
+    def _insert(self, doc_keys, sources, sigs, keys):
+        with self._conn:
+            buckets = []
+            for doc_key, source, sig, row in zip(doc_keys, sources, sigs, keys.tolist()):
+                cur = self._conn.execute(
+                    "INSERT INTO docs (doc_key, source, signature) VALUES (?, ?, ?)",
+                    (doc_key, source, sig.tobytes())
+                )
+                buckets.extend((key, cur.lastrowid) for key in row)
+            self._conn.executemany("INSERT INTO buckets (bucket, doc) VALUES (?, ?)", buckets)
+
+    def remove_sources(self, sources):
+        """
+        删除来自给定 source（preprocess 中为文件名）的文档，用于增量运行时重新解析已变化的文件。
+        桶键由存储的签名重新计算，按 buckets 表的桶键索引删除，不扫描全表。
+        """
+        sources = list(sources)
+        with self._lock, self._conn:
+            for start in range(0, len(sources), _MAX_SQL_VARS):
+                batch = sources[start:start + _MAX_SQL_VARS]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT rowid, signature FROM docs WHERE source IN ({placeholders})", batch
+                ).fetchall()
+                if not rows:
+                    continue
+                sigs = np.stack([np.frombuffer(blob, dtype=np.uint32) for _, blob in rows])
+                self._conn.executemany(
+                    "DELETE FROM buckets WHERE bucket = ? AND doc = ?",
+                    ((key, rowid) for (rowid, _), keys in zip(rows, self.bucket_keys(sigs).tolist()) for key in keys)
+                )
+                self._conn.executemany("DELETE FROM docs WHERE rowid = ?", ((rowid,) for rowid, _ in rows))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM buckets")
+            self._conn.execute("DELETE FROM docs")
+
+    def close(self):
+        self._conn.close()
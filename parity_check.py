@@ -0,0 +1,193 @@
+"""
+对比推理后端与 fp32 torch 基线的数值偏差与吞吐：
+  - embedding：逐条余弦相似度（drift = 1 - cos）与 encode 吞吐；
+  - rerank：每个查询下候选排序的 Spearman 相关、top-1 一致率与 pairs/s；
+  - generation：贪心解码 token 一致率与 tokens/s。
+用法：python parity_check.py --embedding-backend int8 --rerank-backend onnx --generation-backend bf16
+"""
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+import torch
+
+from config import (
+    DATA_FILE, EMBEDDING_MODEL_NAME, RERANK_MODEL_NAME, GENERATION_MODEL_NAME,
+    EMBEDDING_BACKEND, RERANK_BACKEND, GENERATION_BACKEND
+)
+from data_utils import iter_data
+from models import load_embedding_model, load_generation_model
+from rerank_utils import load_reranker, truncate_passage
+from runtime import configure_logging
+
+_FALLBACK_TEXTS = [
+    "Hypertension is a chronic condition in which blood pressure in the arteries is persistently elevated.",
+    "糖尿病是一组以高血糖为特征的代谢性疾病，长期高血糖会导致多种器官损害。",
+    "Vaccines train the immune system to recognise a pathogen without causing the disease.",
+    "阿司匹林常用于解热镇痛，也可用于预防心血管事件。",
+    "Regular physical activity lowers the risk of heart disease, stroke and type 2 diabetes.",
+    "抗生素对病毒感染无效，滥用会导致细菌耐药。",
+]
+
+
+def load_samples(path, n):
+    """从数据文件取前 n 个 (title, abstract)；文件不存在时使用内置样例。"""
+    try:
+        docs = [(d.get("title", ""), d.get("abstract", "")) for d in itertools.islice(iter_data(path), n)]
+    except (OSError, ValueError):
+        docs = []
+    docs = [d for d in docs if d[1]]
+    return docs or [(text.split("，")[0].split(",")[0], text) for text in _FALLBACK_TEXTS]
+
+
+def _require(model, what):
+    if model is None:
+        raise SystemExit(f"Failed to load {what}, see the error above.")
+    return model
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _ranks(values):
+    ranks = np.empty(len(values))
+    ranks[np.argsort(values)] = np.arange(len(values))
+    return ranks
+
+
+def _spearman(a, b):
+    if len(a) < 2:
+        return 1.0
+    ra, rb = _ranks(a), _ranks(b)
+    if ra.std() == 0 or rb.std() == 0:
+        return 1.0
+    return float(np.corrcoef(ra, rb)[0, 1])
+
+
+def check_embedding(model_name, backend, texts, batch_size):
+    base_model = _require(load_embedding_model(model_name, "torch"), "baseline embedding model")
+    test_model = _require(load_embedding_model(model_name, backend), f"{backend} embedding model")
+    base, base_s = _timed(lambda: base_model.encode(texts, batch_size=batch_size, normalize_embeddings=True))
+    test, test_s = _timed(lambda: test_model.encode(texts, batch_size=batch_size, normalize_embeddings=True))
+    cos = np.sum(np.asarray(base, dtype=np.float32) * np.asarray(test, dtype=np.float32), axis=1)
+    return {
+        "backend": backend,
+        "texts": len(texts),
+        "cosine_mean": float(cos.mean()),
+        "cosine_min": float(cos.min()),
+        "drift_max": float(1.0 - cos.min()),
+        "baseline_texts_per_s": len(texts) / base_s,
+        "backend_texts_per_s": len(texts) / test_s,
+    }
+
+
+def check_rerank(model_name, backend, queries, passages, batch_size):
+    base_model = load_reranker(model_name, backend="torch")
+    test_model = load_reranker(model_name, backend=backend)
+    passages = [truncate_passage(p) for p in passages]
+    pairs = [(q, p) for q in queries for p in passages]
+    base, base_s = _timed(lambda: np.asarray(base_model.predict(pairs, batch_size=batch_size), dtype=np.float32))
+    test, test_s = _timed(lambda: np.asarray(test_model.predict(pairs, batch_size=batch_size), dtype=np.float32))
+    base = base.reshape(len(queries), len(passages))
+    test = test.reshape(len(queries), len(passages))
+    spearman = [_spearman(b, t) for b, t in zip(base, test)]
+    return {
+        "backend": backend,
+        "pairs": len(pairs),
+        "spearman_mean": float(np.mean(spearman)),
+        "spearman_min": float(np.min(spearman)),
+        "top1_agreement": float(np.mean(base.argmax(axis=1) == test.argmax(axis=1))),
+        "score_abs_diff_max": float(np.abs(base - test).max()),
+        "baseline_pairs_per_s": len(pairs) / base_s,
+        "backend_pairs_per_s": len(pairs) / test_s,
+    }
+
+
+def _greedy(model, tokenizer, prompts, max_new_tokens):
+    outputs, new_tokens = [], 0
+    start = time.perf_counter()
+    for prompt in prompts:
+        inputs = tokenizer(prompt, return_tensors="pt")
+        with torch.no_grad():
+            out = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                 pad_token_id=tokenizer.eos_token_id)
+        generated = out[0, inputs["input_ids"].shape[1]:].tolist()
+        outputs.append(generated)
+        new_tokens += len(generated)
+    return outputs, new_tokens / (time.perf_counter() - start)
+
+
+def _prefix_agreement(a, b):
+    n = max(len(a), len(b))
+    if n == 0:
+        return 1.0
+    same = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+    return same / n
+
+
+def check_generation(model_name, backend, prompts, max_new_tokens):
+    base_model, tokenizer = load_generation_model(model_name, "torch")
+    test_model, _ = load_generation_model(model_name, backend)
+    _require(base_model, "baseline generation model")
+    _require(test_model, f"{backend} generation model")
+    base, base_tps = _greedy(base_model, tokenizer, prompts, max_new_tokens)
+    test, test_tps = _greedy(test_model, tokenizer, prompts, max_new_tokens)
+    agreement = [_prefix_agreement(b, t) for b, t in zip(base, test)]
+    return {
+        "backend": backend,
+        "prompts": len(prompts),
+        "greedy_prefix_agreement": float(np.mean(agreement)),
+        "baseline_tokens_per_s": base_tps,
+        "backend_tokens_per_s": test_tps,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare inference backends against the fp32 torch baseline.")
+    parser.add_argument("--data-file", default=DATA_FILE)
+    parser.add_argument("--samples", type=int, default=64, help="参与对比的文档数")
+    parser.add_argument("--queries", type=int, default=8, help="rerank 对比的查询数（取文档标题）")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--embedding-model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--embedding-backend", default=EMBEDDING_BACKEND)
+    parser.add_argument("--rerank-model", default=RERANK_MODEL_NAME)
+    parser.add_argument("--rerank-backend", default=RERANK_BACKEND)
+    parser.add_argument("--generation-model", default=GENERATION_MODEL_NAME)
+    parser.add_argument("--generation-backend", default=GENERATION_BACKEND)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--skip", nargs="*", default=[], choices=["embedding", "rerank", "generation"])
+    parser.add_argument("--output", help="另存 JSON 报告的路径")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    torch.manual_seed(0)
+    docs = load_samples(args.data_file, args.samples)
+    passages = [abstract for _, abstract in docs]
+    queries = [title or abstract[:64] for title, abstract in docs[:args.queries]]
+
+    report = {}
+    if "embedding" not in args.skip:
+        report["embedding"] = check_embedding(args.embedding_model, args.embedding_backend,
+                                              passages, args.batch_size)
+    if "rerank" not in args.skip:
+        report["rerank"] = check_rerank(args.rerank_model, args.rerank_backend,
+                                        queries, passages, args.batch_size)
+    if "generation" not in args.skip:
+        prompts = [f"Context: {p[:400]}\n\nUser Question: {q}\n\nAnswer:\n" for q, p in zip(queries, passages)]
+        report["generation"] = check_generation(args.generation_model, args.generation_backend,
+                                                prompts[:4], args.max_new_tokens)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
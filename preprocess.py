@@ -1,10 +1,20 @@
 import os
+import sys
 import json
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
 import re
 
-# 新增：导入过滤函数
-from data_utils import filter_documents
+# 新增：导入流式过滤 / 读取函数
+from chunker import chunk_documents, load_chunk_tokenizer
+from config import (
+    EMBEDDING_MODEL_NAME, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, NEAR_DUP_THRESHOLD, NEAR_DUP_INDEX_PATH
+)
+from data_utils import iter_filter_documents, iter_data, content_prefix
+from runtime import configure_logging
 
 def extract_text_and_title_from_html(html_filepath):
     """
@@ -53,90 +63,233 @@ def extract_text_and_title_from_html(html_filepath):
         print(f"处理文件 {html_filepath} 时出错: {e}")
         return None, None
 
-def split_text(text, chunk_size=500, chunk_overlap=50):
+# --- 配置 ---
+html_directory    = './data/'
+output_jsonl_path = './data/processed_data.jsonl'
+MIN_LENGTH        = 200
+DEDUP_WINDOW      = 1_000_000
+FILES_PER_TASK    = 64  # 每个进程池任务解析的文件数，同一任务内的文档合并分词
+
+
+def process_html_files(filepaths, tokenizer_name=EMBEDDING_MODEL_NAME,
+                       max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
     """
-    将文本分割成指定大小的块，并带有重叠。
-    Args:
-        text (str): 要分割的文本。
-        chunk_size (int): 每个块的目标字符数。
-        chunk_overlap (int): 相邻块之间的重叠字符数。
+    解析一批 HTML 文件并切块（在进程池的 worker 中执行），整批文档的句子一次分词。
+    char_start / char_end 为块在正文中的字符区间，相邻块的区间重叠即句子重叠。
     Returns:
-        list[str]: 文本块列表。
+        list[tuple]: [(文件名, 文本块条目列表)]；未能提取正文的文件列表为空。
     """
-    if not text:
-        return []
-
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += chunk_size - chunk_overlap
-        if start >= len(text):
-            break
-        if start < chunk_size and len(chunks) > 1 and \
-           chunks[-1] == chunks[-2][chunk_size-chunk_overlap:]:
-            chunks.pop()
-            start = len(text)
-
-    if start < len(text) and start > 0:
-        last_chunk = text[start-chunk_size+chunk_overlap:]
-        if chunks and last_chunk != chunks[-1]:
-            if not chunks[-1].endswith(last_chunk):
-                chunks.append(last_chunk)
-        elif not chunks:
-            chunks.append(last_chunk)
-
-    return [c.strip() for c in chunks if c.strip()]
-
-# --- 配置 ---
-html_directory    = './data/'
-output_json_path  = './data/processed_data.json'
-CHUNK_SIZE        = 512
-CHUNK_OVERLAP     = 50
-
-# --- 主处理逻辑 ---
-all_data_for_milvus = []
-file_count = 0
-chunk_count = 0
-
-print(f"开始处理目录 '{html_directory}' 中的 HTML 文件...")
-
-os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
-html_files = [f for f in os.listdir(html_directory) if f.endswith('.html')]
-print(f"找到 {len(html_files)} 个 HTML 文件。")
-
-for filename in html_files:
-    filepath = os.path.join(html_directory, filename)
-    print(f"  处理文件: {filename} ...")
-    file_count += 1
-
-    title, main_text = extract_text_and_title_from_html(filepath)
-    if main_text:
-        chunks = split_text(main_text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
-        print(f"    分割成 {len(chunks)} 个块。")
-        for i, chunk in enumerate(chunks):
-            chunk_count += 1
-            milvus_entry = {
+    parsed = []
+    for filepath in filepaths:
+        title, main_text = extract_text_and_title_from_html(filepath)
+        parsed.append((os.path.basename(filepath), title, main_text or ""))
+    tokenizer = load_chunk_tokenizer(tokenizer_name)
+    # 编码的是 "Title: ...\nAbstract: <块>"，标题与模板的 token 从每块的预算中扣除
+    parsed = [(filename, title or filename, text) for filename, title, text in parsed]
+    spans = chunk_documents([text for _, _, text in parsed], tokenizer, max_tokens, overlap_tokens,
+                            prefixes=[content_prefix(title) for _, title, _ in parsed])
+    return [
+        (filename, [
+            {
                 "id": f"{filename}_{i}",
-                "title": title or filename,
-                "abstract": chunk,
+                "title": title,
+                "abstract": text[start:end],
                 "source_file": filename,
-                "chunk_index": i
+                "chunk_index": i,
+                "char_start": start,
+                "char_end": end
             }
-            all_data_for_milvus.append(milvus_entry)
-    else:
-        print(f"    警告：未能提取正文，跳过。")
-
-print(f"\n处理完成。共 {file_count} 个文件，生成 {chunk_count} 个文本块。")
-
-# ——— 在保存前进行文档过滤 ———
-all_data_for_milvus = filter_documents(all_data_for_milvus, min_length=200)
-
-# --- 保存为 JSON ---
-try:
-    with open(output_json_path, 'w', encoding='utf-8') as f:
-        json.dump(all_data_for_milvus, f, ensure_ascii=False, indent=4)
-    print(f"结果已保存到: {output_json_path}")
-except Exception as e:
-    print(f"错误：无法写入 JSON 文件 {output_json_path}: {e}")
+            for i, (start, end) in enumerate(doc_spans)
+        ])
+        for (filename, title, text), doc_spans in zip(parsed, spans)
+    ]
+
+
+def _process_html_files_args(args):
+    return process_html_files(*args)
+
+
+def file_digest(filepath):
+    """返回文件内容的 SHA1，用于 mtime 变化但内容未变时跳过重新解析。"""
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_state(state_path):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_state(state_path, state):
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, state_path)
+
+
+def plan_files(html_files, html_dir, prev_state, can_reuse):
+    """
+    按 mtime/size（其次是内容哈希）判断哪些文件自上次运行后未变化。
+    Returns:
+        tuple: (未变化的文件名集合, 需要重新解析的文件名列表, 新的状态 dict)
+    """
+    unchanged, changed, state = set(), [], {}
+    for filename in html_files:
+        path = os.path.join(html_dir, filename)
+        stat = os.stat(path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        prev = prev_state.get(filename)
+        if can_reuse and prev and prev.get("size") == entry["size"] \
+                and prev.get("mtime_ns") == entry["mtime_ns"]:
+            entry["sha1"] = prev.get("sha1")
+            unchanged.add(filename)
+        else:
+            entry["sha1"] = file_digest(path)
+            if can_reuse and prev and prev.get("sha1") == entry["sha1"]:
+                unchanged.add(filename)
+            else:
+                changed.append(filename)
+        state[filename] = entry
+    return unchanged, changed, state
+
+
+def _iter_cached_chunks(chunks_path, unchanged):
+    """按文件分组读出上次缓存的（过滤前的）文本块：产出 (文件名, 文本块列表)，只含 unchanged 中的文件。"""
+    if not unchanged:
+        return
+    for filename, entries in itertools.groupby(iter_data(chunks_path), key=lambda e: e.get("source_file")):
+        if filename in unchanged:
+            yield filename, list(entries)
+
+
+def _iter_parsed_chunks(html_dir, changed, workers, tokenizer_name, max_tokens, overlap_tokens):
+    """进程池并行解析 changed 中的文件，按 changed 的顺序产出 (文件名, 文本块列表)。"""
+    if not changed:
+        return
+    batch_size = max(1, min(FILES_PER_TASK, len(changed) // (workers * 4)))
+    tasks = [
+        ([os.path.join(html_dir, f) for f in changed[i:i + batch_size]], tokenizer_name, max_tokens, overlap_tokens)
+        for i in range(0, len(changed), batch_size)
+    ]
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for results in pool.map(_process_html_files_args, tasks):
+            for filename, entries in results:
+                done += 1
+                if entries:
+                    print(f"  [{done}/{len(changed)}] {filename}: {len(entries)} 个块")
+                else:
+                    print(f"  [{done}/{len(changed)}] {filename}: 警告：未能提取正文，跳过。")
+                yield filename, entries
+
+
+def iter_chunks(html_dir, html_files, changed, chunks_path, unchanged, workers,
+                tokenizer_name, max_tokens, overlap_tokens, cache_file):
+    """
+    按 html_files 的顺序产出全部文件过滤前的文本块：未变化的文件取自上次的块缓存 chunks_path，
+    其余由进程池重新解析。每个块在交给过滤之前先原样写入 cache_file，作为下次运行的块缓存。
+    顺序与 --force 全量运行一致，后续的去重因此得到相同的结果。
+    """
+    cached = _iter_cached_chunks(chunks_path, unchanged)
+    parsed = _iter_parsed_chunks(html_dir, changed, workers, tokenizer_name, max_tokens, overlap_tokens)
+    heads = {}  # 来源 -> 已读出、但属于排在后面的文件的一组文本块（每个来源至多一组）
+    for filename in html_files:
+        # 两个来源都按文件名有序：读到文件名排在当前文件之后就停下，留给后面的文件。
+        # 上次没有产出文本块的文件不在块缓存中，不会因此把整个缓存读进内存
+        source = cached if filename in unchanged else parsed
+        entries = []
+        head = heads.pop(source, None) or next(source, None)
+        if head is not None:
+            if head[0] == filename:
+                entries = head[1]
+            else:
+                heads[source] = head
+        for entry in entries:
+            cache_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            yield entry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="将 HTML 文章解析、切块、过滤后流式写入 JSONL。")
+    parser.add_argument("--input-dir", default=html_directory, help="HTML 文件所在目录")
+    parser.add_argument("--output", default=output_jsonl_path, help="输出 JSONL 路径")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="解析进程数")
+    parser.add_argument("--tokenizer", default=EMBEDDING_MODEL_NAME, help="按此分词器计 token 数切块")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_MAX_TOKENS, help="每块最多 token 数（含特殊 token）")
+    parser.add_argument("--chunk-overlap-tokens", type=int, default=CHUNK_OVERLAP_TOKENS,
+                        help="相邻块重叠的句子最多 token 数")
+    parser.add_argument("--min-length", type=int, default=MIN_LENGTH)
+    parser.add_argument("--dedup-window", type=int, default=DEDUP_WINDOW,
+                        help="去重时最多保留的哈希个数（LRU）")
+    parser.add_argument("--near-dup-threshold", type=float, default=NEAR_DUP_THRESHOLD,
+                        help="近重复判定的 Jaccard 相似度阈值，0 表示关闭近重复过滤")
+    parser.add_argument("--near-dup-index", default=NEAR_DUP_INDEX_PATH, help="持久化的近重复 LSH 索引路径")
+    parser.add_argument("--force", action="store_true", help="忽略状态文件，重新解析全部文件")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    print(f"开始处理目录 '{args.input_dir}' 中的 HTML 文件...")
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    html_files = sorted(f for f in os.listdir(args.input_dir) if f.endswith('.html'))
+    print(f"找到 {len(html_files)} 个 HTML 文件。")
+
+    # 块缓存保存每个文件过滤前的文本块；切块参数变化时不可复用。
+    # 长度过滤与精确去重每次都在全部文本块上按文件顺序重跑，输出顺序与 --force 一致
+    state_path = args.output + ".state.json"
+    chunks_path = args.output + ".chunks.jsonl"
+    prev = load_state(state_path)
+    settings = {"tokenizer": args.tokenizer, "chunk_tokens": args.chunk_tokens,
+                "chunk_overlap_tokens": args.chunk_overlap_tokens, "chunk_budget": "title+abstract",
+                "near_dup_threshold": args.near_dup_threshold}
+    can_reuse = (not args.force and os.path.exists(chunks_path)
+                 and prev.get("settings") == settings)
+    unchanged, changed, file_state = plan_files(
+        html_files, args.input_dir, prev.get("files", {}), can_reuse
+    )
+    print(f"其中 {len(unchanged)} 个文件未变化（复用上次结果），{len(changed)} 个需要解析。")
+
+    # 近重复索引保存上次保留下来的块：全量运行时清空，增量运行时删掉将被重新解析或已删除的文件，
+    # 未变化文件中已在索引里的块直接保留，只有新块（及上次被过滤掉的块）计算签名并与已有语料比较
+    near_dup = None
+    if args.near_dup_threshold > 0:
+        from near_dup import NearDupIndex
+        near_dup = NearDupIndex(args.near_dup_index, threshold=args.near_dup_threshold)
+        if can_reuse:
+            near_dup.remove_sources(set(changed) | (set(prev.get("files", {})) - set(html_files)))
+        else:
+            near_dup.clear()
+
+    # 先写临时文件，完成后原子替换，中途失败不会破坏上次的输出与块缓存
+    tmp_path = args.output + ".tmp"
+    chunks_tmp_path = chunks_path + ".tmp"
+    stats = {}
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f, open(chunks_tmp_path, 'w', encoding='utf-8') as cache_file:
+            chunks = iter_chunks(args.input_dir, html_files, changed, chunks_path, unchanged,
+                                 max(1, args.workers), args.tokenizer, args.chunk_tokens,
+                                 args.chunk_overlap_tokens, cache_file)
+            for entry in iter_filter_documents(chunks, min_length=args.min_length,
+                                               max_seen=args.dedup_window, stats=stats, near_dup=near_dup):
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(chunks_tmp_path, chunks_path)
+        os.replace(tmp_path, args.output)
+    except Exception as e:
+        print(f"错误：无法写入 JSONL 文件 {args.output}: {e}")
+        return 1
+
+    save_state(state_path, {"settings": settings, "files": file_state})
+    print(f"\n处理完成。共 {len(html_files)} 个文件，"
+          f"{stats.get('before', 0)} 个文本块 → 过滤后 {stats.get('after', 0)} 个"
+          f"（其中近重复 {stats.get('near_duplicates', 0)} 个）。")
+    print(f"结果已保存到: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
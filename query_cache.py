@@ -0,0 +1,104 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from config import QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS
+
+
+class TTLLRUCache:
+    """线程安全的 LRU 缓存，每条记录带过期时间；统计命中/未命中次数便于评估容量。"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# 第一层：规范化查询文本 -> 查询向量
+query_embedding_cache = TTLLRUCache(QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS)
+# 第二层：(查询向量哈希, top_k, 索引版本) -> (hit_ids, distances)
+search_result_cache = TTLLRUCache(QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_TTL_SECONDS)
+
+# 本进程最近一次读到的索引版本；权威值持久化在 doc store 的 meta 表中，由各进程共享
+_index_version = None
+_version_lock = threading.Lock()
+
+
+def _observe_version(version: int):
+    """版本与本进程上次读到的不同（本进程或其它进程导入过）时，旧的检索结果全部失效。"""
+    global _index_version
+    with _version_lock:
+        if version != _index_version:
+            _index_version = version
+            search_result_cache.clear()
+
+
+def get_index_version() -> int:
+    """读取 doc store 中持久化的索引版本号，bulk_ingest 等其它进程的更新也能看到。"""
+    from doc_store import get_doc_store
+    version = int(get_doc_store().get_meta("index_version", 0))
+    _observe_version(version)
+    return version
+
+
+def bump_index_version() -> int:
+    """collection 内容变化后调用：持久化的版本号递增，所有进程中旧的检索结果随之失效。"""
+    from doc_store import get_doc_store
+    version = get_doc_store().increment_meta("index_version")
+    _observe_version(version)
+    return version
+
+
+def normalize_query(query: str) -> str:
+    """NFKC 归一化（全角转半角等）并压缩空白，使等价的查询命中同一缓存项。"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', query)).strip()
+
+
+def cache_stats() -> dict:
+    return {
+        "query_embedding": query_embedding_cache.stats(),
+        "search_result": search_result_cache.stats(),
+        "index_version": get_index_version(),
+    }
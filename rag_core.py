@@ -1,41 +1,201 @@
-import streamlit as st
+from runtime import log
+import threading
+import time
 import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
 from config import MAX_NEW_TOKENS_GEN, TEMPERATURE, TOP_P, REPETITION_PENALTY
+from context_packing import pack_context
+from kv_cache import prefix_kv_cache
+from metrics import span, observe, count
+from models import is_torch_model
 
-def generate_answer(query, context_docs, gen_model, tokenizer):
-    """Generates an answer using the LLM based on query and context."""
-    if not context_docs:
-        return "I couldn't find relevant documents to answer your question."
-    if not gen_model or not tokenizer:
-         st.error("Generation model or tokenizer not available.")
-         return "Error: Generation components not loaded."
+NO_CONTEXT_ANSWER = "I couldn't find relevant documents to answer your question."
+GENERATION_ERROR_ANSWER = "Sorry, I encountered an error while generating the answer."
 
-    context = "\n\n---\n\n".join([doc['content'] for doc in context_docs]) # Combine retrieved docs
 
-    prompt = f"""Based ONLY on the following context documents, answer the user's question.
+PROMPT_HEADER = """Based ONLY on the following context documents, answer the user's question.
 If the answer is not found in the context, state that clearly. Do not make up information.
 
 Context Documents:
-{context}
+"""
 
-User Question: {query}
 
-Answer:
-"""
+def build_prompt_parts(query, context_docs):
+    """
+    把 prompt 拆成 (静态指令头, 上下文块, 问题块) 三段，
+    前两段作为可复用 KV 缓存的前缀。
+    """
+    context = "\n\n---\n\n".join([doc['content'] for doc in context_docs]) # Combine retrieved docs
+    return PROMPT_HEADER, f"{context}\n\n", f"User Question: {query}\n\nAnswer:\n"
+
+
+def build_prompt(query, context_docs):
+    """Builds the RAG prompt from the query and the retrieved context docs."""
+    return "".join(build_prompt_parts(query, context_docs))
+
+
+def tokenize_prompt_parts(query, context_docs, tokenizer):
+    """按 (指令头, 上下文, 问题) 三段分别分词，前两段的分界作为前缀 KV 缓存的复用点。"""
+    return [tokenizer(p, add_special_tokens=False)["input_ids"] for p in build_prompt_parts(query, context_docs)]
+
+
+def _prepare_inputs(query, context_docs, gen_model, tokenizer, stats):
+    """
+    分段分词并从前缀 KV 缓存取出 header+context 的 past_key_values，
+    generate 只需预填充问题部分。缓存不可用时退回整段分词。
+    """
+    parts = build_prompt_parts(query, context_docs)
+    if not is_torch_model(gen_model):
+        # ONNX Runtime 模型自行管理 KV，不能接收 DynamicCache
+        stats["prefill_cached_tokens"] = 0
+        return tokenizer("".join(parts), return_tensors="pt")
+    try:
+        segments = tokenize_prompt_parts(query, context_docs, tokenizer)
+        with span("prefix_prefill"):
+            past_key_values, stats["prefill_cached_tokens"] = prefix_kv_cache.prefill(gen_model, segments[:2])
+        input_ids = torch.tensor([[i for seg in segments for i in seg]], device=gen_model.device)
+        return {
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "past_key_values": past_key_values,
+        }
+    except Exception as e:
+        log.write(f"Prefix KV cache unavailable, prefilling full prompt: {e}")
+        stats["prefill_cached_tokens"] = 0
+        return tokenizer("".join(parts), return_tensors="pt").to(gen_model.device)
+
+
+class _GenerationMonitor(StoppingCriteria):
+    """每生成一个 token 调用一次：统计新 token 数，并在 stop_event 被置位时中止生成。"""
+
+    def __init__(self, prompt_len, stop_event):
+        self.prompt_len = prompt_len
+        self.stop_event = stop_event
+        self.new_tokens = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.new_tokens = input_ids.shape[1] - self.prompt_len
+        return self.stop_event.is_set()
+
+
+def _stream_from_scheduler(request, stats, stop_event):
+    """消费已提交给共享 GenerationScheduler 的请求，与其它会话的请求连续合批 decode。"""
+    finished = False
+    try:
+        for text in request.stream():
+            if stop_event is not None and stop_event.is_set():
+                break
+            yield text
+        finished = True
+    except Exception as e:
+        log.error(f"Error during text generation: {e}")
+        yield GENERATION_ERROR_ANSWER
+    finally:
+        if not finished:
+            request.cancel()
+        latency = request.latency()
+        stats.update({k: v for k, v in latency.items() if v is not None})
+        stats["prefill_cached_tokens"] = request.cached_tokens
+        stats["cancelled"] = not finished
+        total = stats.get("total_s")
+        stats["tokens_per_s"] = latency["new_tokens"] / total if total else 0.0
+
+
+def generate_answer_stream(query, context_docs, gen_model, tokenizer, stats=None, stop_event=None,
+                           scheduler=None):
+    """
+    流式生成答案：generate 在后台线程运行，TextIteratorStreamer 逐段产出文本。
+    Args:
+      - stats: 可选 dict，写入 context_tokens / context_docs / prefill_cached_tokens / ttft_s /
+        total_s / new_tokens / tokens_per_s / cancelled
+      - stop_event: 可选 threading.Event，置位后生成在下一步停止
+      - scheduler: 可选 GenerationScheduler；给定时请求交由其连续合批生成
+    调用方提前关闭生成器（如客户端断开、Streamlit 重跑脚本）时同样会停止生成。
+    """
+    stats = {} if stats is None else stats
+    if not context_docs:
+        yield NO_CONTEXT_ANSWER
+        return
+    if not gen_model or not tokenizer:
+        log.error("Generation model or tokenizer not available.")
+        yield "Error: Generation components not loaded."
+        return
+
+    stop_event = stop_event or threading.Event()
+    errors = []
     try:
-        inputs = tokenizer(prompt, return_tensors="pt").to(gen_model.device)
-        with torch.no_grad():
-            outputs = gen_model.generate(
-                **inputs,
-                max_new_tokens=MAX_NEW_TOKENS_GEN,
-                temperature=TEMPERATURE,
-                top_p=TOP_P,
-                repetition_penalty=REPETITION_PENALTY,
-                pad_token_id=tokenizer.eos_token_id # Important for open-end generation
-            )
-        # Decode only the newly generated tokens, excluding the prompt
-        response = tokenizer.decode(outputs[0][inputs['input_ids'].shape[1]:], skip_special_tokens=True)
-        return response.strip()
+        # prompt_build 含上下文装箱与分词；直接生成时还包含前缀 KV 的预填充（prefix_prefill），
+        # 后者属于 prefill，计入 ttft_s 与 prefill 直方图
+        with span("prompt_build", path="scheduler" if scheduler is not None else "direct"):
+            # 按 token 预算装入上下文，prefill 开销与请求内容无关地保持在上限以内
+            context_docs, stats["context_tokens"] = pack_context(context_docs, tokenizer)
+            stats["context_docs"] = len(context_docs)
+            if scheduler is not None:
+                # 调度器同样从前缀 KV 缓存取 header+context，只预填充问题部分
+                segments = tokenize_prompt_parts(query, context_docs, tokenizer)
+                request = scheduler.submit([i for seg in segments for i in seg], prefix_segments=segments[:2])
+            else:
+                start = time.perf_counter()
+                inputs = _prepare_inputs(query, context_docs, gen_model, tokenizer, stats)
+                streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+                monitor = _GenerationMonitor(inputs['input_ids'].shape[1], stop_event)
     except Exception as e:
-        st.error(f"Error during text generation: {e}")
-        return "Sorry, I encountered an error while generating the answer." 
\ No newline at end of file
+        log.error(f"Error during text generation: {e}")
+        yield GENERATION_ERROR_ANSWER
+        return
+
+    if scheduler is not None:
+        yield from _stream_from_scheduler(request, stats, stop_event)
+        return
+
+    def _worker():
+        try:
+            with torch.no_grad():
+                gen_model.generate(
+                    **inputs,
+                    max_new_tokens=MAX_NEW_TOKENS_GEN,
+                    temperature=TEMPERATURE,
+                    top_p=TOP_P,
+                    repetition_penalty=REPETITION_PENALTY,
+                    pad_token_id=tokenizer.eos_token_id, # Important for open-end generation
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([monitor])
+                )
+        except Exception as e:
+            errors.append(e)
+            streamer.end()  # 让消费端的迭代正常结束
+
+    worker = threading.Thread(target=_worker, name="generate-answer", daemon=True)
+    worker.start()
+    finished = False
+    try:
+        for text in streamer:
+            if not text:
+                continue
+            if "ttft_s" not in stats:
+                stats["ttft_s"] = time.perf_counter() - start
+            yield text
+        finished = True
+    finally:
+        # 正常结束时无副作用；生成器被提前关闭时通知后台线程停止
+        stats["cancelled"] = not finished or stop_event.is_set()
+        stop_event.set()
+        worker.join()
+        stats["total_s"] = time.perf_counter() - start
+        stats["new_tokens"] = monitor.new_tokens
+        stats["tokens_per_s"] = monitor.new_tokens / stats["total_s"] if stats["total_s"] else 0.0
+        # prefill：前缀 KV 预填充开始到首个 token；decode：其后直至结束
+        if "ttft_s" in stats:
+            observe("prefill", stats["ttft_s"], path="direct")
+            observe("decode", stats["total_s"] - stats["ttft_s"], path="direct")
+        count("rag_generated_tokens_total", monitor.new_tokens, path="direct",
+              help="Tokens generated, by generation path.")
+
+    if errors:
+        log.error(f"Error during text generation: {errors[0]}")
+        yield GENERATION_ERROR_ANSWER
+
+
+def generate_answer(query, context_docs, gen_model, tokenizer):
+    """Generates an answer using the LLM based on query and context."""
+    return "".join(generate_answer_stream(query, context_docs, gen_model, tokenizer)).strip()
@@ -1,13 +1,164 @@
-import streamlit as st
-from sentence_transformers import CrossEncoder
+import hashlib
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from config import (
+    RERANK_MODEL_NAME, RERANK_MAX_LENGTH, RERANK_BACKEND, RERANK_CHARS_PER_TOKEN,
+    RERANK_MAX_BATCH_SIZE, RERANK_MAX_WAIT_MS,
+    RERANK_CACHE_MAX_ENTRIES, RERANK_CACHE_TTL_SECONDS
+)
+from data_utils import content_hash
+from metrics import span, count
+from models import resolve_backend, quantize_int8, load_with_fallback
+from query_cache import TTLLRUCache
+from runtime import cache_resource
+
+# (模型, 查询哈希, 文档 ID, 段落哈希) -> cross-encoder 分数；
+# 段落哈希保证文档被重新导入、内容变化后不会命中旧分数
+rerank_score_cache = TTLLRUCache(RERANK_CACHE_MAX_ENTRIES, RERANK_CACHE_TTL_SECONDS)
 
 # 缓存加载 cross-encoder 模型
-@st.cache_resource
-def load_reranker(model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"):
+@cache_resource
+def load_reranker(model_name: str = RERANK_MODEL_NAME, max_length: int = RERANK_MAX_LENGTH,
+                  backend: str = RERANK_BACKEND):
+    """
+    加载用于 reranking 的 CrossEncoder，输入超过 max_length 个 token 时截断。
+    backend 取值同 models.SUPPORTED_BACKENDS。
     """
-    加载用于 reranking 的 CrossEncoder。
+    import torch
+    from sentence_transformers import CrossEncoder
+
+    def _load(backend):
+        if backend == "onnx":
+            return CrossEncoder(model_name, max_length=max_length, backend="onnx")
+        reranker = CrossEncoder(model_name, max_length=max_length)
+        if backend == "int8":
+            quantize_int8(reranker.model)
+        elif backend == "bf16":
+            reranker.model.to(torch.bfloat16)
+        return reranker
+
+    return load_with_fallback(_load, resolve_backend(backend))
+
+
+class RerankBatcher:
     """
-    return CrossEncoder(model_name)
+    把多个并发请求的 (query, passage) 对合并成一次 CrossEncoder.predict：
+    后台线程取到第一个请求后，最多再等待 max_wait_ms 或凑满 max_batch_size 对再统一推理。
+    """
+
+    def __init__(self, reranker, max_batch_size: int = RERANK_MAX_BATCH_SIZE,
+                 max_wait_ms: float = RERANK_MAX_WAIT_MS):
+        self.reranker = reranker
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+        self._thread.start()
+
+    def predict(self, pairs) -> np.ndarray:
+        """提交一组 pair 并阻塞等待对应的分数。"""
+        if not pairs:
+            return np.zeros(0, dtype=np.float32)
+        future = Future()
+        self._queue.put((list(pairs), future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            n_pairs = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while n_pairs < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                n_pairs += len(item[0])
+
+            all_pairs = [pair for pairs, _ in batch for pair in pairs]
+            count("rag_rerank_batches_total", help="CrossEncoder.predict calls made by the batcher.")
+            count("rag_rerank_pairs_total", len(all_pairs), help="(query, passage) pairs scored by the cross-encoder.")
+            try:
+                with span("rerank_predict"):
+                    scores = np.asarray(
+                        self.reranker.predict(all_pairs, batch_size=self.max_batch_size)
+                    ).reshape(-1)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for pairs, future in batch:
+                future.set_result(scores[offset:offset + len(pairs)])
+                offset += len(pairs)
+
+
+def reranker_id(reranker) -> str:
+    """
+    模型标识：名称 + 实际后端 + 截断长度，作为分数缓存与 batcher 的键。
+    后端取 load_with_fallback 记录的回退后的值：同一模型的 torch 与 int8 实例分数不同，不能共用。
+    """
+    name = getattr(reranker, "model_name", None) or getattr(
+        getattr(reranker, "config", None), "_name_or_path", None) or type(reranker).__name__
+    backend = getattr(reranker, "inference_backend", "torch")
+    max_length = getattr(reranker, "max_length", None) or RERANK_MAX_LENGTH
+    return f"{name}@{backend}@{max_length}"
+
+
+@cache_resource
+def get_rerank_batcher(_reranker, model_id: str):
+    """Returns the process-wide batcher shared by all sessions for the given reranker, keyed on model_id."""
+    return RerankBatcher(_reranker)
+
+
+def truncate_passage(text: str, max_length: int = RERANK_MAX_LENGTH) -> str:
+    """
+    在分词前按字符数粗截断：max_length 个 token 至多对应 max_length * RERANK_CHARS_PER_TOKEN 个字符，
+    窗口内的内容不会丢失，但超长摘要不会再拖慢整批的分词与 padding。
+    """
+    return text[:max_length * RERANK_CHARS_PER_TOKEN]
+
+
+def rerank_with_scores(query: str, docs: list[dict], reranker) -> tuple[list[dict], list[float]]:
+    """
+    对第一阶段检索出的 docs 进一步 rerank，并返回分数。
+    已计算过的 (查询, 文档) 分数直接取缓存，其余 pair 交给 RerankBatcher 合批推理。
+    Returns:
+      - (排序后的 docs, 对应的分数)，相关度最高的在前
+    """
+    if not docs:
+        return [], []
+    with span("rerank"):
+        model_id = reranker_id(reranker)
+        query_key = content_hash(query)
+        max_length = getattr(reranker, "max_length", None) or RERANK_MAX_LENGTH
+        passages = [truncate_passage(doc["abstract"], max_length) for doc in docs]
+        keys = [(model_id, query_key, doc.get("id"), content_hash(passage))
+                for doc, passage in zip(docs, passages)]
+        scores = [rerank_score_cache.get(k) for k in keys]
+        missing = [i for i, s in enumerate(scores) if s is None]
+        count("rag_cache_requests_total", len(keys) - len(missing), cache="rerank_score", result="hit")
+        count("rag_cache_requests_total", len(missing), cache="rerank_score", result="miss")
+        if missing:
+            # 构建 (query, 文档段落) 对
+            pairs = [(query, passages[i]) for i in missing]
+            fresh = get_rerank_batcher(reranker, model_id).predict(pairs)
+            for i, score in zip(missing, fresh):
+                scores[i] = float(score)
+                rerank_score_cache.put(keys[i], scores[i])
+        # 按分数降序排序
+        ranked = sorted(zip(scores, range(len(docs))), key=lambda x: x[0], reverse=True)
+        return [docs[i] for _, i in ranked], [s for s, _ in ranked]
+
 
 def rerank_documents(query: str, docs: list[dict], reranker) -> list[dict]:
     """
@@ -19,11 +170,4 @@ def rerank_documents(query: str, docs: list[dict], reranker) -> list[dict]:
     Returns:
       - 排序后的 docs 列表（相关度最高的在前）
     """
-    # 构建 (query, 文档段落) 对
-    pairs = [(query, doc["abstract"]) for doc in docs]
-    # 得到每个 pair 的相关度分数
-    scores = reranker.predict(pairs)
-    # 按分数降序排序
-    ranked = sorted(zip(scores, docs), key=lambda x: x[0], reverse=True)
-    # 返回排序后的文档
-    return [doc for _, doc in ranked]
+    return rerank_with_scores(query, docs, reranker)[0]
@@ -0,0 +1,141 @@
+import numpy as np
+
+from config import (
+    TOP_K, GRAPH_HOPS, GRAPH_TOP_K_PER_NODE, GRAPH_MIN_WEIGHT, GRAPH_CANDIDATE_BUDGET,
+    HYBRID_LEXICAL_TOP_K, HYBRID_RRF_K, HYBRID_CANDIDATE_BUDGET
+)
+from embedding_cache import get_embedding_cache
+from metrics import span
+from milvus_utils import embed_queries, search_many
+
+
+def _cosine_scores(query_vec, doc_vecs):
+    q = query_vec / max(np.linalg.norm(query_vec), 1e-12)
+    d = doc_vecs / np.maximum(np.linalg.norm(doc_vecs, axis=1, keepdims=True), 1e-12)
+    return d @ q
+
+
+def vector_search(client, query, embedding_model, doc_store, top_k=TOP_K):
+    """
+    纯向量检索，与 graph_augmented_search 返回相同的结构，便于对比两种模式的延迟。
+    Returns:
+      - docs: 命中的文档（按 Milvus 距离升序）
+      - scores: 对应的 Milvus 距离
+      - timings: {阶段: 毫秒}
+    """
+    timings = {}
+    with span("query_embedding", timings, mode="vector"):
+        query_vecs = embed_queries([query], embedding_model)
+
+    with span("vector_search", timings, mode="vector"):
+        ids, dists = search_many(client, [query], embedding_model, top_k, query_embeddings=query_vecs)[0]
+
+    with span("doc_lookup", timings, mode="vector"):
+        docs = doc_store.get_docs(ids)
+        distance_by_id = dict(zip(ids, dists))
+    return docs, [distance_by_id[doc['id']] for doc in docs], timings
+
+
+def graph_augmented_search(client, query, embedding_model, doc_store, graph,
+                           top_k=TOP_K, hops=GRAPH_HOPS,
+                           top_k_per_node=GRAPH_TOP_K_PER_NODE,
+                           min_weight=GRAPH_MIN_WEIGHT,
+                           budget=GRAPH_CANDIDATE_BUDGET):
+    """
+    图扩展检索：以 Milvus 的 top_k 命中为种子，沿相似度图逐跳扩展，
+    候选总数（含种子）不超过 budget；再用缓存的文档向量与查询向量计算余弦相似度排序，
+    不额外请求 Milvus。结果交给 rerank 阶段。
+    Returns:
+      - docs: 候选文档（按与查询的余弦相似度降序）
+      - scores: 对应的余弦相似度
+      - timings: {阶段: 毫秒}
+    """
+    timings = {}
+    with span("query_embedding", timings, mode="graph"):
+        query_vecs = embed_queries([query], embedding_model)
+
+    with span("vector_search", timings, mode="graph"):
+        seed_ids, _ = search_many(client, [query], embedding_model, top_k, query_embeddings=query_vecs)[0]
+
+    with span("graph_expand", timings, mode="graph"):
+        candidates = expand_seeds(graph, seed_ids, hops, top_k_per_node, min_weight, budget)
+
+    with span("doc_lookup", timings, mode="graph"):
+        docs = doc_store.get_docs(candidates)
+
+    with span("candidate_scoring", timings, mode="graph"):
+        docs, scores = rank_by_similarity(query_vecs[0], docs, embedding_model)
+    return docs, scores, timings
+
+
+def expand_seeds(graph, seed_ids, hops=GRAPH_HOPS, top_k_per_node=GRAPH_TOP_K_PER_NODE,
+                 min_weight=GRAPH_MIN_WEIGHT, budget=GRAPH_CANDIDATE_BUDGET):
+    """
+    沿相似度图逐跳扩展种子：近的跳数优先占用预算，同一跳内按边权从高到低取，直到用完预算。
+    返回候选 ID（含种子）。
+    """
+    candidates = list(dict.fromkeys(seed_ids))[:budget]
+    seen = set(candidates)
+    frontier = candidates
+    for _ in range(hops):
+        if len(candidates) >= budget or not frontier:
+            break
+        reached = graph.expand(frontier, 1, min_weight, top_k_per_node)
+        frontier = [int(i) for i in reached if int(i) not in seen][:budget - len(candidates)]
+        seen.update(frontier)
+        candidates.extend(frontier)
+    return candidates
+
+
+def rank_by_similarity(query_vec, docs, embedding_model):
+    """用缓存的文档向量与查询向量的余弦相似度给候选排序，返回 (docs, scores)，降序。"""
+    if not docs:
+        return [], []
+    doc_vecs = get_embedding_cache().encode([doc['content'] for doc in docs], embedding_model)
+    scores = _cosine_scores(query_vec, doc_vecs)
+    order = np.argsort(-scores)
+    return [docs[i] for i in order], [float(scores[i]) for i in order]
+
+
+def reciprocal_rank_fusion(rankings, k: int = HYBRID_RRF_K):
+    """
+    RRF：score(d) = Σ 1 / (k + rank_i(d))，rank 从 1 开始；只用名次，
+    不需要把 L2 距离与 BM25 分数归一到同一尺度。
+    Returns:
+      - [(doc_id, score)]，按分数降序
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+def hybrid_search(client, query, embedding_model, doc_store, lexical_index,
+                  top_k=TOP_K, lexical_top_k=HYBRID_LEXICAL_TOP_K,
+                  rrf_k=HYBRID_RRF_K, budget=HYBRID_CANDIDATE_BUDGET):
+    """
+    混合检索：Milvus 仍只取 top_k，另用 BM25 倒排索引取 lexical_top_k 个词面命中
+    （药名、术语等精确匹配），两路按 RRF 融合后取前 budget 个候选交给 rerank。
+    Returns:
+      - docs: 候选文档（按 RRF 分数降序）
+      - scores: 对应的 RRF 分数
+      - timings: {阶段: 毫秒}
+    """
+    timings = {}
+    with span("query_embedding", timings, mode="hybrid"):
+        query_vecs = embed_queries([query], embedding_model)
+
+    with span("vector_search", timings, mode="hybrid"):
+        dense_ids, _ = search_many(client, [query], embedding_model, top_k, query_embeddings=query_vecs)[0]
+
+    with span("lexical_search", timings, mode="hybrid"):
+        lexical_ids, _ = lexical_index.search(query, lexical_top_k)
+
+    with span("fusion", timings, mode="hybrid"):
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids], rrf_k)[:budget]
+
+    with span("doc_lookup", timings, mode="hybrid"):
+        docs = doc_store.get_docs([doc_id for doc_id, _ in fused])
+        score_by_id = dict(fused)
+    return docs, [score_by_id[doc['id']] for doc in docs], timings
@@ -0,0 +1,199 @@
+"""
+核心模块的运行时适配层：资源缓存与日志，不依赖 Streamlit。
+  - cache_resource：进程级的资源缓存（模型、客户端、索引），语义同 st.cache_resource，
+    以下划线开头的参数不参与缓存键；
+  - atomic_dir / dir_lock：整目录持久化的索引（相似度图、BM25）先写临时目录再改名替换；
+  - log：在 Streamlit 脚本线程中调用时转发到 st.write / st.warning / ...，
+    其余情况（preprocess、server 工作线程、离线脚本）写入 logging。
+核心模块只依赖本模块，批处理与服务进程无需导入 streamlit。
+"""
+import functools
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import shutil
+import sys
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：只做进程内互斥
+    fcntl = None
+
+logger = logging.getLogger("rag")
+
+_cached_functions = []
+
+
+def _arg_key(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        # dict / list / ndarray 等不可哈希参数按内容取摘要
+        return hashlib.md5(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+
+def cache_resource(func=None, *, latest_per=None):
+    """
+    按参数缓存函数返回值，整个进程共享一份。
+    同一参数的并发首次调用只会执行一次，其余调用等待其结果；
+    抛出异常时不缓存。func.clear() 清空该函数的缓存。
+    latest_per 为参数名元组时，这些参数取值相同的缓存项只保留最新一份
+    （如按索引版本缓存的图：同一路径换入新版本后旧版本即被释放）。
+    """
+    if func is None:
+        return functools.partial(cache_resource, latest_per=latest_per)
+    signature = inspect.signature(func)
+    cache = {}
+    locks = {}
+    guard = threading.Lock()
+
+    def make_key(args, kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return tuple((name, _arg_key(value)) for name, value in bound.arguments.items()
+                     if not name.startswith("_"))
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = make_key(args, kwargs)
+        with guard:
+            if key in cache:
+                return cache[key]
+            lock = locks.setdefault(key, threading.Lock())
+        with lock:
+            with guard:
+                if key in cache:
+                    return cache[key]
+            value = func(*args, **kwargs)
+            with guard:
+                if latest_per:
+                    group = [dict(key).get(name) for name in latest_per]
+                    for other in [k for k in cache if [dict(k).get(name) for name in latest_per] == group]:
+                        del cache[other]
+                cache[key] = value
+                locks.pop(key, None)
+            return value
+
+    def clear():
+        with guard:
+            cache.clear()
+
+    wrapper.clear = clear
+    _cached_functions.append(wrapper)
+    return wrapper
+
+
+@contextmanager
+def dir_lock(path, exclusive=False):
+    """目录 path 旁的文件锁：读取整个目录时持共享锁，替换目录时持排他锁，跨进程互斥。"""
+    path = os.path.normpath(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+@contextmanager
+def atomic_dir(path):
+    """
+    原子地替换目录 path：调用方写入产出的临时目录，成功后在排他锁内换入，失败时删除临时目录。
+    已 mmap 旧文件的读者继续读旧文件，不会遇到截断；并发重建的进程各写各的临时目录，依次换入。
+    """
+    path = os.path.normpath(path)
+    suffix = f"{os.getpid()}-{threading.get_ident()}"
+    tmp_path, old_path = f"{path}.tmp-{suffix}", f"{path}.old-{suffix}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        yield tmp_path
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    # 目录不能原子覆盖：旧目录先移开再换入新目录
+    with dir_lock(path, exclusive=True):
+        if os.path.isdir(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def clear_resource_caches():
+    """清空所有 cache_resource 缓存（测试或热更新模型时使用）。"""
+    for func in _cached_functions:
+        func.clear()
+
+
+def _streamlit():
+    """当前线程处于 Streamlit 脚本运行上下文时返回 streamlit 模块，否则返回 None。"""
+    if "streamlit" not in sys.modules:
+        return None
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        if get_script_run_ctx(suppress_warning=True) is None:
+            return None
+    except Exception:
+        return None
+    return sys.modules["streamlit"]
+
+
+class _Log:
+    """st.write / st.success / st.warning / st.error / st.spinner 的无头替代。"""
+
+    def write(self, message):
+        st = _streamlit()
+        if st is not None:
+            st.write(message)
+        logger.info(message)
+
+    info = write
+
+    def success(self, message):
+        st = _streamlit()
+        if st is not None:
+            st.success(message)
+        logger.info(message)
+
+    def warning(self, message):
+        st = _streamlit()
+        if st is not None:
+            st.warning(message)
+        logger.warning(message)
+
+    def error(self, message):
+        st = _streamlit()
+        if st is not None:
+            st.error(message)
+        logger.error(message)
+
+    @contextmanager
+    def spinner(self, message):
+        st = _streamlit()
+        if st is None:
+            logger.info(message)
+            yield
+            return
+        with st.spinner(message):
+            yield
+
+
+log = _Log()
+
+
+def configure_logging(level=logging.INFO):
+    """
+    命令行入口调用：把 rag 日志输出到 stderr，不改动其他库的日志配置。
+    已配置过时不做任何改动（如 bench 在调用 preprocess.main 之前已设定级别）。
+    """
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+    logger.setLevel(level)
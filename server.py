@@ -0,0 +1,344 @@
+"""
+RAG 服务层：在 milvus_utils / retrieval / rerank_utils / rag_core 之上提供 HTTP 接口，
+与 Streamlit 脚本解耦，可多实例水平扩展、单独压测。
+  - POST /search  检索（vector / graph / hybrid）
+  - POST /rerank  cross-encoder 重排
+  - POST /answer  流式生成（NDJSON：context / token / done / error 事件）
+  - GET  /health
+  - GET  /metrics  Prometheus 文本格式的阶段耗时直方图与吞吐计数器
+阻塞的模型调用在有界线程池中执行；每个接口的并发上限由信号量控制，
+等不到空位时返回 503（背压），超时返回 504。
+用法：python server.py --host 0.0.0.0 --port 8000
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel
+
+from config import (
+    TOP_K, EMBEDDING_MODEL_NAME, GENERATION_MODEL_NAME, GENERATION_SCHEDULER_ENABLED,
+    API_HOST, API_PORT, API_SEARCH_WORKERS, API_RERANK_WORKERS, API_GENERATION_WORKERS,
+    API_MAX_CONCURRENT_SEARCH, API_MAX_CONCURRENT_RERANK, API_MAX_CONCURRENT_ANSWER,
+    API_QUEUE_TIMEOUT_S, API_REQUEST_TIMEOUT_S, API_ANSWER_TIMEOUT_S
+)
+from metrics import span, count, trace_context, render_prometheus, stage_seconds
+from runtime import configure_logging, log
+
+RETRIEVAL_MODES = ("vector", "graph", "hybrid")
+
+
+class SearchRequest(BaseModel):
+    query: str
+    mode: str = "vector"
+    top_k: int = TOP_K
+
+
+class RerankRequest(BaseModel):
+    query: str
+    docs: list[dict]
+
+
+class AnswerRequest(BaseModel):
+    query: str
+    # 给定时直接作为上下文；否则服务端按 mode 检索并 rerank，取前 top_k 个
+    docs: list[dict] | None = None
+    mode: str = "vector"
+    top_k: int = TOP_K
+
+
+class _Limiter:
+    """接口级并发上限：在 queue_timeout 内拿不到空位即返回 503，而不是无限排队。"""
+
+    def __init__(self, name, max_concurrent, queue_timeout=API_QUEUE_TIMEOUT_S):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._sem = asyncio.Semaphore(max_concurrent)
+        self.rejected = 0
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            count("rag_api_rejected_total", endpoint=self.name, help="Requests rejected with 503 by backpressure.")
+            raise HTTPException(status_code=503, detail=f"{self.name} is overloaded, retry later",
+                                headers={"Retry-After": "1"})
+
+    def release(self):
+        self._sem.release()
+
+    def once(self):
+        """返回只释放一次的回调，流式响应的多条结束路径可以都调用它。"""
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self.release()
+        return release
+
+    def stats(self):
+        return {
+            "in_flight": self.max_concurrent - self._sem._value,
+            "max_concurrent": self.max_concurrent,
+            "rejected": self.rejected,
+        }
+
+
+class _Resources:
+    """进程内共享的模型与索引；图与 BM25 索引在首次使用对应检索模式时加载。"""
+
+    def __init__(self):
+        from doc_store import get_doc_store
+        from milvus_utils import get_milvus_client, setup_milvus_collection
+        from models import load_embedding_model, load_generation_model, is_torch_model
+        from rerank_utils import load_reranker
+        from generation_server import get_generation_scheduler
+
+        self.client = get_milvus_client()
+        if not self.client or not setup_milvus_collection(self.client):
+            raise RuntimeError("Milvus collection is not available.")
+        self.doc_store = get_doc_store()
+        self.embedding_model = load_embedding_model(EMBEDDING_MODEL_NAME)
+        self.reranker = load_reranker()
+        self.generation_model, self.tokenizer = load_generation_model(GENERATION_MODEL_NAME)
+        if not self.embedding_model or not self.generation_model:
+            raise RuntimeError("Failed to load models.")
+        self.scheduler = (get_generation_scheduler(self.generation_model, self.tokenizer)
+                          if GENERATION_SCHEDULER_ENABLED and is_torch_model(self.generation_model)
+                          else None)
+        self._lock = threading.Lock()
+
+    def graph(self):
+        from graph_utils import load_or_build_graph
+        from query_cache import get_index_version
+        with self._lock:
+            return load_or_build_graph(self.doc_store, self.embedding_model, get_index_version())
+
+    def lexical_index(self):
+        from lexical_index import load_or_build_lexical_index
+        from query_cache import get_index_version
+        with self._lock:
+            return load_or_build_lexical_index(self.doc_store, get_index_version())
+
+    def retrieve(self, query, mode="vector", top_k=TOP_K):
+        """按模式检索，返回 (docs, scores, timings)。"""
+        from retrieval import vector_search, graph_augmented_search, hybrid_search
+        if mode == "graph":
+            return graph_augmented_search(self.client, query, self.embedding_model, self.doc_store,
+                                          self.graph(), top_k=top_k)
+        if mode == "hybrid":
+            return hybrid_search(self.client, query, self.embedding_model, self.doc_store,
+                                 self.lexical_index(), top_k=top_k)
+        return vector_search(self.client, query, self.embedding_model, self.doc_store, top_k)
+
+    def rerank(self, query, docs):
+        from rerank_utils import rerank_with_scores
+        return rerank_with_scores(query, docs, self.reranker)
+
+
+resources = None
+pools = {}
+limiters = {}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global resources
+    pools.update(
+        search=ThreadPoolExecutor(API_SEARCH_WORKERS, thread_name_prefix="api-search"),
+        rerank=ThreadPoolExecutor(API_RERANK_WORKERS, thread_name_prefix="api-rerank"),
+        generation=ThreadPoolExecutor(API_GENERATION_WORKERS, thread_name_prefix="api-generate"),
+    )
+    limiters.update(
+        search=_Limiter("search", API_MAX_CONCURRENT_SEARCH),
+        rerank=_Limiter("rerank", API_MAX_CONCURRENT_RERANK),
+        answer=_Limiter("answer", API_MAX_CONCURRENT_ANSWER),
+    )
+    resources = await asyncio.get_running_loop().run_in_executor(pools["search"], _Resources)
+    yield
+    if resources.scheduler is not None:
+        resources.scheduler.shutdown()
+    for pool in pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="Medical RAG API", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def _trace_requests(request: Request, call_next):
+    """每个请求一个 trace ID（可由 X-Trace-Id 请求头指定），随响应头返回并写入 JSONL 追踪。"""
+    with trace_context(request.headers.get("x-trace-id")) as trace_id:
+        with span("http_request", endpoint=request.url.path):
+            response = await call_next(request)
+        count("rag_api_requests_total", endpoint=request.url.path, status=response.status_code,
+              help="HTTP requests by endpoint and status code.")
+        response.headers["X-Trace-Id"] = trace_id
+        return response
+
+
+def _in_pool(pool_name, fn, *args, **kwargs):
+    """提交到线程池，并带上当前上下文（trace ID），线程中的 span 归属于本请求。"""
+    ctx = contextvars.copy_context()
+    return asyncio.get_running_loop().run_in_executor(pools[pool_name], ctx.run, partial(fn, *args, **kwargs))
+
+
+async def _run(pool_name, fn, *args, timeout=API_REQUEST_TIMEOUT_S, **kwargs):
+    """在有界线程池中执行阻塞调用；超时返回 504（已开始的计算会在后台跑完）。"""
+    try:
+        return await asyncio.wait_for(_in_pool(pool_name, fn, *args, **kwargs), timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail=f"{pool_name} timed out after {timeout}s")
+
+
+def _check_mode(mode):
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=422, detail=f"mode must be one of {RETRIEVAL_MODES}")
+
+
+def _event(kind, **payload):
+    return json.dumps({"event": kind, **payload}, ensure_ascii=False) + "\n"
+
+
+@app.get("/health")
+async def health():
+    from query_cache import cache_stats
+    return {
+        "status": "ok",
+        "limits": {name: limiter.stats() for name, limiter in limiters.items()},
+        "scheduler": resources.scheduler.stats() if resources and resources.scheduler else None,
+        "caches": cache_stats(),
+        "stages": stage_seconds.summary(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/search")
+async def search(req: SearchRequest):
+    _check_mode(req.mode)
+    await limiters["search"].acquire()
+    try:
+        docs, scores, timings = await _run("search", resources.retrieve, req.query, req.mode, req.top_k)
+    finally:
+        limiters["search"].release()
+    return {"docs": docs, "scores": [float(s) for s in scores], "timings": timings}
+
+
+@app.post("/rerank")
+async def rerank(req: RerankRequest):
+    await limiters["rerank"].acquire()
+    try:
+        docs, scores = await _run("rerank", resources.rerank, req.query, req.docs)
+    finally:
+        limiters["rerank"].release()
+    return {"docs": docs, "scores": scores}
+
+
+def _close_quietly(gen):
+    try:
+        gen.close()
+    except ValueError:
+        pass  # next() 仍在另一个线程中执行；stop_event 已置位，生成会自行结束
+
+
+async def _answer_events(req: AnswerRequest, release):
+    """把同步的 generate_answer_stream 搬到线程池中逐段拉取，客户端断开时停止生成。"""
+    from rag_core import generate_answer_stream
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + API_ANSWER_TIMEOUT_S
+    stop_event = threading.Event()
+    stats = {}
+    gen = None
+    try:
+        docs = req.docs
+        if docs is None:
+            docs, _, _ = await _run("search", resources.retrieve, req.query, req.mode, req.top_k)
+            docs, _ = await _run("rerank", resources.rerank, req.query, docs)
+            docs = docs[:req.top_k]
+            yield _event("context", docs=docs)
+
+        gen = generate_answer_stream(req.query, docs, resources.generation_model, resources.tokenizer,
+                                     stats=stats, stop_event=stop_event, scheduler=resources.scheduler)
+        while True:
+            try:
+                text = await asyncio.wait_for(_in_pool("generation", next, gen, None),
+                                              max(deadline - loop.time(), 0.0))
+            except asyncio.TimeoutError:
+                yield _event("error", detail=f"answer timed out after {API_ANSWER_TIMEOUT_S}s")
+                return
+            if text is None:
+                break
+            yield _event("token", text=text)
+        yield _event("done", stats=stats)
+    except HTTPException as e:
+        yield _event("error", detail=e.detail)
+    except Exception as e:
+        log.error(f"/answer failed: {e}")
+        count("rag_errors_total", stage="answer", help="Errors swallowed by pipeline stages.")
+        yield _event("error", detail=str(e))
+    finally:
+        stop_event.set()
+        if gen is not None:
+            pools["generation"].submit(_close_quietly, gen)
+        release()
+
+
+class _SlotResponse(StreamingResponse):
+    """发送结束（正常完成、出错或客户端断开）后调用 release，释放接口的并发空位。"""
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+@app.post("/answer")
+async def answer(req: AnswerRequest):
+    if req.docs is None:
+        _check_mode(req.mode)
+    limiter = limiters["answer"]
+    await limiter.acquire()
+    # 空位在流结束（或客户端断开）时才释放；body 一次都没迭代时（响应开始前断开、发送响应头失败）
+    # 生成器的 finally 不会执行，由 _SlotResponse 兜底
+    release = limiter.once()
+    try:
+        return _SlotResponse(_answer_events(req, release), release, media_type="application/x-ndjson")
+    except BaseException:
+        release()
+        raise
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the RAG pipeline over HTTP.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args(argv)
+    configure_logging()
+    # 单进程：模型与调度器在进程内共享，扩容通过多实例 + 负载均衡
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()